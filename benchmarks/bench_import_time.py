@@ -0,0 +1,155 @@
+"""
+Import time benchmark.
+
+Measures how long the command line interface takes to import, using the interpreter's -X importtime output, and the
+wall time of `pypianalyser --help`. Each measurement runs in a fresh interpreter and the fastest of several runs is
+reported, as startup time is noisy.
+
+Heavy dependencies (requests, lxml, numpy, pyarrow, distutils, sqlite3worker, multiprocessing) should only be imported
+by the commands that use them. The benchmark fails if any of them is imported at startup, or if the import time is over
+--max_ms, so it can be run in CI to stop startup time from regressing.
+
+Example:
+    python benchmarks/bench_import_time.py --repeat 10 --max_ms 150
+"""
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+logger = logging.getLogger(__file__)
+
+DEFAULT_MODULE = 'pypianalyser.cli'
+DEFAULT_FORBIDDEN_MODULES = ['requests', 'lxml', 'numpy', 'pyarrow', 'distutils', 'sqlite3worker', 'multiprocessing']
+TOP_MODULE_COUNT = 15
+
+
+def parse_importtime(output):
+    """
+    Parses the output of -X importtime
+
+    :param output: stderr of the interpreter
+    :type output: str
+
+    :return: (module name, self microseconds, cumulative microseconds) of every import, in the order they finished
+    :rtype: list
+    """
+    ret_val = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = [x.strip() for x in line[len('import time:'):].split('|')]
+        if len(parts) != 3 or not parts[0].isdigit():
+            # The header line
+            continue
+        ret_val.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return ret_val
+
+
+def measure_import(module_name):
+    """
+    Imports a module in a fresh interpreter with -X importtime
+
+    :param module_name: Module to import
+    :type module_name: str
+
+    :return: Imports as returned by parse_importtime()
+    :rtype: list
+    """
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module_name)],
+                               cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    if process.returncode:
+        raise Exception('Failed to import {}: {}'.format(module_name, stderr.decode('utf-8', 'replace')))
+    return parse_importtime(stderr.decode('utf-8', 'replace'))
+
+
+def measure_help():
+    """
+    Times `pypianalyser --help` in a fresh interpreter
+
+    :return: Wall time in seconds
+    :rtype: float
+    """
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', 'import pypianalyser; pypianalyser.main(["--help"])'], cwd=ROOT_DIR,
+                          stdout=subprocess.PIPE)
+    return time.time() - start
+
+
+def run_benchmark(module_name=DEFAULT_MODULE, repeat=5, forbidden_modules=None):
+    """
+    Measures the import time of a module and the startup time of the CLI
+
+    :return: Benchmark results
+    :rtype: dict
+    """
+    forbidden_modules = DEFAULT_FORBIDDEN_MODULES if forbidden_modules is None else forbidden_modules
+    best_imports = None
+    best_total = None
+    for _ in range(repeat):
+        imports = measure_import(module_name)
+        total = sum(x[2] for x in imports if x[0] == module_name)
+        if best_total is None or total < best_total:
+            best_total, best_imports = total, imports
+    help_seconds = min(measure_help() for _ in range(repeat))
+
+    imported = set(x[0] for x in best_imports)
+    forbidden_imported = sorted(x for x in forbidden_modules if x in imported)
+    top_modules = sorted(best_imports, key=lambda x: x[1], reverse=True)[:TOP_MODULE_COUNT]
+    return {
+        'module': module_name,
+        'repeat': repeat,
+        'import_ms': round(best_total / 1000.0, 1),
+        'help_ms': round(help_seconds * 1000, 1),
+        'modules_imported': len(imported),
+        'forbidden_modules_imported': forbidden_imported,
+        'slowest_modules_self_ms': [[x[0], round(x[1] / 1000.0, 1)] for x in top_modules],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the command line interface')
+    parser.add_argument('-m', '--module', default=DEFAULT_MODULE,
+                        help='Module to import. Default is {}'.format(DEFAULT_MODULE))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs, the fastest is reported. Default is 5')
+    parser.add_argument('--max_ms', type=float,
+                        help='Fail if importing the module takes longer than this many milliseconds')
+    parser.add_argument('--forbidden', nargs='*', default=DEFAULT_FORBIDDEN_MODULES,
+                        help='Modules that must not be imported at startup. Default is {}'
+                             .format(' '.join(DEFAULT_FORBIDDEN_MODULES)))
+    parser.add_argument('-o', '--output_file',
+                        help='Path of a JSON file to write the results to, for tracking them across runs')
+    parsed_args = parser.parse_args(argv)
+
+    results = run_benchmark(parsed_args.module, parsed_args.repeat, parsed_args.forbidden)
+    for name, value in sorted(results.items()):
+        if name != 'slowest_modules_self_ms':
+            logger.info('{}: {}'.format(name, value))
+    logger.info('Slowest modules (self ms):')
+    for name, self_ms in results['slowest_modules_self_ms']:
+        logger.info('  {:>7.1f}  {}'.format(self_ms, name))
+    if parsed_args.output_file:
+        with open(parsed_args.output_file, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    failures = []
+    if results['forbidden_modules_imported']:
+        failures.append('Imported at startup: {}'.format(', '.join(results['forbidden_modules_imported'])))
+    if parsed_args.max_ms is not None and results['import_ms'] > parsed_args.max_ms:
+        failures.append('Import took {}ms, over the limit of {}ms'.format(results['import_ms'], parsed_args.max_ms))
+    for failure in failures:
+        logger.error(failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+End to end ingest benchmark.
+
+Serves a corpus of recorded PyPi responses from a local HTTP server that stands in for pypi.org, then runs
+PyPiMetadataRetriever.run() against it and reports:
+
+- packages/sec processed
+- p50/p99 latency of fetching (and parsing) a package's metadata, per request and per package. They differ when
+  requests are hedged, a package taking as long as the first of its requests to succeed
+- rows/sec written to the database
+- peak RSS of the process running the ingest
+
+The recorded /pypi/<package>/json payloads are cloned under new names to build a corpus of the requested size. The
+server runs in a separate process so that it neither competes for the GIL nor counts towards the peak RSS, and it can
+add latency, a tail of slow responses and errors to mimic a real index.
+
+Example:
+    python benchmarks/bench_ingest.py --packages 2000 --latency_ms 20 --error_rate 0.01 --threads 8
+    python benchmarks/bench_ingest.py --latency_ms 20 --slow_rate 0.02 --slow_ms 1000 --hedge_quantile 0
+"""
+from __future__ import print_function
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from six.moves import BaseHTTPServer, socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pypianalyser import pypi_metadata_retriever  # noqa: E402
+from pypianalyser.hedging import DEFAULT_HEDGE_QUANTILE  # noqa: E402
+from pypianalyser.pypi_metadata_retriever import PyPiMetadataRetriever  # noqa: E402
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+logger = logging.getLogger(__file__)
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'resources')
+COUNTED_TABLES = ['packages', 'package_releases', 'package_classifiers']
+SIMPLE_INDEX_TEMPLATE = u'<!DOCTYPE html>\n<html>\n  <head>\n    <title>Simple index</title>\n  </head>\n  <body>\n' \
+                        u'{}\n  </body>\n</html>\n'
+SIMPLE_INDEX_LINK_TEMPLATE = u'    <a href="/simple/{0}/">{0}</a>'
+
+
+def load_corpus(corpus_dir, package_count):
+    """
+    Loads the recorded metadata payloads from a directory and clones them until there are package_count packages
+
+    :param corpus_dir: Directory of recorded /pypi/<package>/json responses, one .json file per package
+    :type corpus_dir: str
+    :param package_count: Number of packages to serve
+    :type package_count: int
+
+    :return: Simple index HTML and package names mapped to their encoded JSON payloads
+    :rtype: tuple
+    """
+    recorded = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.json'))):
+        with open(path, 'r') as fp:
+            metadata = json.load(fp)
+        if 'info' in metadata and 'releases' in metadata:
+            recorded.append(metadata)
+    if not recorded:
+        raise Exception('No recorded metadata payloads found in {}'.format(corpus_dir))
+
+    base_names = [x['info']['name'].lower() for x in recorded]
+    payloads = {}
+    for i in range(package_count):
+        metadata = recorded[i % len(recorded)]
+        name = '{}-{}'.format(base_names[i % len(recorded)], i)
+        metadata['info']['name'] = name
+        payloads[name] = json.dumps(metadata).encode('utf-8')
+
+    links = u'\n'.join(SIMPLE_INDEX_LINK_TEMPLATE.format(x) for x in sorted(payloads))
+    return SIMPLE_INDEX_TEMPLATE.format(links).encode('utf-8'), payloads
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _build_handler(simple_index, payloads, latency_ms, latency_jitter_ms, error_rate, seed, slow_rate=0.0,
+                   slow_ms=0.0):
+    rand = random.Random(seed)
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            delay = max(0.0, rand.gauss(latency_ms, latency_jitter_ms)) if latency_jitter_ms else latency_ms
+            if slow_rate and rand.random() < slow_rate:
+                delay += slow_ms
+            if delay:
+                time.sleep(delay / 1000.0)
+
+            parts = [x for x in self.path.split('/') if x]
+            if parts == ['simple']:
+                body = simple_index
+            elif len(parts) == 3 and parts[0] == 'pypi' and parts[2] == 'json':
+                if rand.random() < error_rate:
+                    self._respond(503, b'Service Unavailable')
+                    return
+                body = payloads.get(parts[1])
+            else:
+                body = None
+
+            if body is None:
+                self._respond(404, b'Not Found')
+            else:
+                self._respond(200, body)
+
+        def _respond(self, status, body):
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def _serve(port_queue, corpus_dir, package_count, latency_ms, latency_jitter_ms, error_rate, seed, slow_rate, slow_ms):
+    simple_index, payloads = load_corpus(corpus_dir, package_count)
+    handler = _build_handler(simple_index, payloads, latency_ms, latency_jitter_ms, error_rate, seed, slow_rate,
+                             slow_ms)
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(corpus_dir, package_count, latency_ms=0.0, latency_jitter_ms=0.0, error_rate=0.0, seed=0,
+                 slow_rate=0.0, slow_ms=0.0):
+    """
+    Starts the stand-in index in a separate process
+
+    :return: The server process and the base URL it is serving on
+    :rtype: tuple
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(port_queue, corpus_dir, package_count, latency_ms,
+                                                          latency_jitter_ms, error_rate, seed, slow_rate, slow_ms))
+    process.daemon = True
+    process.start()
+    return process, 'http://127.0.0.1:{}/'.format(port_queue.get(timeout=60))
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of a sorted list
+
+    :param sorted_values: Sorted values
+    :type sorted_values: list
+    :param fraction: Percentile as a fraction, e.g. 0.99
+    :type fraction: float
+
+    :return: Percentile value, or None if there are no values
+    :rtype: float or None
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss / 1024.0 ** 2 if sys.platform == 'darwin' else peak_rss / 1024.0
+
+
+def _count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return sum(conn.execute('SELECT COUNT(*) FROM {}'.format(x)).fetchone()[0] for x in COUNTED_TABLES)
+    finally:
+        conn.close()
+
+
+def run_benchmark(index_url, work_dir, threads, trunc_descriptions=-1, trunc_releases=-1, search_index=False,
+                  compress_descriptions=False, hedge_quantile=DEFAULT_HEDGE_QUANTILE):
+    """
+    Runs the ingest against the stand-in index and measures it
+
+    :return: Benchmark results
+    :rtype: dict
+    """
+    fetch_latencies = []
+    get_metadata_for_package = pypi_metadata_retriever.get_metadata_for_package
+
+    def timed_get_metadata_for_package(*args, **kwargs):
+        start = time.time()
+        try:
+            return get_metadata_for_package(*args, **kwargs)
+        finally:
+            # list.append is atomic so is safe to call from the download threads
+            fetch_latencies.append(time.time() - start)
+
+    package_latencies = []
+
+    def timed_download_metadata(package_name):
+        start = time.time()
+        try:
+            return download_metadata(package_name)
+        finally:
+            package_latencies.append(time.time() - start)
+
+    db_path = os.path.join(work_dir, 'bench.sqlite')
+    retriever = PyPiMetadataRetriever(trunc_descriptions, trunc_releases, threads, db_path, max_packages=None,
+                                      file_404=os.path.join(work_dir, '404.txt'), search_index=search_index,
+                                      compress_descriptions=compress_descriptions, index_url=index_url,
+                                      hedge_quantile=hedge_quantile)
+    download_metadata = retriever._download_metadata
+    retriever._download_metadata = timed_download_metadata
+    pypi_metadata_retriever.get_metadata_for_package = timed_get_metadata_for_package
+    try:
+        start = time.time()
+        retriever.calculate_package_list()
+        list_time = time.time() - start
+        package_count = len(retriever.package_list)
+        retriever.run()
+        run_time = time.time() - start - list_time
+    finally:
+        pypi_metadata_retriever.get_metadata_for_package = get_metadata_for_package
+
+    fetch_latencies.sort()
+    package_latencies.sort()
+    row_count = _count_rows(db_path)
+    return {
+        'packages': package_count,
+        'threads': threads,
+        'package_list_seconds': round(list_time, 3),
+        'run_seconds': round(run_time, 3),
+        'packages_per_second': round(package_count / run_time, 1),
+        'fetch_p50_ms': round(percentile(fetch_latencies, 0.5) * 1000, 2) if fetch_latencies else None,
+        'fetch_p99_ms': round(percentile(fetch_latencies, 0.99) * 1000, 2) if fetch_latencies else None,
+        'package_p50_ms': round(percentile(package_latencies, 0.5) * 1000, 2) if package_latencies else None,
+        'package_p99_ms': round(percentile(package_latencies, 0.99) * 1000, 2) if package_latencies else None,
+        'hedged_requests': retriever.metrics.get_counter('hedged_requests'),
+        'db_rows': row_count,
+        'db_rows_per_second': round(row_count / run_time, 1),
+        'db_size_mb': round(os.path.getsize(db_path) / 1024.0 ** 2, 2),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ingest against a local stand-in for PyPi')
+    parser.add_argument('--corpus_dir', default=DEFAULT_CORPUS_DIR,
+                        help='Directory of recorded /pypi/<package>/json responses. Default is tests/resources')
+    parser.add_argument('-p', '--packages', type=int, default=1000,
+                        help='Number of packages to serve, cloned from the recorded ones. Default is 1000')
+    parser.add_argument('-t', '--threads', type=int, default=5,
+                        help='Number of download threads. Default is 5')
+    parser.add_argument('--latency_ms', type=float, default=0.0,
+                        help='Mean latency added to each response in milliseconds. Default is 0')
+    parser.add_argument('--latency_jitter_ms', type=float, default=0.0,
+                        help='Standard deviation of the added latency in milliseconds. Default is 0')
+    parser.add_argument('--error_rate', type=float, default=0.0,
+                        help='Fraction of metadata requests that fail with a HTTP 503. Default is 0')
+    parser.add_argument('--slow_rate', type=float, default=0.0,
+                        help='Fraction of requests that are slow, on top of the latency. Default is 0')
+    parser.add_argument('--slow_ms', type=float, default=0.0,
+                        help='Milliseconds added to the slow requests. Default is 0')
+    parser.add_argument('--hedge_quantile', type=float, default=DEFAULT_HEDGE_QUANTILE,
+                        help='Quantile of the fetch latencies after which requests are hedged, 0 to disable. Default '
+                             'is {}'.format(DEFAULT_HEDGE_QUANTILE))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the latency and error injection. Default is 0')
+    parser.add_argument('-td', '--trunc_descriptions', type=int, default=-1,
+                        help='Truncate descriptions to X characters, -1 for no truncation. Default is -1')
+    parser.add_argument('-tr', '--trunc_releases', type=int, default=-1,
+                        help='Maximum number of releases to store per package, -1 for all. Default is -1')
+    parser.add_argument('--search_index', action='store_true', help='Maintain the full-text search index')
+    parser.add_argument('--compress_descriptions', action='store_true', help='Store descriptions compressed')
+    parser.add_argument('-o', '--output_file',
+                        help='Path of a JSON file to write the results to, for tracking them across runs')
+    parsed_args = parser.parse_args(argv)
+
+    server, index_url = start_server(parsed_args.corpus_dir, parsed_args.packages, parsed_args.latency_ms,
+                                     parsed_args.latency_jitter_ms, parsed_args.error_rate, parsed_args.seed,
+                                     parsed_args.slow_rate, parsed_args.slow_ms)
+    work_dir = tempfile.mkdtemp()
+    try:
+        # Keep the per-package error logging of the retriever out of the report
+        logging.getLogger(pypi_metadata_retriever.__file__).disabled = True
+        results = run_benchmark(index_url, work_dir, parsed_args.threads, parsed_args.trunc_descriptions,
+                                parsed_args.trunc_releases, parsed_args.search_index,
+                                parsed_args.compress_descriptions, parsed_args.hedge_quantile)
+    finally:
+        server.terminate()
+        shutil.rmtree(work_dir)
+
+    for name, value in sorted(results.items()):
+        logger.info('{}: {}'.format(name, value))
+    if parsed_args.output_file:
+        with open(parsed_args.output_file, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+from io import open
+import logging
+import os
+import tempfile
+import threading
+from pypianalyser.compression import TextCompressor, DEFAULT_CODEC, COMPRESSION_LEVEL
+
+logger = logging.getLogger(__file__)
+
+ARCHIVE_INDEX_FILE = 'index.tsv'
+ARCHIVE_OBJECTS_DIR = 'objects'
+
+
+class ResponseArchive(object):
+    """
+    Archive of the raw /pypi/<package>/json responses, so that the database can be rebuilt with different settings
+    without downloading everything again.
+
+    Responses are stored compressed and content-addressed: each is written to objects/<xx>/<sha256>.<codec>, named by
+    the SHA-256 of the raw response, so a response that is identical to one already archived (e.g. a package that hasn't
+    changed between runs) costs no extra space. index.tsv is an append-only log of package name, hash and fetch time.
+    The latest entry of a package is its current response
+    """
+    def __init__(self, directory, codec=DEFAULT_CODEC):
+        """
+        Constructor for ResponseArchive. The directory is created if it does not exist
+
+        :param directory: Directory of the archive
+        :type directory: str
+        :param codec: Codec to compress new responses with. Responses already archived with another codec can still be
+         read
+        :type codec: str
+        """
+        self.directory = directory
+        self.codec = codec
+        self._compressor = TextCompressor(codec)
+        self._decompressors = {codec: self._compressor}
+        self._index_path = os.path.join(directory, ARCHIVE_INDEX_FILE)
+        self._index_lock = threading.Lock()
+        self._index_fp = None
+        objects_dir = os.path.join(directory, ARCHIVE_OBJECTS_DIR)
+        if not os.path.isdir(objects_dir):
+            os.makedirs(objects_dir)
+
+    def _object_path(self, digest, codec):
+        return os.path.join(self.directory, ARCHIVE_OBJECTS_DIR, digest[:2], '{}.{}'.format(digest, codec))
+
+    def _find_object(self, digest):
+        """
+        Finds the file of an archived response, whichever codec it was compressed with
+
+        :param digest: SHA-256 hex digest of the response
+        :type digest: str
+
+        :return: Path and codec of the object, or None if it isn't archived
+        :rtype: tuple or None
+        """
+        for codec in [self.codec] + [x for x in COMPRESSION_LEVEL if x != self.codec]:
+            path = self._object_path(digest, codec)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def store(self, package_name, content):
+        """
+        Archives the response of a package. Safe to call from several threads at once
+
+        :param package_name: Normalized package name
+        :type package_name: str
+        :param content: Raw response body
+        :type content: bytes
+
+        :return: SHA-256 hex digest of the response, and whether it was new to the archive
+        :rtype: tuple
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        is_new = self._find_object(digest) is None
+        if is_new:
+            path = self._object_path(digest, self.codec)
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Created by another thread in the meantime
+                    if not os.path.isdir(directory):
+                        raise
+            # Written to a temporary file and renamed into place, so a reader never sees a partial object. Two threads
+            # racing to store the same response write identical files, so whichever rename lands last is harmless
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(self._compressor.compress(content.decode('utf-8')))
+                if hasattr(os, 'replace'):
+                    os.replace(temp_path, path)
+                else:
+                    os.rename(temp_path, path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        line = u'{}\t{}\t{}\n'.format(package_name, digest, datetime.utcnow().isoformat())
+        with self._index_lock:
+            if self._index_fp is None:
+                self._index_fp = open(self._index_path, 'a', encoding='utf-8')
+            self._index_fp.write(line)
+            self._index_fp.flush()
+        return digest, is_new
+
+    def load(self, digest):
+        """
+        Loads an archived response
+
+        :param digest: SHA-256 hex digest of the response
+        :type digest: str
+
+        :return: Response body
+        :rtype: str
+        """
+        found = self._find_object(digest)
+        if found is None:
+            raise Exception('Response {} is not in the archive {}'.format(digest, self.directory))
+        path, codec = found
+        if codec not in self._decompressors:
+            self._decompressors[codec] = TextCompressor(codec)
+        with open(path, 'rb') as fp:
+            return self._decompressors[codec].decompress(fp.read())
+
+    def read_index(self):
+        """
+        Reads the latest archived response of every package
+
+        :return: Package names mapped to the digest of their latest response, in the order they were first archived
+        :rtype: OrderedDict
+        """
+        ret_val = OrderedDict()
+        if not os.path.exists(self._index_path):
+            return ret_val
+        with open(self._index_path, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                parts = line.rstrip(u'\n').split(u'\t')
+                # A line cut short by the process being killed mid-write is skipped
+                if len(parts) == 3:
+                    ret_val[parts[0]] = parts[1]
+        return ret_val
+
+    def close(self):
+        """
+        Closes the index file
+        """
+        with self._index_lock:
+            if self._index_fp is not None:
+                self._index_fp.close()
+                self._index_fp = None
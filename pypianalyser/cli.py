@@ -0,0 +1,554 @@
+from __future__ import print_function
+import argparse
+from collections import OrderedDict
+import logging
+import os
+import sys
+from io import open
+# Only the options of the commands are imported here. Each command imports the modules it runs with when it is run, so
+# that --help and the quick commands don't load the dependencies of the others
+from pypianalyser.export import EXPORT_FORMATS, EXPORT_TABLES, FORMAT_PARQUET, DEFAULT_EXPORT_BATCH_SIZE
+from pypianalyser.hedging import DEFAULT_HEDGE_QUANTILE
+from pypianalyser.options import DEFAULT_MAX_QUEUED_PACKAGES, MAINTENANCE_STEPS, STEP_INTEGRITY_CHECK, \
+    DEFAULT_BUSY_TIMEOUT, DEFAULT_PAUSE_SECONDS, PROFILE_MODES, PROFILE_MODE_CPU, DEFAULT_HOST, DEFAULT_PORT, \
+    DEFAULT_CACHE_SIZE
+from pypianalyser.pypi_index_helpers import DEFAULT_INDEX_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from pypianalyser.progress import DEFAULT_PROGRESS_INTERVAL
+from pypianalyser.query import QUERY_TYPES, QUERY_COLUMNS, OUTPUT_FORMATS, FORMAT_JSONL
+from pypianalyser.release_stats import STAT_NAMES
+from pypianalyser.scheduling import SCHEDULES, SCHEDULE_ALPHABETICAL
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+logger = logging.getLogger(__file__)
+
+DEFAULT_DB_PATH = 'pypi_metadata.sqlite'
+
+
+def _add_database_argument(parser):
+    parser.add_argument('-db', '--database_path',
+                        help='Name or path of the database to query. Default is {}'.format(DEFAULT_DB_PATH),
+                        default=DEFAULT_DB_PATH)
+
+
+def _add_filter_file_argument(parser):
+    parser.add_argument('-pf', '--filter_file',
+                        help='Path to a file of rules selecting the packages to process, one per line in the form '
+                             '"<include|exclude> <prefix|glob|regex> <pattern>", e.g. "include prefix robotframework-". '
+                             'A package is selected if it matches any include rule (or there are none) and no exclude '
+                             'rule. The package regex, if given, counts as another include rule')
+
+
+def _open_existing_db(db_path):
+    """
+    Opens a database that has previously been created by the ingest command
+
+    :param db_path: Path to the database file
+    :type db_path: str
+
+    :return: Database helper
+    :rtype: PyPiAnalyserSqliteHelper
+    """
+    from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+    if not os.path.exists(db_path):
+        raise Exception('Database {} does not exist, run the ingest command first'.format(db_path))
+    return PyPiAnalyserSqliteHelper(db_path)
+
+
+def _shard_type(value):
+    """
+    Parses a shard argument of the form k/N, where k is from 0 to N - 1
+
+    :param value: Argument value
+    :type value: str
+
+    :return: (k, N)
+    :rtype: tuple
+    """
+    try:
+        shard_index, shard_count = [int(x) for x in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shard must be of the form k/N, e.g. 0/4')
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError('Shard index must be from 0 to {}'.format(shard_count - 1))
+    return shard_index, shard_count
+
+
+def _add_ingest_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Download PyPi metadata into the database. This is the default '
+                                                  'command if none is given')
+    parser.add_argument('-td', '--trunc_descriptions',
+                        help='Truncate the description field to X characters to reduce the size of the database. Use '
+                             '-1 for no truncation. Default is 500',
+                        type=int,
+                        default=500)
+    parser.add_argument('-tr', '--trunc_releases',
+                        help='Specify the maximum number of releases to store in the database for each package. In many'
+                             ' cases you may only be interested in the latest one or two releases. Use -1 for no '
+                             'truncation. Default is 2',
+                        type=int,
+                        default=2)
+    parser.add_argument('-t', '--threads',
+                        help='Number of threads to spawn to download the metadata. Default is 5',
+                        type=int,
+                        default=5)
+    parser.add_argument('-db', '--database_path',
+                        help='Name or path of the database to store the metadata in. If the database already exists '
+                             'with entries then it will be read and only packages that are missing from the database '
+                             'will be retrieved. This allows you to download the PyPi mirror metadata over a few runs '
+                             'rather than a single one. Default is pypi_metadata.sqlite',
+                        default=DEFAULT_DB_PATH)
+    parser.add_argument('-m', '--max_packages',
+                        help='Maximum number of packages to retrieve the metadata for. Using this allows you download'
+                             ' the metadata over a series of runs rather than spamming PyPi and your network.',
+                        type=int)
+    parser.add_argument('-pr', '--package_regex',
+                        help='Specify a regex to match package names against. Only those that match will be retrieved. '
+                             'NOTE: all package names are normalized before this, whereby characters a lowercased and '
+                             'underscores are replaced with hyphens. E.g. ^robotframework-.*')
+    _add_filter_file_argument(parser)
+    parser.add_argument('-404', '--file_404_list',
+                        help='Path to a file to store a list of package names that returned a HTTP 404. This usually'
+                             ' means that the package no longer exists in PyPi. The file is useful for doing future '
+                             'runs. Default: 404.txt',
+                        default='404.txt')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Dry run mode that gives insight into the package metadata that will be retrieved. This '
+                             'mode obtains the package list from the index, removes any packages that are already '
+                             'present the database (if it exists). If the list of package URLs that returned 404 on '
+                             'previous runs exists, these will also be removed from the set. Finally the regex will be '
+                             'applied to the remaining packages. If this list is less than 100 then its printed to the'
+                             ' console. The entire list will be written out to a file called dry_run_package_list.txt')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Verbose mode.')
+    parser.add_argument('--search_index', action='store_true',
+                        help='Build a full-text search index over the package name, summary, keywords and description '
+                             'so that the search command can be used. The index is created for existing packages and '
+                             'then kept up to date on every future run')
+    parser.add_argument('--compress_descriptions', action='store_true',
+                        help='Store descriptions compressed in a separate table so that the packages table stays '
+                             'small. Recommended when not truncating descriptions. Existing descriptions are moved over '
+                             'and compression stays enabled for the database on every future run')
+    parser.add_argument('--index_url', default=DEFAULT_INDEX_URL,
+                        help='Base URL of the PyPi index or mirror to download from. It must serve both the /simple '
+                             'index and the /pypi/<package>/json API. Default is {}'.format(DEFAULT_INDEX_URL))
+    parser.add_argument('--mirrors', nargs='+', metavar='URL',
+                        help='Base URLs of further mirrors to download from alongside --index_url. Requests are spread '
+                             'across all of them, favouring the mirrors with the lowest latency and error rate, and a '
+                             'failed request is retried on another mirror')
+    parser.add_argument('--connect_timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help='Seconds to wait for a connection to the index. Default is {}'
+                             .format(DEFAULT_CONNECT_TIMEOUT))
+    parser.add_argument('--read_timeout', type=float, default=DEFAULT_READ_TIMEOUT,
+                        help='Seconds to wait for the next bytes of a response from the index. Default is {}'
+                             .format(DEFAULT_READ_TIMEOUT))
+    parser.add_argument('--hedge_quantile', type=float, default=DEFAULT_HEDGE_QUANTILE,
+                        help='Make a duplicate request for a package once its download has taken longer than this '
+                             'quantile of the recent download latencies, using whichever response arrives first. 0 '
+                             'disables hedging. Default is {}'.format(DEFAULT_HEDGE_QUANTILE))
+    parser.add_argument('--metrics_interval', type=float, default=0,
+                        help='Log the ingest metrics (fetch latency, bytes downloaded, parse time, database queue depth,'
+                             ' rows written and errors by type) as a JSON line every X seconds. Default is 0 (off)')
+    parser.add_argument('--metrics_file',
+                        help='Path of a Prometheus text file to keep updated with the ingest metrics, e.g. for the '
+                             'node_exporter textfile collector')
+    parser.add_argument('--progress_interval', type=float, default=DEFAULT_PROGRESS_INTERVAL,
+                        help='Log the progress, packages/sec rate and ETA every X seconds. Use 0 to disable. Default is'
+                             ' {}'.format(DEFAULT_PROGRESS_INTERVAL))
+    parser.add_argument('--max_queued_packages', type=int, default=DEFAULT_MAX_QUEUED_PACKAGES,
+                        help='Maximum number of downloaded packages waiting to be written to the database. Downloads '
+                             'pause while the queue is full. Default is {}'.format(DEFAULT_MAX_QUEUED_PACKAGES))
+    parser.add_argument('--max_memory_mb', type=int,
+                        help='Memory ceiling in MB. Downloads pause while the process is above it until the queued '
+                             'packages have been written. Default is no ceiling')
+    parser.add_argument('--shard', type=_shard_type,
+                        help='Only process shard k of N (k/N, from 0/N to N-1/N) of the package list, so that a crawl '
+                             'can be split across N machines. Packages are assigned to shards by a stable hash of '
+                             'their name. Combine the databases afterwards with the merge command')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Also re-download the packages already in the database and update any that have changed. '
+                             'A hash of each package is stored, so unchanged packages are skipped without being '
+                             'rewritten')
+    parser.add_argument('--schedule', choices=SCHEDULES, default=SCHEDULE_ALPHABETICAL,
+                        help='Order to fetch the packages in, which decides the packages fetched when limited by '
+                             '--max_packages. alphabetical: by name. staleness: least recently refreshed first, '
+                             'combine with --refresh. downloads: most downloaded first, from --downloads_file. fanin: '
+                             'most depended on by the packages already in the database first. Default is alphabetical')
+    parser.add_argument('--downloads_file',
+                        help='File of "<package> <download count>" lines used by the downloads schedule')
+    parser.add_argument('--archive_dir',
+                        help='Keep the raw JSON responses compressed in this directory, so that the database can be '
+                             'regenerated with the rebuild command without downloading everything again. Identical '
+                             'responses are only stored once, across runs')
+    parser.add_argument('--profile',
+                        help='Profile the run, including every download thread and the database worker thread, and '
+                             'write the results to this file')
+    parser.add_argument('--profile_mode', choices=PROFILE_MODES, default=PROFILE_MODE_CPU,
+                        help='cpu: merged cProfile stats, viewable with python -m pstats. sample: collapsed stacks from '
+                             'a sampling profiler, for flame graphs. memory: tracemalloc report of the largest '
+                             'allocations. Default is cpu')
+    parser.set_defaults(func=_run_ingest)
+
+
+def _run_ingest(parsed_args):
+    from pypianalyser.pypi_metadata_retriever import PyPiMetadataRetriever
+    retriever = PyPiMetadataRetriever(parsed_args.trunc_descriptions,
+                                      parsed_args.trunc_releases,
+                                      parsed_args.threads,
+                                      parsed_args.database_path,
+                                      parsed_args.max_packages,
+                                      parsed_args.package_regex,
+                                      parsed_args.file_404_list,
+                                      parsed_args.verbose,
+                                      parsed_args.search_index,
+                                      parsed_args.compress_descriptions,
+                                      parsed_args.index_url,
+                                      parsed_args.metrics_interval,
+                                      parsed_args.metrics_file,
+                                      parsed_args.progress_interval,
+                                      parsed_args.max_queued_packages,
+                                      parsed_args.max_memory_mb,
+                                      parsed_args.shard,
+                                      parsed_args.refresh,
+                                      parsed_args.archive_dir,
+                                      parsed_args.filter_file,
+                                      parsed_args.schedule,
+                                      parsed_args.downloads_file,
+                                      parsed_args.mirrors,
+                                      parsed_args.connect_timeout,
+                                      parsed_args.read_timeout,
+                                      parsed_args.hedge_quantile)
+
+    if parsed_args.dry_run:
+        package_list = retriever.calculate_package_list()
+        with open('dry_run_package_list.txt', 'w', encoding='utf-8') as fp:
+            fp.write(u'\n'.join(package_list))
+
+        logger.info('Dry run has calculated {} packages that would be processed. This list has been output to '
+                    'dry_run_package_list.txt'.format(len(package_list)))
+    elif parsed_args.profile:
+        from pypianalyser.profiling import create_profiler
+        profiler = create_profiler(parsed_args.profile_mode, parsed_args.profile)
+        profiler.start()
+        try:
+            retriever.run()
+        finally:
+            profiler.stop()
+    else:
+        retriever.run()
+
+
+def _add_search_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Search packages by topic using the full-text search index')
+    parser.add_argument('search_terms', nargs='+',
+                        help='Terms to search for in the package name, summary, keywords and description')
+    _add_database_argument(parser)
+    parser.add_argument('-l', '--limit', type=int, default=20,
+                        help='Maximum number of results to display. Default is 20')
+    parser.add_argument('--raw', action='store_true',
+                        help='Treat the search terms as a raw FTS5 query, e.g. "http* NOT django"')
+    parser.set_defaults(func=_run_search)
+
+
+def _run_search(parsed_args):
+    db_helper = _open_existing_db(parsed_args.database_path)
+    try:
+        results = db_helper.search_packages(u' '.join(parsed_args.search_terms), parsed_args.limit, parsed_args.raw)
+    finally:
+        db_helper.close()
+    for result in results:
+        print(u'{}\t{}\t{}'.format(result['name'], result['version'], result['summary'] or ''))
+
+
+def _add_query_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Look up packages over a read-only connection, writing the results as '
+                                                  'JSON lines or TSV')
+    parser.add_argument('query_type', choices=QUERY_TYPES,
+                        help='info: package metadata, releases: stored release files, classifiers: classifiers of a '
+                             'package, rdeps: packages that require a package, classifier: packages with a classifier '
+                             'or any classifier below it')
+    parser.add_argument('terms', nargs='*',
+                        help='Package names, or classifiers for the classifier query. If none are given, or the only '
+                             'one is -, they are read from stdin one per line')
+    _add_database_argument(parser)
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default=FORMAT_JSONL,
+                        help='Output format. Default is {}'.format(FORMAT_JSONL))
+    parser.set_defaults(func=_run_query)
+
+
+def _run_query(parsed_args):
+    from pypianalyser.query import PackageQueries, write_rows
+    terms = parsed_args.terms
+    if not terms or terms == ['-']:
+        terms = (x.strip() for x in sys.stdin)
+    queries = PackageQueries(parsed_args.database_path)
+    try:
+        columns = QUERY_COLUMNS[parsed_args.query_type]
+        header = True
+        for term in terms:
+            if term:
+                write_rows(queries.run(parsed_args.query_type, term), columns, parsed_args.format, sys.stdout, header)
+                header = False
+    finally:
+        queries.close()
+
+
+ROLLUP_GETTERS = OrderedDict([
+    ('classifiers', 'get_classifier_counts'),
+    ('requires_python', 'get_requires_python_counts'),
+    ('licenses', 'get_license_counts'),
+    ('monthly_uploads', 'get_monthly_upload_counts'),
+])
+
+
+def _add_rollups_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Update the precomputed analytics rollup tables and display them')
+    _add_database_argument(parser)
+    parser.add_argument('-s', '--show', choices=list(ROLLUP_GETTERS.keys()),
+                        help='Rollup to display once the tables have been updated')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Recount every rollup from scratch rather than only the values that have changed')
+    parser.set_defaults(func=_run_rollups)
+
+
+def _run_rollups(parsed_args):
+    db_helper = _open_existing_db(parsed_args.database_path)
+    try:
+        db_helper.update_rollups(parsed_args.rebuild)
+        rollup = getattr(db_helper, ROLLUP_GETTERS[parsed_args.show])() if parsed_args.show else {}
+    finally:
+        db_helper.close()
+    for key, count in rollup.items():
+        print(u'{}\t{}'.format(count, key))
+
+
+def _add_export_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Export the database tables to Parquet or Arrow IPC files')
+    _add_database_argument(parser)
+    parser.add_argument('-o', '--output_dir', default='export',
+                        help='Directory to write a file per table to. Default is export')
+    parser.add_argument('-f', '--format', choices=EXPORT_FORMATS, default=FORMAT_PARQUET,
+                        help='File format. Arrow IPC files can be memory-mapped. Default is parquet')
+    parser.add_argument('--tables', nargs='+', choices=EXPORT_TABLES,
+                        help='Tables to export. Default is all of them')
+    parser.add_argument('-b', '--batch_size', type=int, default=DEFAULT_EXPORT_BATCH_SIZE,
+                        help='Number of rows to stream into each batch. Default is {}'.format(DEFAULT_EXPORT_BATCH_SIZE))
+    parser.set_defaults(func=_run_export)
+
+
+def _run_export(parsed_args):
+    from pypianalyser.export import export_database
+    if not os.path.exists(parsed_args.database_path):
+        raise Exception('Database {} does not exist, run the ingest command first'.format(parsed_args.database_path))
+    export_database(parsed_args.database_path, parsed_args.output_dir, parsed_args.format, parsed_args.batch_size,
+                    parsed_args.tables)
+
+
+def _add_stats_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Report release statistics, such as release cadence, artifact size and '
+                                                 'wheel adoption, for every package')
+    _add_database_argument(parser)
+    parser.add_argument('-s', '--sort', choices=STAT_NAMES, default='total_size',
+                        help='Statistic to rank the packages by, largest first. Default is total_size')
+    parser.add_argument('-n', '--top', type=int, default=20,
+                        help='Number of packages to display. Default is 20')
+    parser.add_argument('-o', '--output_file',
+                        help='Path of a TSV file to write the statistics of every package to')
+    parser.set_defaults(func=_run_stats)
+
+
+def _run_stats(parsed_args):
+    from pypianalyser.release_stats import get_release_stats, summarise_release_stats, top_packages
+    db_helper = _open_existing_db(parsed_args.database_path)
+    try:
+        stats = get_release_stats(db_helper)
+    finally:
+        db_helper.close()
+
+    for name, value in summarise_release_stats(stats).items():
+        logger.info('{}: {}'.format(name, value))
+
+    columns = list(stats.keys())
+    if parsed_args.output_file:
+        with open(parsed_args.output_file, 'w', encoding='utf-8') as fp:
+            fp.write(u'\t'.join(columns) + u'\n')
+            for row in zip(*stats.values()):
+                fp.write(u'\t'.join(u'{}'.format(x) for x in row) + u'\n')
+        logger.info('Wrote the statistics of {} packages to {}'.format(len(stats['name']), parsed_args.output_file))
+
+    print(u'\t'.join(columns))
+    for i in top_packages(stats, parsed_args.sort, parsed_args.top):
+        print(u'\t'.join(u'{}'.format(stats[x][i]) for x in columns))
+
+
+def _add_rebuild_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Build a new database from the raw responses archived by the ingest '
+                                                  'command, without any network access')
+    parser.add_argument('archive_dir', help='Directory of the response archive, as given to ingest --archive_dir')
+    parser.add_argument('-db', '--database_path', default=DEFAULT_DB_PATH,
+                        help='Name or path of the database to create. It must not already exist. Default is '
+                             '{}'.format(DEFAULT_DB_PATH))
+    parser.add_argument('-td', '--trunc_descriptions', type=int, default=500,
+                        help='Truncate the description field to X characters. Use -1 for no truncation. Default is 500')
+    parser.add_argument('-tr', '--trunc_releases', type=int, default=2,
+                        help='Maximum number of releases to store for each package. Use -1 for no truncation. Default '
+                             'is 2')
+    parser.add_argument('-t', '--threads', type=int,
+                        help='Number of processes to parse the responses with. Default is the number of CPUs')
+    parser.add_argument('-pr', '--package_regex',
+                        help='Only rebuild the packages whose normalized name matches this regex')
+    _add_filter_file_argument(parser)
+    parser.add_argument('--search_index', action='store_true',
+                        help='Build the full-text search index used by the search command')
+    parser.add_argument('--compress_descriptions', action='store_true',
+                        help='Store descriptions compressed in a separate table')
+    parser.set_defaults(func=_run_rebuild)
+
+
+def _run_rebuild(parsed_args):
+    import multiprocessing
+    from pypianalyser.pypi_metadata_retriever import PyPiMetadataRetriever
+    retriever = PyPiMetadataRetriever(parsed_args.trunc_descriptions,
+                                      parsed_args.trunc_releases,
+                                      parsed_args.threads or max(multiprocessing.cpu_count(), 1),
+                                      parsed_args.database_path,
+                                      package_regex=parsed_args.package_regex,
+                                      filter_file=parsed_args.filter_file,
+                                      search_index=parsed_args.search_index,
+                                      compress_descriptions=parsed_args.compress_descriptions,
+                                      archive_dir=parsed_args.archive_dir)
+    retriever.rebuild()
+
+
+def _add_merge_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Merge the databases of a sharded crawl into one database')
+    parser.add_argument('-db', '--database_path', default=DEFAULT_DB_PATH,
+                        help='Name or path of the database to merge into. It is created if it does not exist. Default '
+                             'is {}'.format(DEFAULT_DB_PATH))
+    parser.add_argument('shard_paths', nargs='+', help='Paths of the shard databases to merge')
+    parser.set_defaults(func=_run_merge)
+
+
+def _run_merge(parsed_args):
+    from pypianalyser.merge import merge_databases
+    merge_databases(parsed_args.database_path, parsed_args.shard_paths)
+
+
+def _add_serve_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Serve /pypi/<package>/json compatible responses from the database over '
+                                                  'HTTP, downloading packages that are missing from it')
+    _add_database_argument(parser)
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='Address to listen on. Default is {}'.format(DEFAULT_HOST))
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help='Port to listen on. Default is {}'.format(DEFAULT_PORT))
+    parser.add_argument('-c', '--cache_size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='Number of responses to keep in memory. Default is {}'.format(DEFAULT_CACHE_SIZE))
+    parser.add_argument('--index_url', default=DEFAULT_INDEX_URL,
+                        help='Base URL of the PyPi index or mirror to download missing packages from. Default is '
+                             '{}'.format(DEFAULT_INDEX_URL))
+    parser.add_argument('--no_fetch', action='store_true',
+                        help='Respond with a 404 for packages that are not in the database rather than downloading them')
+    parser.add_argument('-td', '--trunc_descriptions', type=int, default=500,
+                        help='Truncate the description field of downloaded packages to X characters. Use -1 for no '
+                             'truncation. Default is 500')
+    parser.add_argument('-tr', '--trunc_releases', type=int, default=2,
+                        help='Maximum number of releases to store for each downloaded package. Use -1 for no '
+                             'truncation. Default is 2')
+    parser.set_defaults(func=_run_serve)
+
+
+def _run_serve(parsed_args):
+    from pypianalyser.server import MetadataService, create_http_server
+    db_helper = _open_existing_db(parsed_args.database_path)
+    try:
+        service = MetadataService(db_helper, parsed_args.cache_size, parsed_args.index_url, not parsed_args.no_fetch,
+                                  parsed_args.trunc_descriptions, parsed_args.trunc_releases)
+        server = create_http_server(service, parsed_args.host, parsed_args.port)
+        logger.info('Serving {} on http://{}:{}/pypi/<package>/json'.format(parsed_args.database_path,
+                                                                          *server.server_address[:2]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    finally:
+        db_helper.close()
+
+
+def _add_maintenance_parser(subparsers, command):
+    parser = subparsers.add_parser(command, help='Check and compact the database: integrity check, index rebuild, '
+                                                  'ANALYZE and search index optimization, vacuum and WAL checkpoint')
+    parser.add_argument('-db', '--database_path', default=DEFAULT_DB_PATH,
+                        help='Name or path of the database to maintain. Default is {}'.format(DEFAULT_DB_PATH))
+    parser.add_argument('--online', action='store_true',
+                        help='Split the work into short transactions so that the database can still be read and written '
+                             'while the maintenance runs. The integrity check is quicker but less thorough, and the '
+                             'vacuum only releases free pages rather than defragmenting the file')
+    parser.add_argument('--steps', nargs='+', choices=MAINTENANCE_STEPS, default=MAINTENANCE_STEPS,
+                        help='Steps to run. They are always run in the order {}. Default is all of them'
+                             .format(', '.join(MAINTENANCE_STEPS)))
+    parser.add_argument('--busy_timeout', type=float, default=DEFAULT_BUSY_TIMEOUT,
+                        help='Seconds to wait for a lock held by another process. Default is {}'
+                             .format(DEFAULT_BUSY_TIMEOUT))
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE_SECONDS,
+                        help='Seconds to pause between the batches of work in online mode. Default is {}'
+                             .format(DEFAULT_PAUSE_SECONDS))
+    parser.set_defaults(func=_run_maintenance)
+
+
+def _run_maintenance(parsed_args):
+    from pypianalyser.maintenance import DatabaseMaintenance
+    maintenance = DatabaseMaintenance(parsed_args.database_path, parsed_args.online, parsed_args.busy_timeout,
+                                      parsed_args.pause)
+    try:
+        report = maintenance.run(parsed_args.steps)
+    finally:
+        maintenance.close()
+    problems = report[STEP_INTEGRITY_CHECK]['result'] if STEP_INTEGRITY_CHECK in report else []
+    if problems:
+        raise Exception('The integrity check of {} found {} problems'.format(parsed_args.database_path, len(problems)))
+
+
+# Maps each command name to the function that adds its sub-parser
+COMMANDS = OrderedDict([
+    ('ingest', _add_ingest_parser),
+    ('search', _add_search_parser),
+    ('query', _add_query_parser),
+    ('rollups', _add_rollups_parser),
+    ('export', _add_export_parser),
+    ('stats', _add_stats_parser),
+    ('merge', _add_merge_parser),
+    ('rebuild', _add_rebuild_parser),
+    ('serve', _add_serve_parser),
+    ('maintenance', _add_maintenance_parser),
+])
+
+
+def build_parser():
+    """
+    Builds the argument parser for the command line interface
+
+    :return: Argument parser with a sub-parser for each command
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser('pypianalyser',
+                                     description='Download PyPi metadata into an SQLite database for easy querying.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for command, add_parser in COMMANDS.items():
+        add_parser(subparsers, command)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else argv
+    # Ingesting was the only mode before commands were added, keep it as the default so existing invocations still work
+    if not argv or argv[0] not in COMMANDS and argv[0] not in ('-h', '--help'):
+        argv = ['ingest'] + list(argv)
+    parsed_args = parser.parse_args(argv)
+    parsed_args.func(parsed_args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+from collections import Counter
+import threading
+import zlib
+import six
+from pypianalyser.utils import lazy_import
+
+# zstandard is an optional dependency, loaded on first use
+zstandard = lazy_import('zstandard')
+# Lazy loading isn't thread safe, and compressors are created from the threads of the server
+_zstandard_load_lock = threading.Lock()
+
+CODEC_ZLIB = 'zlib'
+CODEC_ZSTD = 'zstd'
+# zstd compresses better and faster, but is an optional dependency
+DEFAULT_CODEC = CODEC_ZSTD if zstandard else CODEC_ZLIB
+# zlib can only make use of a preset dictionary as large as its window
+ZLIB_MAX_DICTIONARY_SIZE = 32 * 1024
+# zlib's compressobj() and decompressobj() only take a preset dictionary from Python 3.3
+ZLIB_DICTIONARY_SUPPORTED = six.PY3
+DEFAULT_DICTIONARY_SIZE = 64 * 1024
+COMPRESSION_LEVEL = {CODEC_ZLIB: 9, CODEC_ZSTD: 10}
+
+
+class TextCompressor(object):
+    """
+    Compresses and decompresses text, optionally using a dictionary shared between many small documents. Sharing a
+    dictionary greatly improves the compression ratio of short texts such as package descriptions, which have a lot of
+    boilerplate in common but are too small to compress well individually
+    """
+    def __init__(self, codec=DEFAULT_CODEC, dictionary=None):
+        """
+        Constructor for TextCompressor
+
+        :param codec: Compression codec, 'zlib' or 'zstd'
+        :type codec: str
+        :param dictionary: Raw dictionary data, or None to compress without a dictionary
+        :type dictionary: bytes or None
+        """
+        if codec == CODEC_ZSTD and not zstandard:
+            raise Exception('The zstandard package is required to use the zstd codec')
+        elif codec not in COMPRESSION_LEVEL:
+            raise Exception('Unknown compression codec: {}'.format(codec))
+        elif codec == CODEC_ZLIB and dictionary and not ZLIB_DICTIONARY_SUPPORTED:
+            raise Exception('Python 3 is required to use a dictionary with the zlib codec')
+        self.codec = codec
+        self.dictionary = dictionary
+        self._zstd_dictionary = None
+        if codec == CODEC_ZSTD:
+            _load_zstandard()
+        if codec == CODEC_ZSTD and dictionary:
+            self._zstd_dictionary = zstandard.ZstdCompressionDict(dictionary)
+
+    def compress(self, text):
+        """
+        Compresses a string
+
+        :param text: Text to compress
+        :type text: str
+
+        :return: Compressed data
+        :rtype: bytes
+        """
+        data = text.encode('utf-8')
+        if self.codec == CODEC_ZSTD:
+            # Compressor objects aren't thread safe, so create one per call
+            compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL[CODEC_ZSTD], dict_data=self._zstd_dictionary)
+            return compressor.compress(data)
+        if self.dictionary:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL[CODEC_ZLIB], zlib.DEFLATED, zlib.MAX_WBITS, 9,
+                                          zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        else:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL[CODEC_ZLIB])
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """
+        Decompresses data created by compress()
+
+        :param data: Compressed data
+        :type data: bytes
+
+        :return: Decompressed text
+        :rtype: str
+        """
+        if self.codec == CODEC_ZSTD:
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dictionary)
+            raw = decompressor.decompress(data)
+        elif self.dictionary:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, self.dictionary)
+            raw = decompressor.decompress(data) + decompressor.flush()
+        else:
+            raw = zlib.decompress(data)
+        return raw.decode('utf-8')
+
+
+def train_dictionary(codec, samples, dictionary_size=DEFAULT_DICTIONARY_SIZE):
+    """
+    Trains a compression dictionary from a set of sample texts
+
+    :param codec: Compression codec the dictionary will be used with, 'zlib' or 'zstd'
+    :type codec: str
+    :param samples: Sample texts, ideally a few hundred or more
+    :type samples: list
+    :param dictionary_size: Maximum size of the dictionary in bytes
+    :type dictionary_size: int
+
+    :return: Raw dictionary data, or None if the samples were not sufficient to train one or the codec can't use one
+    :rtype: bytes or None
+    """
+    if codec == CODEC_ZLIB and not ZLIB_DICTIONARY_SUPPORTED:
+        return None
+    encoded_samples = [x.encode('utf-8') for x in samples if x]
+    if not encoded_samples:
+        return None
+    if codec == CODEC_ZSTD:
+        _load_zstandard()
+        try:
+            return zstandard.train_dictionary(dictionary_size, encoded_samples).as_bytes()
+        except zstandard.ZstdError:
+            # The trainer needs a reasonably large number of samples. zstd also accepts raw content dictionaries, so
+            # fall back to the same approach as zlib
+            return _build_raw_dictionary(encoded_samples, dictionary_size)
+    return _build_raw_dictionary(encoded_samples, min(dictionary_size, ZLIB_MAX_DICTIONARY_SIZE))
+
+
+def _load_zstandard():
+    """
+    Loads the zstandard module, if it hasn't been already, before any of its attributes are used
+    """
+    with _zstandard_load_lock:
+        getattr(zstandard, 'ZstdCompressor')
+
+
+def _build_raw_dictionary(samples, dictionary_size):
+    """
+    Builds a raw content dictionary, which is simply data that the compressor can refer back to, from the lines that
+    are shared between the most samples. Shorter distances are encoded more cheaply, so the most common lines are placed
+    at the end
+
+    :param samples: Encoded sample texts
+    :type samples: list
+    :param dictionary_size: Maximum size of the dictionary in bytes
+    :type dictionary_size: int
+
+    :return: Raw dictionary data, or None if the samples have nothing in common
+    :rtype: bytes or None
+    """
+    line_counts = Counter()
+    for sample in samples:
+        line_counts.update(set(x.strip() for x in sample.splitlines() if len(x.strip()) > 3))
+
+    dictionary_lines = []
+    size = 0
+    for line, count in line_counts.most_common():
+        if count < 2 or size + len(line) + 1 > dictionary_size:
+            break
+        dictionary_lines.append(line)
+        size += len(line) + 1
+
+    if not dictionary_lines:
+        return None
+    return b'\n'.join(reversed(dictionary_lines))
@@ -3,3 +3,10 @@
 class Exception404(Exception):
     def __init__(self, url):
         super(Exception, self).__init__('404 HTTP Error: ' + url)
+
+
+class UpstreamError(Exception):
+    """
+    Failure to download from the upstream index, other than the package not existing
+    """
+    pass
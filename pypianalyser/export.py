@@ -0,0 +1,280 @@
+import logging
+import os
+from pypianalyser.compression import TextCompressor
+from pypianalyser.sql_queries import TABLE_COLUMNS, SELECT_COLUMNS_SQL, SELECT_ALL_PACKAGES_WITH_DESCRIPTIONS_SQL, \
+    SELECT_COMPRESSION_DICTIONARY_SQL
+from pypianalyser.sqlite_helper import connect_read_only, SELECT_TABLE_EXISTS_SQL
+from pypianalyser.utils import lazy_import
+
+# pyarrow is an optional dependency, loaded on first use. Its ipc and parquet modules are imported where they are used
+pyarrow = lazy_import('pyarrow')
+
+logger = logging.getLogger(__file__)
+
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+EXPORT_FORMATS = [FORMAT_PARQUET, FORMAT_ARROW]
+DEFAULT_EXPORT_BATCH_SIZE = 50000
+EXPORT_TABLES = ['packages', 'package_releases', 'classifier_strings', 'package_classifiers']
+PACKAGE_DESCRIPTIONS_TABLE = 'package_descriptions'
+
+INTEGER_COLUMNS = {'id', 'package_id', 'classifier_id', 'size'}
+BOOLEAN_COLUMNS = {'has_sig'}
+# Low cardinality string columns that are dictionary encoded, which makes them much smaller and loads them into pandas
+# as categoricals. Mostly unique columns such as URLs and descriptions gain nothing from it so are left as plain strings
+DICTIONARY_COLUMNS = {
+    'packages': {'requires_python', 'platform', 'license', 'description_content_type', 'version', 'author',
+                 'maintainer', 'docs_url', 'bugtrack_url'},
+    'package_releases': {'version', 'packagetype', 'python_version', 'requires_python', 'comment_text'},
+    'classifier_strings': set(),
+    'package_classifiers': set(),
+}
+
+
+class _DictionaryEncoder(object):
+    """
+    Dictionary encodes a string column across every batch of an export. The dictionary only ever grows, so each batch
+    can be written as a delta of the previous one rather than each batch carrying a dictionary of its own
+    """
+    def __init__(self):
+        self._indices = {}
+        self._values = []
+
+    def encode(self, values):
+        """
+        Encodes a batch of values
+
+        :param values: Strings (or None) to encode
+        :type values: list
+
+        :return: Dictionary encoded array
+        :rtype: pyarrow.DictionaryArray
+        """
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            index = self._indices.get(value)
+            if index is None:
+                index = len(self._values)
+                self._indices[value] = index
+                self._values.append(value)
+            indices.append(index)
+        return pyarrow.DictionaryArray.from_arrays(pyarrow.array(indices, pyarrow.int32()),
+                                                   pyarrow.array(self._values, pyarrow.string()))
+
+
+def _build_schema(table_name):
+    """
+    Builds the Arrow schema for one of the tables
+
+    :param table_name: Name of the table
+    :type table_name: str
+
+    :return: Arrow schema
+    :rtype: pyarrow.Schema
+    """
+    fields = []
+    for column in TABLE_COLUMNS[table_name]:
+        if column in INTEGER_COLUMNS:
+            column_type = pyarrow.int64()
+        elif column in BOOLEAN_COLUMNS:
+            column_type = pyarrow.bool_()
+        elif column in DICTIONARY_COLUMNS[table_name]:
+            column_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        else:
+            column_type = pyarrow.string()
+        fields.append(pyarrow.field(column, column_type))
+    return pyarrow.schema(fields)
+
+
+def _iter_rows(conn, query, batch_size):
+    """
+    Generator that runs a query and yields the rows, fetching them from the cursor in batches so that the full result
+    set is never held in memory
+
+    :param conn: Connection to the database
+    :type conn: sqlite3.Connection
+    :param query: SQL query
+    :type query: str
+    :param batch_size: Number of rows to fetch from the cursor at a time
+    :type batch_size: int
+
+    :return: Generator of row tuples
+    :rtype: generator
+    """
+    cursor = conn.execute(query)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+
+def _iter_package_rows(conn, batch_size):
+    """
+    Generator that yields every row of the packages table, with any description that is stored compressed in the
+    package_descriptions table decompressed back into its column
+
+    :param conn: Connection to the database
+    :type conn: sqlite3.Connection
+    :param batch_size: Number of rows to fetch from the cursor at a time
+    :type batch_size: int
+
+    :return: Generator of row tuples
+    :rtype: generator
+    """
+    columns = TABLE_COLUMNS['packages']
+    if conn.execute(SELECT_TABLE_EXISTS_SQL, (PACKAGE_DESCRIPTIONS_TABLE,)).fetchone() is None:
+        for row in _iter_rows(conn, SELECT_COLUMNS_SQL.format(columns=', '.join(columns), table='packages'),
+                              batch_size):
+            yield row
+        return
+
+    description_index = columns.index('description')
+    compressors = {}
+    for row in _iter_rows(conn, SELECT_ALL_PACKAGES_WITH_DESCRIPTIONS_SQL, batch_size):
+        codec, dictionary_id, data = row[len(columns):]
+        row = row[:len(columns)]
+        if data is not None:
+            if (codec, dictionary_id) not in compressors:
+                dictionary = None
+                if dictionary_id is not None:
+                    dictionary = bytes(conn.execute(SELECT_COMPRESSION_DICTIONARY_SQL, (dictionary_id,)).fetchone()[0])
+                compressors[(codec, dictionary_id)] = TextCompressor(codec, dictionary)
+            description = compressors[(codec, dictionary_id)].decompress(data)
+            row = row[:description_index] + (description,) + row[description_index + 1:]
+        yield row
+
+
+def _iter_record_batches(rows, schema, batch_size):
+    """
+    Groups row tuples into Arrow record batches
+
+    :param rows: Iterable of row tuples, in schema column order
+    :type rows: iterable
+    :param schema: Arrow schema of the rows
+    :type schema: pyarrow.Schema
+    :param batch_size: Number of rows per batch
+    :type batch_size: int
+
+    :return: Generator of record batches
+    :rtype: generator
+    """
+    encoders = {field.name: _DictionaryEncoder() for field in schema if pyarrow.types.is_dictionary(field.type)}
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield _build_record_batch(batch, schema, encoders)
+            batch = []
+    if batch:
+        yield _build_record_batch(batch, schema, encoders)
+
+
+def _build_record_batch(rows, schema, encoders):
+    columns = []
+    for field, values in zip(schema, zip(*rows)):
+        if field.name in encoders:
+            columns.append(encoders[field.name].encode(values))
+        elif pyarrow.types.is_boolean(field.type):
+            columns.append(pyarrow.array([None if x is None else bool(x) for x in values], field.type))
+        else:
+            columns.append(pyarrow.array(values, field.type))
+    return pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def export_table(conn, table_name, output_path, file_format=FORMAT_PARQUET, batch_size=DEFAULT_EXPORT_BATCH_SIZE):
+    """
+    Streams a table out of the database into a Parquet or Arrow IPC file, one batch at a time
+
+    :param conn: Connection to the database to export from
+    :type conn: sqlite3.Connection
+    :param table_name: Name of the table to export
+    :type table_name: str
+    :param output_path: Path of the file to write
+    :type output_path: str
+    :param file_format: 'parquet' or 'arrow'
+    :type file_format: str
+    :param batch_size: Number of rows to read and write at a time
+    :type batch_size: int
+
+    :return: Number of rows exported
+    :rtype: int
+    """
+    schema = _build_schema(table_name)
+    if table_name == 'packages':
+        rows = _iter_package_rows(conn, batch_size)
+    else:
+        rows = _iter_rows(conn, SELECT_COLUMNS_SQL.format(columns=', '.join(TABLE_COLUMNS[table_name]),
+                                                          table=table_name), batch_size)
+
+    if file_format == FORMAT_PARQUET:
+        import pyarrow.parquet as parquet
+        writer = parquet.ParquetWriter(output_path, schema, compression='zstd')
+    else:
+        import pyarrow.ipc as ipc
+        # The dictionaries only grow, so later batches can be written as deltas which keeps the IPC file memory
+        # mappable
+        options = ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        writer = ipc.new_file(output_path, schema, options=options)
+
+    row_count = 0
+    try:
+        for record_batch in _iter_record_batches(rows, schema, batch_size):
+            writer.write_batch(record_batch)
+            row_count += record_batch.num_rows
+    finally:
+        writer.close()
+    return row_count
+
+
+def export_database(db_path, output_dir, file_format=FORMAT_PARQUET, batch_size=DEFAULT_EXPORT_BATCH_SIZE,
+                    tables=None):
+    """
+    Exports tables of the metadata database to columnar files, one file per table named <table>.parquet or
+    <table>.arrow. The database is only read, through a read-only connection
+
+    :param db_path: Path to the database file
+    :type db_path: str
+    :param output_dir: Directory to write the files to. Created if it doesn't exist
+    :type output_dir: str
+    :param file_format: 'parquet' or 'arrow'
+    :type file_format: str
+    :param batch_size: Number of rows to read and write at a time
+    :type batch_size: int
+    :param tables: Names of the tables to export, or None to export them all
+    :type tables: list or None
+
+    :return: Paths of the files written
+    :rtype: list
+    """
+    if pyarrow is None:
+        raise Exception('The pyarrow package is required to export the database')
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: {}. Must be one of {}'.format(file_format, ', '.join(EXPORT_FORMATS)))
+    unknown_tables = set(tables or []) - set(EXPORT_TABLES)
+    if unknown_tables:
+        raise ValueError('Unknown tables: {}. Must be one of {}'.format(', '.join(sorted(unknown_tables)),
+                                                                       ', '.join(EXPORT_TABLES)))
+    if not os.path.exists(db_path):
+        raise Exception('Database {} does not exist, run the ingest command first'.format(db_path))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    output_paths = []
+    conn = connect_read_only(db_path)
+    try:
+        for table_name in tables or EXPORT_TABLES:
+            output_path = os.path.join(output_dir, '{}.{}'.format(table_name, file_format))
+            row_count = export_table(conn, table_name, output_path, file_format, batch_size)
+            logger.info('Exported {} rows from {} to {}'.format(row_count, table_name, output_path))
+            output_paths.append(output_path)
+    finally:
+        conn.close()
+    return output_paths
@@ -0,0 +1,189 @@
+from collections import deque
+import logging
+import threading
+import time
+from six.moves import queue
+
+logger = logging.getLogger(__file__)
+
+# Requests that take longer than this quantile of the recent request latencies are hedged
+DEFAULT_HEDGE_QUANTILE = 0.95
+# Number of recent request latencies the quantile is taken over
+DEFAULT_WINDOW_SIZE = 1000
+# Requests aren't hedged until this many latencies have been seen, as the quantile of a few requests is meaningless
+DEFAULT_MIN_SAMPLES = 50
+# Requests aren't hedged sooner than this many seconds, as hedging requests this fast would only add load
+MIN_HEDGE_DELAY = 0.005
+# Number of latencies recorded between recalculations of the hedge delay, so that every request doesn't sort the window
+RECALCULATE_INTERVAL = 20
+
+
+class _WorkerPool(object):
+    """
+    Pool of daemon threads that grows whenever a task is submitted and no thread is idle, so a task never waits behind
+    another. Threads are reused rather than started per task, so per-thread state (e.g. each thread's shard of the
+    metrics) stays bounded by the peak number of concurrent tasks
+    """
+    def __init__(self, name):
+        self.name = name
+        self._tasks = queue.Queue()
+        self._idle = 0
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        with self._lock:
+            # Each task reserves an idle thread, or a new one if there are none
+            if self._idle:
+                self._idle -= 1
+            else:
+                thread = threading.Thread(target=self._work, name='{}-{}'.format(self.name, len(self._threads)))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+        self._tasks.put((func, args))
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error('Unhandled exception in {}: {}'.format(threading.current_thread().name, e))
+            with self._lock:
+                self._idle += 1
+
+    def close(self):
+        """
+        Stops the threads once they have finished their current task. The pool can't be used afterwards
+        """
+        with self._lock:
+            for _ in self._threads:
+                self._tasks.put(None)
+
+
+class HedgedRequester(object):
+    """
+    Cuts the tail latency of requests by hedging them. A request that hasn't completed within the hedge quantile (p95 by
+    default) of the recent request latencies is duplicated, and whichever attempt succeeds first is used. The other
+    attempt is left to finish in the background and its result discarded. Hedging at p95 costs roughly 5% more
+    requests, in exchange for the slowest requests taking about the p95 latency plus a typical request rather than
+    however long the slow attempt takes.
+
+    Both attempts run in threads of a shared pool while the caller waits for them. Until enough latencies have been
+    seen to estimate the quantile, requests are made directly by the caller without hedging. A request that fails
+    before the hedge delay isn't hedged, and one that was hedged only fails once both attempts have failed
+    """
+    def __init__(self, hedge_quantile=DEFAULT_HEDGE_QUANTILE, window_size=DEFAULT_WINDOW_SIZE,
+                 min_samples=DEFAULT_MIN_SAMPLES, metrics=None):
+        """
+        Constructor for HedgedRequester
+
+        :param hedge_quantile: Quantile of the recent request latencies after which a request is hedged, from 0 to 1
+        :type hedge_quantile: float
+        :param window_size: Number of recent request latencies the quantile is taken over
+        :type window_size: int
+        :param min_samples: Number of latencies to see before hedging
+        :type min_samples: int
+        :param metrics: Metrics to record the hedged requests, and the requests won by the hedge, in
+        :type metrics: pypianalyser.metrics.Metrics or None
+        """
+        if not 0 < hedge_quantile < 1:
+            raise ValueError('The hedge quantile must be between 0 and 1, got {}'.format(hedge_quantile))
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.metrics = metrics
+        self._latencies = deque(maxlen=window_size)
+        self._recorded_since_update = 0
+        self._hedge_delay = None
+        self._lock = threading.Lock()
+        self._pool = _WorkerPool('hedged-request')
+
+    @property
+    def hedge_delay(self):
+        """
+        Seconds after which a request is hedged, or None until enough latencies have been seen
+        """
+        return self._hedge_delay
+
+    def record_latency(self, seconds):
+        """
+        Records the latency of a single attempt, updating the hedge delay every RECALCULATE_INTERVAL attempts
+
+        :param seconds: Duration of the attempt
+        :type seconds: float
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+            self._recorded_since_update += 1
+            if len(self._latencies) < self.min_samples or (self._hedge_delay is not None and
+                                                           self._recorded_since_update < RECALCULATE_INTERVAL):
+                return
+            latencies = sorted(self._latencies)
+            self._recorded_since_update = 0
+        self._hedge_delay = max(MIN_HEDGE_DELAY,
+                                latencies[min(len(latencies) - 1, int(self.hedge_quantile * len(latencies)))])
+        if self.metrics:
+            self.metrics.set_gauge('hedge_delay_seconds', self._hedge_delay)
+
+    def _attempt(self, func, results, is_hedge):
+        start = time.time()
+        try:
+            result = (is_hedge, True, func())
+        except Exception as e:
+            result = (is_hedge, False, e)
+        self.record_latency(time.time() - start)
+        results.put(result)
+
+    def call(self, func):
+        """
+        Makes a request, hedging it if it is slow
+
+        :param func: Function making the request. It may be called twice, concurrently
+        :type func: callable
+
+        :return: Result of the first attempt to succeed
+        :rtype: object
+        """
+        delay = self._hedge_delay
+        if delay is None:
+            start = time.time()
+            try:
+                return func()
+            finally:
+                self.record_latency(time.time() - start)
+
+        results = queue.Queue()
+        self._pool.submit(self._attempt, func, results, False)
+        attempts = 1
+        finished = 0
+        error = None
+        while True:
+            try:
+                is_hedge, succeeded, value = results.get(timeout=delay if attempts == 1 else None)
+            except queue.Empty:
+                self._pool.submit(self._attempt, func, results, True)
+                attempts += 1
+                if self.metrics:
+                    self.metrics.increment('hedged_requests')
+                continue
+            finished += 1
+            if succeeded:
+                if is_hedge and self.metrics:
+                    self.metrics.increment('hedge_wins')
+                return value
+            if error is None:
+                error = value
+            if finished == attempts:
+                raise error
+
+    def close(self):
+        """
+        Stops the threads making the requests once any in flight have finished. Requests can still be made afterwards,
+        in new threads
+        """
+        pool, self._pool = self._pool, _WorkerPool('hedged-request')
+        pool.close()
@@ -0,0 +1,249 @@
+from collections import OrderedDict
+import logging
+import os
+import sqlite3
+import time
+from pypianalyser.pypi_sqlite_helper import PACKAGE_SEARCH_TABLE
+from pypianalyser.sql_queries import INTEGRITY_CHECK_SQL, QUICK_CHECK_SQL, SEARCH_INDEX_INTEGRITY_CHECK_SQL, \
+    SEARCH_INDEX_OPTIMIZE_SQL, SEARCH_INDEX_MERGE_SQL, SELECT_INDEXED_TABLES_SQL, REINDEX_TABLE_SQL, \
+    SET_ANALYSIS_LIMIT_SQL, ANALYZE_SQL, SELECT_AUTO_VACUUM_SQL, SET_INCREMENTAL_AUTO_VACUUM_SQL, \
+    SELECT_FREELIST_COUNT_SQL, SELECT_PAGE_COUNT_SQL, SELECT_PAGE_SIZE_SQL, INCREMENTAL_VACUUM_SQL, VACUUM_SQL, \
+    WAL_CHECKPOINT_SQL
+from pypianalyser.sqlite_helper import SELECT_TABLE_EXISTS_SQL
+from pypianalyser.options import STEP_INTEGRITY_CHECK, STEP_REINDEX, STEP_OPTIMIZE, STEP_VACUUM, STEP_CHECKPOINT, \
+    MAINTENANCE_STEPS, DEFAULT_BUSY_TIMEOUT, DEFAULT_PAUSE_SECONDS
+
+logger = logging.getLogger(__file__)
+
+AUTO_VACUUM_INCREMENTAL = 2
+# Free pages returned to the filesystem per transaction by an online vacuum
+DEFAULT_VACUUM_BATCH_PAGES = 1000
+# Pages of the search index merged per transaction by an online optimize
+SEARCH_INDEX_MERGE_PAGES = 256
+# Rows of each index sampled by ANALYZE in online mode, bounding how long it holds the lock
+ONLINE_ANALYSIS_LIMIT = 1000
+# Maximum number of problems reported by the integrity check
+MAX_INTEGRITY_ERRORS = 100
+
+
+class DatabaseMaintenance(object):
+    """
+    Maintenance of a database written by the ingest command, to undo the fragmentation left by repeated partial runs,
+    refreshes and merges. Each step is run on its own connection in autocommit mode, outside of
+    PyPiAnalyserSqliteHelper, as VACUUM can't run inside a transaction.
+
+    Offline, each step does as thorough a job as it can in one go: a full integrity check, a full ANALYZE, optimizing
+    the search index into a single segment, a VACUUM that rewrites the file, and a TRUNCATE checkpoint. These hold the
+    write lock for as long as they take, and VACUUM and the checkpoint wait for readers to finish.
+
+    Online, the work is split into short transactions with a pause between them, so that a concurrent ingest or serve
+    only waits for one batch at a time, and readers of the WAL database are never blocked. The integrity check only
+    checks the structure of the file, the indexes are rebuilt a table at a time, ANALYZE samples each index, the search
+    index is merged a few pages at a time, free pages are returned to the filesystem with incremental vacuums, and the
+    checkpoint is passive. The incremental vacuum needs a database created with auto_vacuum=INCREMENTAL, which is the
+    default for new databases. Older databases are switched over by the first offline vacuum
+    """
+    def __init__(self, db_path, online=False, busy_timeout=DEFAULT_BUSY_TIMEOUT, pause_seconds=DEFAULT_PAUSE_SECONDS,
+                 vacuum_batch_pages=DEFAULT_VACUUM_BATCH_PAGES):
+        """
+        Constructor for DatabaseMaintenance
+
+        :param db_path: Path to the database file
+        :type db_path: str
+        :param online: Split the work into short transactions so that the database stays usable while it runs
+        :type online: bool
+        :param busy_timeout: Seconds to wait for a lock held by another connection
+        :type busy_timeout: float
+        :param pause_seconds: Seconds to pause between batches of work in online mode
+        :type pause_seconds: float
+        :param vacuum_batch_pages: Free pages returned to the filesystem per transaction in online mode
+        :type vacuum_batch_pages: int
+        """
+        if not os.path.exists(db_path):
+            raise Exception('Database {} does not exist, run the ingest command first'.format(db_path))
+        self.db_path = db_path
+        self.online = online
+        self.pause_seconds = pause_seconds
+        self.vacuum_batch_pages = vacuum_batch_pages
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None)
+
+    def _pause(self):
+        if self.online and self.pause_seconds:
+            time.sleep(self.pause_seconds)
+
+    def _pragma_value(self, sql):
+        return self._conn.execute(sql).fetchone()[0]
+
+    def _has_search_index(self):
+        return self._conn.execute(SELECT_TABLE_EXISTS_SQL, (PACKAGE_SEARCH_TABLE,)).fetchone() is not None
+
+    def file_size(self):
+        """
+        Returns the size of the database on disk, including its WAL
+
+        :return: Size in bytes
+        :rtype: int
+        """
+        wal_path = self.db_path + '-wal'
+        return os.path.getsize(self.db_path) + (os.path.getsize(wal_path) if os.path.exists(wal_path) else 0)
+
+    def integrity_check(self):
+        """
+        Checks the database for corruption. Only reads, so neither readers nor writers are blocked, but the read
+        snapshot it holds stops checkpoints from getting past it. Online, only the structure of the file is checked
+        (PRAGMA quick_check), not that every index matches its table, which is much quicker
+
+        :return: Problems found, empty if the database is intact
+        :rtype: list
+        """
+        sql = QUICK_CHECK_SQL if self.online else INTEGRITY_CHECK_SQL
+        problems = [x[0] for x in self._conn.execute('{}({:d})'.format(sql, MAX_INTEGRITY_ERRORS)) if x[0] != 'ok']
+        # The search index checks its contents with a write statement, so it is only checked offline
+        if not self.online and self._has_search_index():
+            try:
+                self._conn.execute(SEARCH_INDEX_INTEGRITY_CHECK_SQL)
+            except sqlite3.DatabaseError as e:
+                problems.append('{}: {}'.format(PACKAGE_SEARCH_TABLE, e))
+        for problem in problems:
+            logger.error('Integrity check: {}'.format(problem))
+        return problems
+
+    def reindex(self):
+        """
+        Rebuilds the indexes, a table at a time
+
+        :return: Number of tables whose indexes were rebuilt
+        :rtype: int
+        """
+        tables = [x[0] for x in self._conn.execute(SELECT_INDEXED_TABLES_SQL)]
+        for i, table in enumerate(tables):
+            self._conn.execute(REINDEX_TABLE_SQL.format(table.replace('"', '""')))
+            logger.info('Rebuilt the indexes of {} ({} of {} tables)'.format(table, i + 1, len(tables)))
+            self._pause()
+        return len(tables)
+
+    def optimize(self):
+        """
+        Gathers the statistics the query planner uses to choose indexes, and merges the segments of the search index
+        if there is one
+
+        :return: Number of search index merge batches run, 1 offline
+        :rtype: int
+        """
+        self._conn.execute(SET_ANALYSIS_LIMIT_SQL.format(ONLINE_ANALYSIS_LIMIT if self.online else 0))
+        self._conn.execute(ANALYZE_SQL)
+        logger.info('Analyzed the tables')
+        if not self._has_search_index():
+            return 0
+        self._pause()
+        if not self.online:
+            self._conn.execute(SEARCH_INDEX_OPTIMIZE_SQL)
+            logger.info('Optimized the search index')
+            return 1
+
+        self._conn.execute(SEARCH_INDEX_MERGE_SQL, (-SEARCH_INDEX_MERGE_PAGES,))
+        batches = 1
+        while True:
+            self._pause()
+            changes = self._conn.total_changes
+            self._conn.execute(SEARCH_INDEX_MERGE_SQL, (SEARCH_INDEX_MERGE_PAGES,))
+            batches += 1
+            # Fewer than 2 changes means there was nothing left to merge
+            if self._conn.total_changes - changes < 2:
+                break
+            if batches % 100 == 0:
+                logger.info('Merged {} batches of the search index'.format(batches))
+        logger.info('Merged the search index in {} batches'.format(batches))
+        return batches
+
+    def vacuum(self):
+        """
+        Returns free pages to the filesystem. Offline, the whole file is rewritten, which also defragments the tables
+        and indexes and switches the database to incremental auto-vacuum if it isn't already. Online, free pages are
+        released vacuum_batch_pages at a time with incremental vacuums, which doesn't defragment. A database that
+        doesn't have incremental auto-vacuum is skipped online
+
+        :return: Number of pages freed
+        :rtype: int
+        """
+        page_count = self._pragma_value(SELECT_PAGE_COUNT_SQL)
+        free_pages = self._pragma_value(SELECT_FREELIST_COUNT_SQL)
+        incremental = self._pragma_value(SELECT_AUTO_VACUUM_SQL) == AUTO_VACUUM_INCREMENTAL
+        if not self.online:
+            if not incremental:
+                self._conn.execute(SET_INCREMENTAL_AUTO_VACUUM_SQL)
+            self._conn.execute(VACUUM_SQL)
+            freed = page_count - self._pragma_value(SELECT_PAGE_COUNT_SQL)
+            logger.info('Vacuumed the database, freeing {} of {} pages'.format(freed, page_count))
+            return freed
+
+        if not incremental:
+            logger.warning('{} was created without incremental auto-vacuum, so it can only be vacuumed offline. Run '
+                           'the maintenance without --online once to enable it'.format(self.db_path))
+            return 0
+        while True:
+            remaining = self._pragma_value(SELECT_FREELIST_COUNT_SQL)
+            if not remaining:
+                break
+            # The pragma frees a page per row stepped, so every row has to be fetched
+            self._conn.execute(INCREMENTAL_VACUUM_SQL.format(min(remaining, self.vacuum_batch_pages))).fetchall()
+            logger.info('Vacuumed {} of {} free pages'.format(free_pages - self._pragma_value(SELECT_FREELIST_COUNT_SQL),
+                                                              free_pages))
+            self._pause()
+        return page_count - self._pragma_value(SELECT_PAGE_COUNT_SQL)
+
+    def checkpoint(self):
+        """
+        Copies the pages in the WAL back into the database file. Offline, the WAL is then truncated, which waits for
+        readers. Online, the checkpoint is passive, copying what it can without waiting
+
+        :return: Number of WAL frames and number of those checkpointed, -1 for both if the database isn't in WAL mode
+        :rtype: tuple
+        """
+        _, frames, checkpointed = self._conn.execute(WAL_CHECKPOINT_SQL.format('PASSIVE' if self.online
+                                                                                else 'TRUNCATE')).fetchone()
+        logger.info('Checkpointed {} of {} WAL frames'.format(checkpointed, frames))
+        return frames, checkpointed
+
+    def run(self, steps=None):
+        """
+        Runs maintenance steps, logging the progress of each
+
+        :param steps: Steps to run, from MAINTENANCE_STEPS. They are run in the order of MAINTENANCE_STEPS. All of them
+         if None
+        :type steps: list or None
+
+        :return: Each step run mapped to its result and duration in seconds, plus the size of the database on disk
+         before and after
+        :rtype: collections.OrderedDict
+        """
+        steps = MAINTENANCE_STEPS if steps is None else steps
+        unknown_steps = [x for x in steps if x not in MAINTENANCE_STEPS]
+        if unknown_steps:
+            raise ValueError('Unknown maintenance steps: {}. Must be from {}'.format(', '.join(unknown_steps),
+                                                                                    ', '.join(MAINTENANCE_STEPS)))
+        steps = [x for x in MAINTENANCE_STEPS if x in steps]
+
+        report = OrderedDict([('size_before', self.file_size())])
+        page_size = self._pragma_value(SELECT_PAGE_SIZE_SQL)
+        logger.info('Running {} maintenance on {} ({:.1f} MB, {:.1f} MB free)'.format(
+            'online' if self.online else 'offline', self.db_path, report['size_before'] / 1024.0 ** 2,
+            self._pragma_value(SELECT_FREELIST_COUNT_SQL) * page_size / 1024.0 ** 2))
+        for i, step in enumerate(steps):
+            logger.info('Step {} of {}: {}'.format(i + 1, len(steps), step))
+            start = time.time()
+            result = getattr(self, step)()
+            report[step] = OrderedDict([('result', result), ('seconds', round(time.time() - start, 3))])
+            logger.info('Finished {} in {:.1f}s'.format(step, report[step]['seconds']))
+            if step != steps[-1]:
+                self._pause()
+        report['size_after'] = self.file_size()
+        logger.info('Maintenance finished, the database is {:.1f} MB, from {:.1f} MB'.format(
+            report['size_after'] / 1024.0 ** 2, report['size_before'] / 1024.0 ** 2))
+        return report
+
+    def close(self):
+        """
+        Closes the connection
+        """
+        self._conn.close()
@@ -0,0 +1,137 @@
+import logging
+import os
+import sqlite3
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper, PACKAGE_SEARCH_TABLE, PACKAGE_DESCRIPTIONS_TABLE, \
+    PACKAGE_RELEASE_SUMMARY_TABLE, RELEASE_SUMMARY_COLUMNS
+from pypianalyser.sql_queries import PACKAGE_TABLE_COLUMNS, PACKAGE_RELEASES_TABLE_COLUMNS, ATTACH_MERGE_SOURCE_SQL, \
+    DETACH_MERGE_SOURCE_SQL, SELECT_MERGE_SOURCE_TABLE_EXISTS_SQL, SELECT_MAX_PACKAGE_ID_SQL, MERGE_PACKAGES_SQL, \
+    MERGE_CLASSIFIER_STRINGS_SQL, CREATE_MERGE_PACKAGE_ID_MAP_SQL, INSERT_MERGE_PACKAGE_ID_MAP_SQL, \
+    CREATE_MERGE_CLASSIFIER_ID_MAP_SQL, INSERT_MERGE_CLASSIFIER_ID_MAP_SQL, MERGE_PACKAGE_CLASSIFIERS_SQL, \
+    MERGE_PACKAGE_RELEASES_SQL, MERGE_COMPRESSION_DICTIONARIES_SQL, CREATE_MERGE_DICTIONARY_ID_MAP_SQL, \
+    INSERT_MERGE_DICTIONARY_ID_MAP_SQL, MERGE_PACKAGE_DESCRIPTIONS_SQL, DROP_MERGE_ID_MAPS_SQL_QUERIES, \
+    MERGE_PACKAGE_SYNC_STATE_SQL, MERGE_PACKAGE_RELEASE_SUMMARY_SQL
+from pypianalyser.sqlite_helper import connect_read_only
+
+logger = logging.getLogger(__file__)
+
+MERGED_PACKAGE_COLUMNS = [x for x in PACKAGE_TABLE_COLUMNS if x != 'id']
+MERGED_RELEASE_COLUMNS = [x for x in PACKAGE_RELEASES_TABLE_COLUMNS if x not in ('id', 'package_id')]
+
+
+def _get_tables(db_path):
+    """
+    Lists the tables of a database without modifying it
+
+    :param db_path: Path to the database file
+    :type db_path: str
+
+    :return: Table names
+    :rtype: set
+    """
+    conn = connect_read_only(db_path)
+    try:
+        return set(x[0] for x in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+    finally:
+        conn.close()
+
+
+def _merge_shard(conn, shard_path):
+    """
+    Copies the packages of one shard database into the merged database. Packages that are already in the merged
+    database are skipped along with their classifiers, releases and description
+
+    :param conn: Connection to the merged database
+    :type conn: sqlite3.Connection
+    :param shard_path: Path to the shard database
+    :type shard_path: str
+
+    :return: Number of packages added
+    :rtype: int
+    """
+    conn.execute(ATTACH_MERGE_SOURCE_SQL, (shard_path,))
+    try:
+        with conn:
+            max_package_id = conn.execute(SELECT_MAX_PACKAGE_ID_SQL).fetchone()[0]
+            package_columns = ', '.join(MERGED_PACKAGE_COLUMNS)
+            added = conn.execute(MERGE_PACKAGES_SQL.format(columns=package_columns)).rowcount
+            conn.execute(MERGE_CLASSIFIER_STRINGS_SQL)
+
+            conn.execute(CREATE_MERGE_PACKAGE_ID_MAP_SQL)
+            conn.execute(INSERT_MERGE_PACKAGE_ID_MAP_SQL, (max_package_id,))
+            conn.execute(CREATE_MERGE_CLASSIFIER_ID_MAP_SQL)
+            conn.execute(INSERT_MERGE_CLASSIFIER_ID_MAP_SQL)
+
+            conn.execute(MERGE_PACKAGE_CLASSIFIERS_SQL)
+            release_columns = ', '.join(MERGED_RELEASE_COLUMNS)
+            source_columns = ', '.join('shard_releases.{}'.format(x) for x in MERGED_RELEASE_COLUMNS)
+            conn.execute(MERGE_PACKAGE_RELEASES_SQL.format(columns=release_columns, source_columns=source_columns))
+
+            if conn.execute(SELECT_MERGE_SOURCE_TABLE_EXISTS_SQL, (PACKAGE_DESCRIPTIONS_TABLE,)).fetchone():
+                conn.execute(MERGE_COMPRESSION_DICTIONARIES_SQL)
+                conn.execute(CREATE_MERGE_DICTIONARY_ID_MAP_SQL)
+                conn.execute(INSERT_MERGE_DICTIONARY_ID_MAP_SQL)
+                conn.execute(MERGE_PACKAGE_DESCRIPTIONS_SQL)
+
+            # Shards created before refreshing was added have no sync state
+            if conn.execute(SELECT_MERGE_SOURCE_TABLE_EXISTS_SQL, ('package_sync_state',)).fetchone():
+                conn.execute(MERGE_PACKAGE_SYNC_STATE_SQL)
+            # Shards without release summaries have them summarised from their stored releases once merged
+            if conn.execute(SELECT_MERGE_SOURCE_TABLE_EXISTS_SQL, (PACKAGE_RELEASE_SUMMARY_TABLE,)).fetchone():
+                conn.execute(MERGE_PACKAGE_RELEASE_SUMMARY_SQL.format(
+                    columns=', '.join(['package_id'] + RELEASE_SUMMARY_COLUMNS),
+                    source_columns=', '.join('shard_summary.{}'.format(x) for x in RELEASE_SUMMARY_COLUMNS)))
+
+            for drop_sql in DROP_MERGE_ID_MAPS_SQL_QUERIES:
+                conn.execute(drop_sql)
+    finally:
+        conn.execute(DETACH_MERGE_SOURCE_SQL)
+    return added
+
+
+def merge_databases(output_path, shard_paths):
+    """
+    Merges the databases written by the nodes of a sharded crawl into one. The shards are folded in one at a time with
+    bulk INSERT ... SELECT statements, remapping the package, classifier and compression dictionary IDs of each shard to
+    those of the merged database. The search index and rollup tables are rebuilt once every shard has been merged.
+
+    The merged database can be an existing database, in which case the shards are added to it. If any shard has a
+    search index or compressed descriptions then so does the merged database
+
+    :param output_path: Path of the merged database
+    :type output_path: str
+    :param shard_paths: Paths of the shard databases
+    :type shard_paths: list
+
+    :return: Number of packages added to the merged database
+    :rtype: int
+    """
+    for shard_path in shard_paths:
+        if not os.path.exists(shard_path):
+            raise Exception('Shard database {} does not exist'.format(shard_path))
+        if os.path.abspath(shard_path) == os.path.abspath(output_path):
+            raise Exception('Cannot merge {} into itself'.format(shard_path))
+    shard_tables = [_get_tables(x) for x in shard_paths]
+
+    # Create the merged database with every feature used by the shards
+    db_helper = PyPiAnalyserSqliteHelper(output_path,
+                                         enable_search_index=any(PACKAGE_SEARCH_TABLE in x for x in shard_tables),
+                                         compress_descriptions=any(PACKAGE_DESCRIPTIONS_TABLE in x for x in shard_tables))
+    db_helper.close()
+
+    total_added = 0
+    conn = sqlite3.connect(output_path)
+    try:
+        for shard_path in shard_paths:
+            added = _merge_shard(conn, shard_path)
+            logger.info('Merged {} packages from {}'.format(added, shard_path))
+            total_added += added
+    finally:
+        conn.close()
+
+    db_helper = PyPiAnalyserSqliteHelper(output_path)
+    try:
+        db_helper.rebuild_derived_tables()
+    finally:
+        db_helper.close()
+    logger.info('Merged {} packages from {} shards into {}'.format(total_added, len(shard_paths), output_path))
+    return total_added
@@ -0,0 +1,347 @@
+from bisect import bisect_left
+from collections import OrderedDict
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__file__)
+
+METRIC_PREFIX = 'pypianalyser_'
+# Upper bounds, in seconds, of the latency histogram buckets. Anything slower lands in the implicit +Inf bucket
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_REPORT_INTERVAL = 30
+
+
+def _metric_key(name, labels):
+    """
+    Builds the key a metric is stored under, the name plus its labels as a sorted tuple of pairs
+
+    :param name: Metric name
+    :type name: str
+    :param labels: Label names mapped to values, or None
+    :type labels: dict or None
+
+    :return: Metric key
+    :rtype: tuple
+    """
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+class _Shard(object):
+    """
+    Metrics recorded by a single thread. Only the owning thread writes to a shard, so recording never takes a lock
+    """
+    def __init__(self):
+        self.counters = {}
+        # Histogram key mapped to [bucket counts, sum, count]
+        self.histograms = {}
+
+
+class Metrics(object):
+    """
+    Thread safe counters, gauges and histograms with negligible contention on the recording side. Each thread records
+    into its own shard, and the shards are only merged when a snapshot is taken
+    """
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Constructor for Metrics
+
+        :param latency_buckets: Sorted upper bounds of the histogram buckets
+        :type latency_buckets: tuple
+        """
+        self.buckets = tuple(latency_buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._gauges = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard()
+            self._local.shard = shard
+            # The lock is only taken the first time each thread records something
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def increment(self, name, amount=1, labels=None):
+        """
+        Adds to a counter
+
+        :param name: Counter name
+        :type name: str
+        :param amount: Amount to add
+        :type amount: int or float
+        :param labels: Label names mapped to values, e.g. {'type': 'Exception404'}
+        :type labels: dict or None
+        """
+        counters = self._shard().counters
+        key = _metric_key(name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        """
+        Records a value, typically a duration in seconds, in a histogram
+
+        :param name: Histogram name
+        :type name: str
+        :param value: Value to record
+        :type value: float
+        :param labels: Label names mapped to values
+        :type labels: dict or None
+        """
+        histograms = self._shard().histograms
+        key = _metric_key(name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histograms[key] = histogram
+        histogram[0][bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def set_gauge(self, name, value, labels=None):
+        """
+        Sets a gauge to the given value
+
+        :param name: Gauge name
+        :type name: str
+        :param value: Current value
+        :type value: int or float
+        :param labels: Label names mapped to values
+        :type labels: dict or None
+        """
+        self._gauges[_metric_key(name, labels)] = value
+
+    def snapshot(self):
+        """
+        Merges the shards of every thread into a point in time view of the metrics
+
+        :return: 'counters', 'gauges' and 'histograms', each mapping metric keys to values. Histogram values are
+         [bucket counts, sum, count]
+        :rtype: dict
+        """
+        with self._shards_lock:
+            shards = list(self._shards)
+        counters = {}
+        histograms = {}
+        for shard in shards:
+            # Copying a dict is atomic under the GIL, so the owning thread can keep recording while this runs
+            for key, value in dict(shard.counters).items():
+                counters[key] = counters.get(key, 0) + value
+            for key, (bucket_counts, total, count) in dict(shard.histograms).items():
+                merged = histograms.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                merged[0] = [x + y for x, y in zip(merged[0], bucket_counts)]
+                merged[1] += total
+                merged[2] += count
+        return {'counters': counters, 'gauges': dict(self._gauges), 'histograms': histograms}
+
+    def get_counter(self, name, labels=None):
+        """
+        Returns the current total of a counter across all threads
+
+        :param name: Counter name
+        :type name: str
+        :param labels: Label names mapped to values
+        :type labels: dict or None
+
+        :return: Counter total
+        :rtype: int or float
+        """
+        key = _metric_key(name, labels)
+        with self._shards_lock:
+            shards = list(self._shards)
+        return sum(shard.counters.get(key, 0) for shard in shards)
+
+    def estimate_quantile(self, histogram, quantile):
+        """
+        Estimates a quantile of a histogram as the upper bound of the bucket it falls in
+
+        :param histogram: [bucket counts, sum, count] from snapshot()
+        :type histogram: list
+        :param quantile: Quantile, e.g. 0.99
+        :type quantile: float
+
+        :return: Estimated value, infinity if it is beyond the last bucket, or None for an empty histogram
+        :rtype: float or None
+        """
+        bucket_counts, _, count = histogram
+        if not count:
+            return None
+        rank = quantile * count
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return upper_bound
+        return float('inf')
+
+    def to_dict(self, snapshot=None):
+        """
+        Summarises the metrics as a JSON serialisable dict, with the count, mean, p50 and p99 of each histogram
+
+        :param snapshot: Snapshot to summarise, or None to take one
+        :type snapshot: dict or None
+
+        :return: Metric names (with any labels) mapped to values
+        :rtype: OrderedDict
+        """
+        snapshot = snapshot or self.snapshot()
+        ret_val = OrderedDict()
+        for key, value in sorted(snapshot['counters'].items()):
+            ret_val[_format_name(key)] = value
+        for key, value in sorted(snapshot['gauges'].items()):
+            ret_val[_format_name(key)] = value
+        for key, histogram in sorted(snapshot['histograms'].items()):
+            name = _format_name(key)
+            count = histogram[2]
+            ret_val[name] = OrderedDict([
+                ('count', count),
+                ('mean', histogram[1] / count if count else None),
+                ('p50', self.estimate_quantile(histogram, 0.5)),
+                ('p99', self.estimate_quantile(histogram, 0.99)),
+            ])
+        return ret_val
+
+    def to_prometheus(self, snapshot=None):
+        """
+        Formats the metrics in the Prometheus text exposition format. Counters are suffixed with _total
+
+        :param snapshot: Snapshot to format, or None to take one
+        :type snapshot: dict or None
+
+        :return: Prometheus text
+        :rtype: str
+        """
+        snapshot = snapshot or self.snapshot()
+        lines = []
+        for metric_type, suffix, values in [('counter', '_total', snapshot['counters']),
+                                            ('gauge', '', snapshot['gauges'])]:
+            last_name = None
+            for (name, labels), value in sorted(values.items()):
+                full_name = METRIC_PREFIX + name + suffix
+                if name != last_name:
+                    lines.append('# TYPE {} {}'.format(full_name, metric_type))
+                    last_name = name
+                lines.append('{}{} {}'.format(full_name, _format_labels(labels), value))
+
+        last_name = None
+        for (name, labels), (bucket_counts, total, count) in sorted(snapshot['histograms'].items()):
+            full_name = METRIC_PREFIX + name
+            if name != last_name:
+                lines.append('# TYPE {} histogram'.format(full_name))
+                last_name = name
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (('le', str(upper_bound)),)
+                lines.append('{}_bucket{} {}'.format(full_name, _format_labels(bucket_labels), cumulative))
+            lines.append('{}_sum{} {}'.format(full_name, _format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(full_name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_file(self, file_path, snapshot=None):
+        """
+        Writes the metrics in the Prometheus text format. The file is replaced atomically so that a scraper (e.g. the
+        node_exporter textfile collector) never reads a partially written file
+
+        :param file_path: Path of the file to write
+        :type file_path: str
+        :param snapshot: Snapshot to write, or None to take one
+        :type snapshot: dict or None
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(self.to_prometheus(snapshot))
+            if hasattr(os, 'replace'):
+                os.replace(temp_path, file_path)
+            else:
+                os.rename(temp_path, file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def _format_name(key):
+    name, labels = key
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}={}'.format(k, v) for k, v in labels))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return '{{{}}}'.format(','.join('{}="{}"'.format(k, v) for k, v in escaped))
+
+
+class MetricsReporter(threading.Thread):
+    """
+    Background thread that periodically samples gauges, logs the metrics as a single JSON line and/or writes them to a
+    Prometheus text file
+    """
+    def __init__(self, metrics, interval=DEFAULT_REPORT_INTERVAL, prometheus_file=None, log_metrics=True,
+                 samplers=None):
+        """
+        Constructor for MetricsReporter
+
+        :param metrics: Metrics to report
+        :type metrics: Metrics
+        :param interval: Seconds between reports
+        :type interval: float
+        :param prometheus_file: Path of the Prometheus text file to write, or None
+        :type prometheus_file: str or None
+        :param log_metrics: Log the metrics as a JSON line on every report
+        :type log_metrics: bool
+        :param samplers: Callables run before each report, which typically set gauges
+        :type samplers: list or None
+        """
+        threading.Thread.__init__(self, name='metrics-reporter')
+        self.daemon = True
+        self.metrics = metrics
+        self.interval = interval
+        self.prometheus_file = prometheus_file
+        self.log_metrics = log_metrics
+        self.samplers = samplers or []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.report()
+
+    def report(self):
+        """
+        Samples the gauges and reports the metrics
+        """
+        for sampler in self.samplers:
+            try:
+                sampler()
+            except Exception as e:
+                logger.debug('Metrics sampler failed: {}'.format(e))
+        snapshot = self.metrics.snapshot()
+        if self.log_metrics:
+            summary = self.metrics.to_dict(snapshot)
+            summary['timestamp'] = round(time.time(), 3)
+            logger.info('metrics {}'.format(json.dumps(summary)))
+        if self.prometheus_file:
+            try:
+                self.metrics.write_prometheus_file(self.prometheus_file, snapshot)
+            except (IOError, OSError) as e:
+                logger.error('Failed to write the metrics file {}: {}'.format(self.prometheus_file, e))
+
+    def stop(self):
+        """
+        Stops the thread and makes a final report
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.report()
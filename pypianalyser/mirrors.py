@@ -0,0 +1,204 @@
+import logging
+import random
+import threading
+import time
+from pypianalyser.exceptions import Exception404
+from pypianalyser.pypi_index_helpers import METADATA_URL_PATH, join_index_url
+
+logger = logging.getLogger(__file__)
+
+# Weight of the latest request in the moving averages of latency and errors
+DEFAULT_SMOOTHING = 0.2
+# Consecutive failures after which a mirror is taken out of rotation, and for how long
+DEFAULT_MAX_FAILURES = 3
+DEFAULT_COOLDOWN_SECONDS = 30
+# How much an error rate of 1 divides a mirror's weight by, on top of its latency
+ERROR_RATE_PENALTY = 20
+# Floor on the latency used for weighting, so a mirror with a handful of very fast responses can't take all the traffic
+MIN_WEIGHTING_LATENCY = 0.01
+
+
+class Mirror(object):
+    """
+    A PyPi index or mirror, and the health of the requests made to it
+    """
+    def __init__(self, url):
+        """
+        Constructor for Mirror
+
+        :param url: Base URL of the index, which must serve both /simple and /pypi/<package>/json
+        :type url: str
+        """
+        self.url = url
+        self.metadata_url_format = join_index_url(url, METADATA_URL_PATH)
+        # Moving averages, None until the first request
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.unavailable_until = 0
+
+    def is_available(self, now):
+        return now >= self.unavailable_until
+
+    def __repr__(self):
+        return 'Mirror({})'.format(self.url)
+
+
+class MirrorPool(object):
+    """
+    Spreads requests across several mirrors of the PyPi index. Each request goes to a mirror picked at random, weighted
+    by the inverse of its moving average latency and penalised by its moving average error rate, so faster and healthier
+    mirrors take a larger share of the requests. Mirrors that haven't been used yet are weighted as the fastest, so each
+    is tried early on.
+
+    A request that fails is retried on another mirror. A mirror that fails max_failures times in a row is taken out of
+    rotation for cooldown_seconds, after which one request is let through to see if it has recovered. If every mirror is
+    out of rotation they are all used rather than failing.
+
+    A 404 from one mirror is also retried on the others, as partial mirrors (e.g. bandersnatch with filters) don't hold
+    every package. The package is only reported as not found once every mirror has been tried and none had an error
+    """
+    def __init__(self, urls, smoothing=DEFAULT_SMOOTHING, max_failures=DEFAULT_MAX_FAILURES,
+                 cooldown_seconds=DEFAULT_COOLDOWN_SECONDS, metrics=None, rng=None):
+        """
+        Constructor for MirrorPool
+
+        :param urls: Base URLs of the mirrors. Duplicates are ignored
+        :type urls: list
+        :param smoothing: Weight of the latest request in the moving averages, from 0 to 1
+        :type smoothing: float
+        :param max_failures: Consecutive failures after which a mirror is taken out of rotation
+        :type max_failures: int
+        :param cooldown_seconds: Seconds a failing mirror is taken out of rotation for
+        :type cooldown_seconds: float
+        :param metrics: Metrics to record the requests and failovers of each mirror in
+        :type metrics: pypianalyser.metrics.Metrics or None
+        :param rng: Random number generator to pick mirrors with
+        :type rng: random.Random or None
+        """
+        self.mirrors = []
+        for url in urls:
+            if url not in [x.url for x in self.mirrors]:
+                self.mirrors.append(Mirror(url))
+        if not self.mirrors:
+            raise ValueError('At least one mirror is required')
+        self.smoothing = smoothing
+        self.max_failures = max_failures
+        self.cooldown_seconds = cooldown_seconds
+        self.metrics = metrics
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def _weight(self, mirror, fastest_latency):
+        latency = mirror.latency if mirror.latency is not None else fastest_latency
+        return 1.0 / (max(latency, MIN_WEIGHTING_LATENCY) * (1 + ERROR_RATE_PENALTY * mirror.error_rate))
+
+    def choose(self, exclude=()):
+        """
+        Picks a mirror for a request
+
+        :param exclude: Mirrors not to pick, e.g. those already tried by the request
+        :type exclude: iterable
+
+        :return: Mirror, or None if every mirror is excluded
+        :rtype: Mirror or None
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [x for x in self.mirrors if x not in exclude]
+            if not candidates:
+                return None
+            available = [x for x in candidates if x.is_available(now)]
+            # Mirrors that are out of rotation are still used once nothing else is left
+            candidates = available or candidates
+            if len(candidates) == 1:
+                return candidates[0]
+            known_latencies = [x.latency for x in candidates if x.latency is not None]
+            fastest_latency = min(known_latencies) if known_latencies else MIN_WEIGHTING_LATENCY
+            weights = [self._weight(x, fastest_latency) for x in candidates]
+            point = self._rng.uniform(0, sum(weights))
+            for mirror, weight in zip(candidates, weights):
+                point -= weight
+                if point <= 0:
+                    return mirror
+            return candidates[-1]
+
+    def record_success(self, mirror, seconds):
+        """
+        Records a request that a mirror answered, including with a 404
+
+        :param mirror: Mirror the request was made to
+        :type mirror: Mirror
+        :param seconds: Duration of the request
+        :type seconds: float
+        """
+        with self._lock:
+            if mirror.latency is None:
+                mirror.latency = seconds
+            else:
+                mirror.latency += self.smoothing * (seconds - mirror.latency)
+            mirror.error_rate -= self.smoothing * mirror.error_rate
+            mirror.consecutive_failures = 0
+            mirror.unavailable_until = 0
+        if self.metrics:
+            self.metrics.set_gauge('mirror_latency_seconds', mirror.latency, labels={'mirror': mirror.url})
+
+    def record_failure(self, mirror):
+        """
+        Records a request that failed, taking the mirror out of rotation if it has failed too many times in a row
+
+        :param mirror: Mirror the request was made to
+        :type mirror: Mirror
+        """
+        with self._lock:
+            mirror.error_rate += self.smoothing * (1 - mirror.error_rate)
+            mirror.consecutive_failures += 1
+            if mirror.consecutive_failures >= self.max_failures:
+                if mirror.is_available(time.time()):
+                    logger.warning('Taking {} out of rotation for {} seconds after {} consecutive failures'
+                                   .format(mirror.url, self.cooldown_seconds, mirror.consecutive_failures))
+                mirror.unavailable_until = time.time() + self.cooldown_seconds
+
+    def request(self, func):
+        """
+        Makes a request to the mirrors, failing over to the next mirror until one succeeds
+
+        :param func: Function making the request, called with the Mirror to use
+        :type func: callable
+
+        :return: Result of the first successful call
+        :rtype: object
+        """
+        tried = []
+        not_found = None
+        error = None
+        while True:
+            mirror = self.choose(exclude=tried)
+            if mirror is None:
+                break
+            if tried and self.metrics:
+                self.metrics.increment('mirror_failovers')
+            tried.append(mirror)
+            start = time.time()
+            try:
+                result = func(mirror)
+            except Exception404 as e:
+                self.record_success(mirror, time.time() - start)
+                self._increment_requests(mirror, 'not_found')
+                not_found = e
+                continue
+            except Exception as e:
+                self.record_failure(mirror)
+                self._increment_requests(mirror, 'error')
+                logger.debug('Request to {} failed: {}'.format(mirror.url, e))
+                error = e
+                continue
+            self.record_success(mirror, time.time() - start)
+            self._increment_requests(mirror, 'ok')
+            return result
+        # An error from any mirror means the package may exist, so it isn't reported as not found
+        raise error if error is not None else not_found
+
+    def _increment_requests(self, mirror, result):
+        if self.metrics:
+            self.metrics.increment('mirror_requests', labels={'mirror': mirror.url, 'result': result})
@@ -0,0 +1,331 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import six
+
+NAME_INDEX_SUFFIX = '.names'
+NAME_INDEX_MAGIC = b'PNIX'
+NAME_INDEX_VERSION = 1
+# Number of names in each front-coded block. Only the first name of a block is stored whole, so larger blocks are
+# smaller on disk but slower to search
+DEFAULT_BLOCK_SIZE = 16
+# 10 bits per name and 7 hashes gives a false positive rate of about 1%
+DEFAULT_BLOOM_BITS_PER_NAME = 10
+BLOOM_HASH_COUNT = 7
+
+# magic, version, name count, block size, block count, Bloom filter hash count, Bloom filter bytes, blob bytes, and
+# the two stamp values
+_HEADER = struct.Struct('<4sIIIIIQQqq')
+_OFFSET = struct.Struct('<I')
+_BYTE = struct.Struct('B')
+
+
+def _encode_varint(value, buf):
+    while value >= 0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _decode_varint(data, pos):
+    """
+    Decodes an unsigned LEB128 integer
+
+    :param data: Data to decode from
+    :type data: bytearray
+    :param pos: Position of the integer
+    :type pos: int
+
+    :return: The integer and the position after it
+    :rtype: tuple
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _bloom_positions(name, hash_count, bit_count):
+    # Double hashing, the k positions are derived from two halves of one digest
+    h1, h2 = struct.unpack('<QQ', hashlib.md5(name).digest())
+    return [(h1 + i * h2) % bit_count for i in range(hash_count)]
+
+
+def _common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    i = 0
+    while i < length and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class NameIndex(object):
+    """
+    Compact, read-only set of package names stored in a file, for membership checks against hundreds of thousands of
+    names without holding them all in memory as Python strings.
+
+    The names are sorted by their UTF-8 bytes and front-coded in blocks: the first name of each block is stored whole,
+    and every other name as the length of the prefix it shares with the name before it plus the rest of the name. An
+    array of block offsets allows a binary search over the first names of the blocks, followed by a scan of one block.
+    An optional Bloom filter in front of the blocks answers most checks for names that aren't in the index without a
+    search.
+
+    The file is memory-mapped rather than read, so opening it takes about the same time however many names it holds,
+    and the pages are shared between processes that open the same index. Each index carries a stamp of two integers,
+    set by whoever builds it, identifying the state of the source it was built from (see load_name_index())
+    """
+    def __init__(self, path):
+        """
+        Opens an index built with NameIndex.build()
+
+        :param path: Path to the index file
+        :type path: str
+        """
+        self.path = path
+        self._fp = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._fp.close()
+            raise
+        try:
+            if len(self._mmap) < _HEADER.size:
+                raise ValueError('{} is not a name index'.format(path))
+            (magic, version, self._count, self.block_size, self._block_count, self._bloom_hash_count, bloom_size,
+             blob_size, stamp_a, stamp_b) = _HEADER.unpack_from(self._mmap, 0)
+            if magic != NAME_INDEX_MAGIC:
+                raise ValueError('{} is not a name index'.format(path))
+            if version != NAME_INDEX_VERSION:
+                raise ValueError('{} is version {} of the name index format, expected {}'.format(path, version,
+                                                                                              NAME_INDEX_VERSION))
+        except Exception:
+            self.close()
+            raise
+        self.stamp = (stamp_a, stamp_b)
+        self._bloom_start = _HEADER.size
+        self._bloom_bits = bloom_size * 8
+        self._offsets_start = self._bloom_start + bloom_size
+        self._blob_start = self._offsets_start + self._block_count * _OFFSET.size
+        self._blob_size = blob_size
+
+    @classmethod
+    def build(cls, path, names, stamp=(0, 0), block_size=DEFAULT_BLOCK_SIZE,
+              bloom_bits_per_name=DEFAULT_BLOOM_BITS_PER_NAME):
+        """
+        Builds an index file. The file is written to a temporary file and renamed into place, so an index that is open
+        elsewhere is never seen half written
+
+        :param path: Path to write the index to
+        :type path: str
+        :param names: Names to index. Duplicates are dropped
+        :type names: iterable
+        :param stamp: Two integers identifying the state of the source the names came from
+        :type stamp: tuple
+        :param block_size: Number of names in each front-coded block
+        :type block_size: int
+        :param bloom_bits_per_name: Size of the Bloom filter in bits per name, 0 for no Bloom filter
+        :type bloom_bits_per_name: int
+
+        :return: Number of names indexed
+        :rtype: int
+        """
+        if block_size < 1:
+            raise ValueError('The block size must be at least 1')
+        # Sorted before the duplicates are dropped rather than put in a set, so that names that are mostly in order
+        # already (e.g. those of an existing index followed by a few new ones) are sorted in about linear time
+        encoded_names = sorted(x.encode('utf-8') if isinstance(x, six.text_type) else x for x in names)
+        encoded_names = [x for i, x in enumerate(encoded_names) if not i or x != encoded_names[i - 1]]
+
+        blob = bytearray()
+        offsets = bytearray()
+        previous = b''
+        for i, name in enumerate(encoded_names):
+            if i % block_size == 0:
+                offsets += _OFFSET.pack(len(blob))
+                _encode_varint(len(name), blob)
+                blob += name
+            else:
+                shared = _common_prefix_length(previous, name)
+                _encode_varint(shared, blob)
+                _encode_varint(len(name) - shared, blob)
+                blob += name[shared:]
+            previous = name
+
+        bloom = bytearray()
+        if bloom_bits_per_name > 0 and encoded_names:
+            bloom = bytearray((len(encoded_names) * bloom_bits_per_name + 7) // 8)
+            for name in encoded_names:
+                for position in _bloom_positions(name, BLOOM_HASH_COUNT, len(bloom) * 8):
+                    bloom[position >> 3] |= 1 << (position & 7)
+
+        header = _HEADER.pack(NAME_INDEX_MAGIC, NAME_INDEX_VERSION, len(encoded_names), block_size,
+                              len(offsets) // _OFFSET.size, BLOOM_HASH_COUNT if bloom else 0, len(bloom), len(blob),
+                              stamp[0], stamp[1])
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for part in (header, bloom, offsets, blob):
+                    fp.write(bytes(part))
+            if hasattr(os, 'replace'):
+                os.replace(temp_path, path)
+            else:
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return len(encoded_names)
+
+    def _block_offset(self, block):
+        return self._blob_start + _OFFSET.unpack_from(self._mmap, self._offsets_start + block * _OFFSET.size)[0]
+
+    def _first_name(self, block):
+        pos = self._block_offset(block)
+        length = 0
+        shift = 0
+        while True:
+            byte = _BYTE.unpack_from(self._mmap, pos)[0]
+            pos += 1
+            length |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        return self._mmap[pos:pos + length]
+
+    def _iter_block(self, block):
+        """
+        Decodes the names of a block
+
+        :param block: Index of the block
+        :type block: int
+
+        :return: Generator of UTF-8 encoded names
+        :rtype: generator
+        """
+        start = self._block_offset(block)
+        end = self._block_offset(block + 1) if block + 1 < self._block_count else self._blob_start + self._blob_size
+        data = bytearray(self._mmap[start:end])
+        length, pos = _decode_varint(data, 0)
+        name = data[pos:pos + length]
+        pos += length
+        yield bytes(name)
+        while pos < len(data):
+            shared, pos = _decode_varint(data, pos)
+            length, pos = _decode_varint(data, pos)
+            name = name[:shared] + data[pos:pos + length]
+            pos += length
+            yield bytes(name)
+
+    def _bloom_contains(self, name):
+        for position in _bloom_positions(name, self._bloom_hash_count, self._bloom_bits):
+            byte = _BYTE.unpack_from(self._mmap, self._bloom_start + (position >> 3))[0]
+            if not byte & (1 << (position & 7)):
+                return False
+        return True
+
+    def __contains__(self, name):
+        if not self._block_count:
+            return False
+        key = name.encode('utf-8') if isinstance(name, six.text_type) else name
+        if self._bloom_hash_count and not self._bloom_contains(key):
+            return False
+
+        # Find the last block whose first name is not after the key
+        if key < self._first_name(0):
+            return False
+        low, high = 0, self._block_count - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._first_name(middle) <= key:
+                low = middle
+            else:
+                high = middle - 1
+        for indexed_name in self._iter_block(low):
+            if indexed_name == key:
+                return True
+            elif indexed_name > key:
+                return False
+        return False
+
+    def __iter__(self):
+        """
+        Iterates over the names in sorted order, decoding one block at a time
+        """
+        for block in range(self._block_count):
+            for name in self._iter_block(block):
+                yield name.decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps and closes the index file
+        """
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def load_name_index(path, stamp, load_names, load_added_names=None, **build_kwargs):
+    """
+    Opens a name index, first rebuilding it if it doesn't exist or was built from a different state of its source. If
+    names have only been added to the source since, the index is rebuilt from its own names and the added ones rather
+    than from the whole source
+
+    :param path: Path to the index file
+    :type path: str
+    :param stamp: Two integers identifying the current state of the source, e.g. the row count and maximum ID of a
+     table, or the size and modification time of a file
+    :type stamp: tuple
+    :param load_names: Function returning an iterable of the names in the source, only called if the index is rebuilt
+    :type load_names: callable
+    :param load_added_names: Function called with the stamp of an out of date index, returning an iterable of the names
+     added to the source since, or None if the source has changed in some other way. None to always rebuild from
+     load_names
+    :type load_added_names: callable or None
+    :param build_kwargs: Keyword arguments for NameIndex.build()
+
+    :return: Open index
+    :rtype: NameIndex
+    """
+    stamp = tuple(int(x) for x in stamp)
+    names = None
+    if os.path.exists(path):
+        try:
+            index = NameIndex(path)
+        except ValueError:
+            # Not an index, or an older version of the format
+            index = None
+        if index is not None:
+            if index.stamp == stamp:
+                return index
+            try:
+                added_names = load_added_names(index.stamp) if load_added_names else None
+                if added_names is not None:
+                    names = list(index)
+                    names.extend(added_names)
+            finally:
+                # Closed before the new index replaces it, which Windows doesn't allow for a file that is mapped
+                index.close()
+    NameIndex.build(path, load_names() if names is None else names, stamp, **build_kwargs)
+    return NameIndex(path)
@@ -0,0 +1,33 @@
+"""
+Choices and defaults of the command line options. They are kept apart from the modules that implement the commands, and
+imported from here by them, so that the command line parser can be built without importing those modules and their
+dependencies
+"""
+
+# pypianalyser.pypi_metadata_retriever
+DEFAULT_MAX_QUEUED_PACKAGES = 100
+
+# pypianalyser.profiling
+PROFILE_MODE_CPU = 'cpu'
+PROFILE_MODE_SAMPLE = 'sample'
+PROFILE_MODE_MEMORY = 'memory'
+PROFILE_MODES = [PROFILE_MODE_CPU, PROFILE_MODE_SAMPLE, PROFILE_MODE_MEMORY]
+
+# pypianalyser.server
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+DEFAULT_CACHE_SIZE = 10000
+
+# pypianalyser.maintenance
+STEP_INTEGRITY_CHECK = 'integrity_check'
+STEP_REINDEX = 'reindex'
+STEP_OPTIMIZE = 'optimize'
+STEP_VACUUM = 'vacuum'
+STEP_CHECKPOINT = 'checkpoint'
+# In the order they are run. The statistics are gathered after the indexes are rebuilt, and the WAL is checkpointed last
+# so that it holds none of the pages written by the other steps
+MAINTENANCE_STEPS = [STEP_INTEGRITY_CHECK, STEP_REINDEX, STEP_OPTIMIZE, STEP_VACUUM, STEP_CHECKPOINT]
+# Seconds to wait for a lock held by another connection before a statement fails
+DEFAULT_BUSY_TIMEOUT = 30
+# Seconds to pause between the batches of work in online mode, so that other writers can take the lock
+DEFAULT_PAUSE_SECONDS = 0.05
@@ -0,0 +1,196 @@
+import fnmatch
+from io import open
+import re
+
+ACTION_INCLUDE = 'include'
+ACTION_EXCLUDE = 'exclude'
+RULE_PREFIX = 'prefix'
+RULE_GLOB = 'glob'
+RULE_REGEX = 'regex'
+RULE_TYPES = [RULE_PREFIX, RULE_GLOB, RULE_REGEX]
+
+
+class PrefixTrie(object):
+    """
+    Character trie of name prefixes. Checking a name against every prefix walks at most one path of the trie, so it
+    costs the same however many prefixes there are
+    """
+    # Key marking the end of a prefix. Names are single characters so it can't clash with one
+    _END = ''
+
+    def __init__(self, prefixes=None):
+        """
+        Constructor for PrefixTrie
+
+        :param prefixes: Prefixes to add
+        :type prefixes: list or None
+        """
+        self._root = {}
+        self.size = 0
+        for prefix in prefixes or []:
+            self.add(prefix)
+
+    def add(self, prefix):
+        """
+        Adds a prefix
+
+        :param prefix: Prefix to add
+        :type prefix: str
+        """
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if self._END not in node:
+            node[self._END] = True
+            self.size += 1
+
+    def matches(self, name):
+        """
+        Checks if a name starts with any of the prefixes
+
+        :param name: Name to check
+        :type name: str
+
+        :return: True if the name starts with a prefix
+        :rtype: bool
+        """
+        node = self._root
+        if self._END in node:
+            return True
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                return False
+            if self._END in node:
+                return True
+        return False
+
+
+class _RuleSet(object):
+    """
+    Prefix, glob and regex rules of one action, compiled into a trie for the prefixes and a single regex alternation for
+    the globs and regexes
+    """
+    def __init__(self):
+        self.prefixes = PrefixTrie()
+        self.patterns = []
+        self._regex = None
+
+    def add(self, rule_type, pattern):
+        if rule_type == RULE_PREFIX:
+            self.prefixes.add(pattern)
+        elif rule_type == RULE_GLOB:
+            # Globs match the whole name, unlike regexes which are searched for anywhere in it
+            self.patterns.append('^' + fnmatch.translate(pattern))
+        elif rule_type == RULE_REGEX:
+            # Compiled on its own first so that a bad pattern is reported on its own
+            re.compile(pattern)
+            self.patterns.append(pattern)
+        else:
+            raise ValueError('Unknown rule type: {}. Must be one of {}'.format(rule_type, ', '.join(RULE_TYPES)))
+        self._regex = None
+
+    @property
+    def is_empty(self):
+        return not self.prefixes.size and not self.patterns
+
+    def matches(self, name):
+        if self.prefixes.matches(name):
+            return True
+        if not self.patterns:
+            return False
+        if self._regex is None:
+            self._regex = re.compile('|'.join('(?:{})'.format(x) for x in self.patterns))
+        return self._regex.search(name) is not None
+
+
+class PackageFilter(object):
+    """
+    Selects package names with include and exclude rules. A name is selected if it matches any include rule (or there
+    are no include rules) and no exclude rule. The rules of each action are compiled into a single matcher, so hundreds
+    of rules are checked in one pass over the package list rather than one pass per rule.
+
+    Rules are one of:
+    - prefix: the name starts with the pattern
+    - glob: the whole name matches a shell-style pattern, e.g. robotframework-*
+    - regex: the regex is found anywhere in the name, as with --package_regex. Inline flags such as (?i) can't be used,
+      as the regexes are combined into one
+    """
+    def __init__(self):
+        self._include = _RuleSet()
+        self._exclude = _RuleSet()
+
+    def add_rule(self, action, rule_type, pattern):
+        """
+        Adds a rule
+
+        :param action: 'include' or 'exclude'
+        :type action: str
+        :param rule_type: 'prefix', 'glob' or 'regex'
+        :type rule_type: str
+        :param pattern: Prefix, glob or regex to match normalized package names against
+        :type pattern: str
+        """
+        if action == ACTION_INCLUDE:
+            self._include.add(rule_type, pattern)
+        elif action == ACTION_EXCLUDE:
+            self._exclude.add(rule_type, pattern)
+        else:
+            raise ValueError('Unknown rule action: {}. Must be {} or {}'.format(action, ACTION_INCLUDE, ACTION_EXCLUDE))
+
+    @classmethod
+    def from_file(cls, file_path):
+        """
+        Loads a filter from a file of rules, one per line in the form '<include|exclude> <prefix|glob|regex> <pattern>'.
+        Blank lines and lines starting with # are ignored. For example:
+
+            include prefix robotframework-
+            include glob *-django
+            exclude regex -(test|dev)$
+
+        :param file_path: Path to the filter file
+        :type file_path: str
+
+        :return: Package filter
+        :rtype: PackageFilter
+        """
+        package_filter = cls()
+        with open(file_path, 'r', encoding='utf-8') as fp:
+            for line_number, line in enumerate(fp, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split(None, 2)
+                if len(parts) != 3:
+                    raise ValueError('Invalid rule on line {} of {}: {}'.format(line_number, file_path, line))
+                try:
+                    package_filter.add_rule(*parts)
+                except (ValueError, re.error) as e:
+                    raise ValueError('Invalid rule on line {} of {}: {}'.format(line_number, file_path, e))
+        return package_filter
+
+    def matches(self, name):
+        """
+        Checks if a package name is selected by the rules
+
+        :param name: Normalized package name
+        :type name: str
+
+        :return: True if the name is selected
+        :rtype: bool
+        """
+        if not self._include.is_empty and not self._include.matches(name):
+            return False
+        return self._exclude.is_empty or not self._exclude.matches(name)
+
+    def filter(self, names):
+        """
+        Filters package names
+
+        :param names: Normalized package names
+        :type names: iterable
+
+        :return: Generator of the selected names
+        :rtype: generator
+        """
+        return (x for x in names if self.matches(x))
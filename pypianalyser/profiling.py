@@ -0,0 +1,243 @@
+from collections import Counter
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+from pypianalyser.options import PROFILE_MODE_CPU, PROFILE_MODE_SAMPLE, PROFILE_MODE_MEMORY, PROFILE_MODES
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_TRACEBACK_FRAMES = 25
+MEMORY_REPORT_TOP_LINES = 50
+MEMORY_REPORT_TOP_TRACEBACKS = 10
+
+
+class _ProfileSnapshot(object):
+    """
+    Stats of a profiler in the form pstats loads them from. pstats would otherwise call create_stats(), which disables
+    the profiler for the calling thread rather than the thread that was profiled
+    """
+    def __init__(self, profiler):
+        profiler.snapshot_stats()
+        self.stats = profiler.stats
+
+    def create_stats(self):
+        pass
+
+
+class CpuProfiler(object):
+    """
+    Deterministic (cProfile) profiler covering the calling thread and every thread started while it is running, which
+    includes the download threads and the SQLite worker thread. Each thread gets its own profiler and the results are
+    merged into a single pstats file when the profiler is stopped
+    """
+    def __init__(self, output_path):
+        """
+        Constructor for CpuProfiler
+
+        :param output_path: Path of the pstats file to write
+        :type output_path: str
+        """
+        self.output_path = output_path
+        self._profilers = []
+        self._lock = threading.Lock()
+        # From Python 3.12 cProfile uses sys.monitoring, which is process wide, so a single profiler sees every thread
+        self._per_thread = sys.version_info < (3, 12)
+
+    def _profile_new_thread(self, *args):
+        # Installed with threading.setprofile(), so this runs as the first profiling event of each new thread and then
+        # replaces itself with a profiler of that thread
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        """
+        Starts profiling the calling thread, and any threads started from now on
+        """
+        self._main_profiler = cProfile.Profile()
+        if self._per_thread:
+            threading.setprofile(self._profile_new_thread)
+        self._main_profiler.enable()
+
+    def stop(self):
+        """
+        Stops profiling and writes the merged stats of every profiled thread
+
+        :return: Merged stats
+        :rtype: pstats.Stats
+        """
+        self._main_profiler.disable()
+        threading.setprofile(None)
+        with self._lock:
+            thread_profilers = list(self._profilers)
+
+        stats = pstats.Stats(self._main_profiler)
+        for profiler in thread_profilers:
+            stats.add(_ProfileSnapshot(profiler))
+        stats.dump_stats(self.output_path)
+        logger.info('Wrote the CPU profile of {} threads to {}. View it with: python -m pstats {}'
+                    .format(len(thread_profilers) + 1, self.output_path, self.output_path))
+        return stats
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler that periodically samples the stack of every thread and writes them in the collapsed stack
+    format used by flamegraph.pl and speedscope. Its overhead doesn't depend on the number of function calls, so it
+    distorts the timings much less than cProfile
+    """
+    def __init__(self, output_path, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        Constructor for SamplingProfiler
+
+        :param output_path: Path of the collapsed stack file to write
+        :type output_path: str
+        :param interval: Seconds between samples
+        :type interval: float
+        """
+        self.output_path = output_path
+        self.interval = interval
+        self.stack_counts = Counter()
+        self.sample_count = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts sampling in a background thread
+        """
+        self._thread = threading.Thread(target=self._sample_loop, name='sampling-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _sample_loop(self):
+        own_thread_id = threading.current_thread().ident
+        while not self._stop_event.wait(self.interval):
+            thread_names = dict((t.ident, t.name) for t in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                self.stack_counts[self._collapse_stack(thread_names.get(thread_id, thread_id), frame)] += 1
+            self.sample_count += 1
+
+    @staticmethod
+    def _collapse_stack(thread_name, frame):
+        """
+        Formats a stack as semicolon separated frames, outermost first, prefixed with the thread name
+
+        :param thread_name: Name of the thread the stack belongs to
+        :type thread_name: str
+        :param frame: Innermost frame of the stack
+        :type frame: frame
+
+        :return: Collapsed stack
+        :rtype: str
+        """
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        frames.append(str(thread_name))
+        return ';'.join(reversed(frames))
+
+    def stop(self):
+        """
+        Stops sampling and writes the collapsed stacks, one '<stack> <count>' line per distinct stack
+
+        :return: Collapsed stacks mapped to the number of times they were sampled
+        :rtype: Counter
+        """
+        self._stop_event.set()
+        self._thread.join()
+        with open(self.output_path, 'w') as fp:
+            for stack, count in sorted(self.stack_counts.items()):
+                fp.write('{} {}\n'.format(stack, count))
+        logger.info('Wrote {} samples to {}. Render it with flamegraph.pl or https://www.speedscope.app'
+                    .format(self.sample_count, self.output_path))
+        return self.stack_counts
+
+
+class MemoryProfiler(object):
+    """
+    Allocation profiler using tracemalloc. Writes a report of the peak memory use, the source lines holding the most
+    memory when stopped, and the tracebacks of the largest allocations
+    """
+    def __init__(self, output_path, traceback_frames=DEFAULT_TRACEBACK_FRAMES):
+        """
+        Constructor for MemoryProfiler
+
+        :param output_path: Path of the report to write
+        :type output_path: str
+        :param traceback_frames: Number of frames to record for each allocation
+        :type traceback_frames: int
+        """
+        if tracemalloc is None:
+            raise Exception('Memory profiling requires tracemalloc, which is only available on Python 3')
+        self.output_path = output_path
+        self.traceback_frames = traceback_frames
+
+    def start(self):
+        """
+        Starts tracing allocations
+        """
+        tracemalloc.start(self.traceback_frames)
+
+    def stop(self):
+        """
+        Stops tracing and writes the report
+
+        :return: Snapshot of the allocations still held when stopped
+        :rtype: tracemalloc.Snapshot
+        """
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+
+        lines = ['Peak traced memory: {:.1f} MiB, still allocated when stopped: {:.1f} MiB'
+                 .format(peak / 1024.0 ** 2, current / 1024.0 ** 2), '',
+                 'Top {} lines by allocated memory:'.format(MEMORY_REPORT_TOP_LINES)]
+        lines.extend(str(x) for x in snapshot.statistics('lineno')[:MEMORY_REPORT_TOP_LINES])
+        lines.extend(['', 'Top {} allocation tracebacks:'.format(MEMORY_REPORT_TOP_TRACEBACKS)])
+        for statistic in snapshot.statistics('traceback')[:MEMORY_REPORT_TOP_TRACEBACKS]:
+            lines.extend(['', str(statistic)])
+            lines.extend(statistic.traceback.format())
+        with open(self.output_path, 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        logger.info('Wrote the memory profile to {}'.format(self.output_path))
+        return snapshot
+
+
+def create_profiler(mode, output_path):
+    """
+    Creates a profiler
+
+    :param mode: One of PROFILE_MODES: 'cpu' for a merged cProfile pstats file, 'sample' for a collapsed stack file
+     that can be rendered as a flame graph, or 'memory' for a tracemalloc allocation report
+    :type mode: str
+    :param output_path: Path of the file to write the results to
+    :type output_path: str
+
+    :return: Profiler, not yet started
+    :rtype: CpuProfiler or SamplingProfiler or MemoryProfiler
+    """
+    if mode == PROFILE_MODE_CPU:
+        return CpuProfiler(output_path)
+    elif mode == PROFILE_MODE_SAMPLE:
+        return SamplingProfiler(output_path)
+    elif mode == PROFILE_MODE_MEMORY:
+        return MemoryProfiler(output_path)
+    raise ValueError('Unknown profile mode: {}. Must be one of {}'.format(mode, ', '.join(PROFILE_MODES)))
@@ -0,0 +1,101 @@
+from collections import deque, OrderedDict
+from datetime import timedelta
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_PROGRESS_INTERVAL = 10
+# Period the packages/sec rate is calculated over. Long enough to smooth out bursts, short enough to follow the rate
+# changing as a run goes on
+DEFAULT_RATE_WINDOW = 60
+STARTED_COUNTER = 'packages_started'
+FINISHED_COUNTER = 'packages_finished'
+
+
+class ProgressReporter(threading.Thread):
+    """
+    Background thread that periodically logs the progress of a run: packages finished, a rolling packages/sec rate, the
+    ETA and how many packages are in flight.
+
+    The processing threads only increment their own shard of the metrics counters (packages_started and
+    packages_finished), so reporting progress adds no lock contention to them however often it is reported
+    """
+    def __init__(self, metrics, total, interval=DEFAULT_PROGRESS_INTERVAL, rate_window=DEFAULT_RATE_WINDOW,
+                 clock=time.time):
+        """
+        Constructor for ProgressReporter
+
+        :param metrics: Metrics that the processing threads record the started and finished counters in
+        :type metrics: pypianalyser.metrics.Metrics
+        :param total: Total number of packages in the run
+        :type total: int
+        :param interval: Seconds between progress reports
+        :type interval: float
+        :param rate_window: Seconds of history the rate is calculated over
+        :type rate_window: float
+        :param clock: Function returning the current time in seconds
+        :type clock: callable
+        """
+        threading.Thread.__init__(self, name='progress-reporter')
+        self.daemon = True
+        self.metrics = metrics
+        self.total = total
+        self.interval = interval
+        self.rate_window = rate_window
+        self._clock = clock
+        self._start_time = clock()
+        self._samples = deque([(self._start_time, 0)])
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.report()
+
+    def sample(self):
+        """
+        Calculates the current progress
+
+        :return: elapsed_seconds, finished, total, in_flight, rate (packages/sec over the rate window) and eta_seconds
+         (None until a rate is known)
+        :rtype: OrderedDict
+        """
+        now = self._clock()
+        finished = self.metrics.get_counter(FINISHED_COUNTER)
+        started = self.metrics.get_counter(STARTED_COUNTER)
+
+        self._samples.append((now, finished))
+        # Keep the newest sample that is older than the window, so the rate always covers at least the full window
+        while len(self._samples) > 2 and self._samples[1][0] <= now - self.rate_window:
+            self._samples.popleft()
+        oldest_time, oldest_finished = self._samples[0]
+        rate = (finished - oldest_finished) / (now - oldest_time) if now > oldest_time else 0.0
+
+        progress = OrderedDict()
+        progress['elapsed_seconds'] = now - self._start_time
+        progress['finished'] = finished
+        progress['total'] = self.total
+        progress['in_flight'] = started - finished
+        progress['rate'] = rate
+        progress['eta_seconds'] = (self.total - finished) / rate if rate else None
+        return progress
+
+    def report(self):
+        """
+        Logs the current progress
+        """
+        progress = self.sample()
+        percent = 100.0 * progress['finished'] / progress['total'] if progress['total'] else 100.0
+        eta = timedelta(seconds=int(progress['eta_seconds'])) if progress['eta_seconds'] is not None else 'unknown'
+        logger.info('Runtime: {}, processed {}/{} ({:.1f}%), {:.1f} packages/sec, {} in flight, ETA {}'
+                    .format(timedelta(seconds=int(progress['elapsed_seconds'])), progress['finished'],
+                            progress['total'], percent, progress['rate'], progress['in_flight'], eta))
+
+    def stop(self):
+        """
+        Stops the thread
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -1,6 +1,5 @@
 import json
-from lxml import html
-import requests
+import time
 import six.moves.urllib as urllib
 from pypianalyser.exceptions import Exception404
 from pypianalyser.utils import normalize_package_name
@@ -9,9 +8,34 @@ from pypianalyser.utils import normalize_package_name
 HTTP_SUCCESS = 200
 HTTP_NOT_FOUND = 404
 UNSET_VAL = -1
+DEFAULT_INDEX_URL = 'https://pypi.org/'
+METADATA_URL_PATH = 'pypi/{}/json'
+# Seconds to wait for a connection, and between bytes of the response. Without these a stuck connection hangs forever
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
 
 
-def get_metadata_for_package(package_name, url_format='https://pypi.org/pypi/{}/json'):
+def join_index_url(index_url, path):
+    """
+    Joins a path onto the base URL of an index. The base URL is treated as a directory whether or not it ends with a /,
+    otherwise urljoin replaces the last segment of a mirror's path, e.g. https://example.com/pypi-mirror
+
+    :param index_url: Base URL of the index
+    :type index_url: str
+    :param path: Path relative to the base URL
+    :type path: str
+
+    :return: Joined URL
+    :rtype: str
+    """
+    if not index_url.endswith('/'):
+        index_url += '/'
+    return urllib.parse.urljoin(index_url, path)
+
+
+def get_metadata_for_package(package_name, url_format='https://pypi.org/pypi/{}/json', metrics=None,
+                             timeout=DEFAULT_TIMEOUT):
     """
     Downloads the metadata JSON for given package
 
@@ -19,33 +43,75 @@ def get_metadata_for_package(package_name, url_format='https://pypi.org/pypi/{}/
     :type package_name: str
     :param url_format: Format URL string
     :type url_format: str
+    :param metrics: Metrics to record the fetch and parse times, bytes downloaded and HTTP status codes in
+    :type metrics: pypianalyser.metrics.Metrics or None
+    :param timeout: Connect and read timeouts in seconds, as a tuple or one value for both
+    :type timeout: tuple or float
 
     :return: Package metadata
     :rtype: dict
     """
+    start = time.time()
+    content = download_metadata_for_package(package_name, url_format, metrics, timeout)
+    fetched = time.time()
+    metadata = json.loads(content)
+    if metrics:
+        metrics.observe('fetch_seconds', fetched - start)
+        metrics.observe('parse_seconds', time.time() - fetched)
+    return metadata
+
+
+def download_metadata_for_package(package_name, url_format='https://pypi.org/pypi/{}/json', metrics=None,
+                                  timeout=DEFAULT_TIMEOUT):
+    """
+    Downloads the raw metadata JSON for given package without parsing it
+
+    :param package_name: Name of the package
+    :type package_name: str
+    :param url_format: Format URL string
+    :type url_format: str
+    :param metrics: Metrics to record the bytes downloaded and HTTP status codes in
+    :type metrics: pypianalyser.metrics.Metrics or None
+    :param timeout: Connect and read timeouts in seconds, as a tuple or one value for both
+    :type timeout: tuple or float
+
+    :return: Response body
+    :rtype: bytes
+    """
+    # Imported here rather than at the top of the module, so that commands which don't download anything start quickly
+    import requests
     url = url_format.format(package_name)
 
-    response = requests.get(url)
+    response = requests.get(url, timeout=timeout)
+    if metrics:
+        metrics.increment('http_responses', labels={'status': response.status_code})
+        metrics.increment('bytes_downloaded', len(response.content))
     if response.status_code == HTTP_NOT_FOUND:
         raise Exception404(url)
     elif response.status_code != HTTP_SUCCESS:
         raise Exception('HTTP Error: {} on {}'.format(str(response.status_code), url))
 
-    return json.loads(response.content)
+    return response.content
 
 
-def get_package_list(domain='https://pypi.org/'):
+def get_package_list(domain=DEFAULT_INDEX_URL, timeout=DEFAULT_TIMEOUT):
     """
     Download the list of packages from a given mirror from the /simple index
 
     :param domain: Domain to download from, e.g. https://pypi.org/
     :type domain: str
+    :param timeout: Connect and read timeouts in seconds, as a tuple or one value for both
+    :type timeout: tuple or float
 
     :return: List of package name strings
     :rtype: str
     """
-    url = urllib.parse.urljoin(domain, 'simple')
-    response = requests.get(url)
+    import requests
+    from lxml import html
+    url = join_index_url(domain, 'simple')
+    response = requests.get(url, timeout=timeout)
+    if response.status_code != HTTP_SUCCESS:
+        raise Exception('HTTP Error: {} on {}'.format(str(response.status_code), url))
     tree = html.fromstring(response.content)
     packages = tree.xpath('//body/a')
     package_names = [normalize_package_name(x.text) for x in packages]
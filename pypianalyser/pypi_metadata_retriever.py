@@ -1,22 +1,150 @@
 from collections import OrderedDict
 from datetime import datetime
-from distutils.version import LooseVersion
+import gc
+import json
 import logging
-import re
+import multiprocessing
+import os
 import threading
-from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
-from pypianalyser.pypi_index_helpers import get_package_list, get_metadata_for_package
+import time
+from six.moves import queue
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper, REFRESH_UNCHANGED, RELEASE_SUMMARY_KEY
+from pypianalyser.archive import ResponseArchive
+from pypianalyser.package_filter import PackageFilter, ACTION_INCLUDE, RULE_REGEX
+from pypianalyser.scheduling import create_scheduler, SCHEDULE_ALPHABETICAL
+from pypianalyser.pypi_index_helpers import get_package_list, get_metadata_for_package, DEFAULT_INDEX_URL, \
+    download_metadata_for_package, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from pypianalyser.hedging import HedgedRequester, DEFAULT_HEDGE_QUANTILE
 from pypianalyser.exceptions import Exception404
-from pypianalyser.utils import append_line_to_file, read_file_lines_into_list, order_release_names_fallback, \
-    split_list_into_chunks
+from pypianalyser.metrics import Metrics, MetricsReporter
+from pypianalyser.mirrors import MirrorPool
+from pypianalyser.name_index import load_name_index, NAME_INDEX_SUFFIX
+from pypianalyser.options import DEFAULT_MAX_QUEUED_PACKAGES
+from pypianalyser.progress import ProgressReporter, DEFAULT_PROGRESS_INTERVAL, STARTED_COUNTER, FINISHED_COUNTER
+from pypianalyser.sql_queries import PACKAGE_TABLE_COLUMNS, PACKAGE_RELEASES_TABLE_COLUMNS
+from pypianalyser.utils import append_line_to_file, read_file_lines_into_list, order_release_names, \
+    split_list_into_chunks, remove_unknown_keys_from_dict, get_rss_bytes, get_shard_index, summarise_releases
 
 logger = logging.getLogger(__file__)
 
+# How often the metrics file is rewritten when metrics aren't also being logged
+DEFAULT_METRICS_FILE_INTERVAL = 15
+MEMORY_PAUSE_INTERVAL = 0.05
+# Fields of the package info that are stored, classifiers go into their own table
+STORED_INFO_FIELDS = PACKAGE_TABLE_COLUMNS + ['classifiers']
+# Archived responses handed to each rebuild process at a time
+REBUILD_CHUNK_SIZE = 16
+
+# State of a rebuild worker process, set up by _init_rebuild_worker()
+_rebuild_worker = {}
+
+
+def _init_rebuild_worker(archive_dir, trunc_description, trunc_releases):
+    """
+    Initialises a process of the rebuild pool with its own handle on the archive, and the truncation settings of the
+    rebuild
+
+    :param archive_dir: Directory of the response archive
+    :type archive_dir: str
+    :param trunc_description: Number of characters to truncate the description field to, -1 for no truncation
+    :type trunc_description: int
+    :param trunc_releases: Number of releases to keep for each package, -1 for all
+    :type trunc_releases: int
+    """
+    _rebuild_worker['archive'] = ResponseArchive(archive_dir)
+    _rebuild_worker['trunc_description'] = trunc_description
+    _rebuild_worker['trunc_releases'] = trunc_releases
+
+
+def _parse_archived_response(item):
+    """
+    Loads, parses and transforms an archived response in a rebuild worker process
+
+    :param item: Package name and the digest of its archived response
+    :type item: tuple
+
+    :return: The package name, its metadata (None on failure) and the error (None on success)
+    :rtype: tuple
+    """
+    package_name, digest = item
+    try:
+        metadata = json.loads(_rebuild_worker['archive'].load(digest))
+        prepare_metadata(metadata, _rebuild_worker['trunc_description'], _rebuild_worker['trunc_releases'])
+        return package_name, metadata, None
+    except Exception as e:
+        return package_name, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def prepare_metadata(metadata, trunc_description=-1, trunc_releases=-1):
+    """
+    Truncates the metadata of a package and removes the parts that aren't stored, ready to be written. The releases are
+    summarised first, so that the summary covers the releases that are truncated
+
+    :param metadata: Package metadata
+    :type metadata: dict
+    :param trunc_description: Number of characters to truncate the description and summary to, -1 for no truncation
+    :type trunc_description: int
+    :param trunc_releases: Number of releases to keep, -1 for all
+    :type trunc_releases: int
+    """
+    metadata[RELEASE_SUMMARY_KEY] = summarise_releases(metadata.get('releases'))
+    if trunc_description >= 0:
+        truncate_description(metadata, trunc_description)
+
+    if trunc_releases >= 0:
+        truncate_releases(metadata, trunc_releases)
+    PyPiMetadataRetriever._remove_unused_fields(metadata)
+
+
+def truncate_description(metadata, length):
+    """
+    Truncates the description and summary fields in the metadata dict to a specified length
+
+    :param metadata: Metadata containing the description
+    :type metadata: dict
+    :param length: Number of characters to truncate the fields to
+    :type length: int
+    """
+    description = metadata['info']['description']
+    if description:
+        metadata['info']['description'] = description[:length]
+
+    summary = metadata['info']['summary']
+    if summary:
+        metadata['info']['summary'] = summary[:length]
+
+
+def truncate_releases(metadata, count):
+    """
+    Truncates the releases in the metadata dict after ordering them
+
+    :param metadata: Metadata containing the releases
+    :type metadata: dict
+    :param count: Number of releases to keep
+    :type count: int
+    """
+    releases = metadata['releases'] or {}
+
+    # In Py3 by default we can't rely on the order of the release dictionary so order the releases using an
+    # OrderedDict
+    ordered_releases_names = order_release_names(releases)
+
+    ordered_releases = OrderedDict()
+    for release_name in ordered_releases_names[:count]:
+        ordered_releases[release_name] = releases[release_name]
+    metadata['releases'] = ordered_releases
+
 
 class PyPiMetadataRetriever:
 
     def __init__(self, trunc_description=-1, trunc_releases=-1, thread_count=1, db_path='pypi.sqlite', max_packages=-1,
-                 package_regex=None, file_404='404.txt', verbose=False):
+                 package_regex=None, file_404='404.txt', verbose=False, search_index=False,
+                 compress_descriptions=False, index_url=DEFAULT_INDEX_URL, metrics_interval=0, metrics_file=None,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL, max_queued_packages=DEFAULT_MAX_QUEUED_PACKAGES,
+                 max_memory_mb=None, shard=None, refresh=False, archive_dir=None,
+                 filter_file=None, schedule=SCHEDULE_ALPHABETICAL, downloads_file=None, mirror_urls=None,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 hedge_quantile=DEFAULT_HEDGE_QUANTILE):
         """
         Constructor for PyPiMetadataRetriever
 
@@ -37,6 +165,57 @@ class PyPiMetadataRetriever:
         :type file_404: str
         :param verbose: Enable verbose logging
         :type verbose: bool
+        :param search_index: Build and maintain the full-text search index in the database
+        :type search_index: bool
+        :param compress_descriptions: Store descriptions compressed, in a separate table to the rest of the package
+         metadata
+        :type compress_descriptions: bool
+        :param index_url: Base URL of the PyPi index or mirror to download from, which must serve both /simple and
+         /pypi/<package>/json
+        :type index_url: str
+        :param metrics_interval: Seconds between logging the ingest metrics as a JSON line, 0 to disable
+        :type metrics_interval: float
+        :param metrics_file: Path of a Prometheus text file to keep updated with the ingest metrics, or None
+        :type metrics_file: str or None
+        :param progress_interval: Seconds between logging the progress, rate and ETA of the run, 0 to disable
+        :type progress_interval: float
+        :param max_queued_packages: Maximum number of downloaded packages waiting to be written to the database. The
+         download threads block once this is reached, so a slow disk can't cause memory use to grow
+        :type max_queued_packages: int
+        :param max_memory_mb: Memory ceiling in MB. When the process RSS is above this, the download threads pause until
+         the queued packages have been written
+        :type max_memory_mb: int or None
+        :param shard: (index, count) to only process the packages assigned to shard index of count, with the index
+         starting from 0. Packages are assigned by a stable hash of their name, so each node of a crawl split across
+         several machines can be given a different index and their databases merged afterwards
+        :type shard: tuple or None
+        :param refresh: Re-download packages that are already in the database and update those that have changed since
+         they were last fetched. Unchanged packages aren't written
+        :type refresh: bool
+        :param archive_dir: Directory of an archive to keep the raw responses in, so that the database can later be
+         rebuilt from it with rebuild(). Identical responses are only stored once
+        :type archive_dir: str or None
+        :param filter_file: Path to a file of include and exclude rules (prefixes, globs and regexes) to select the
+         packages with. The package regex, if given, is added to it as another include rule
+        :type filter_file: str or None
+        :param schedule: Order to process the packages in, highest priority first, which decides the packages kept when
+         the list is cut to max_packages. One of pypianalyser.scheduling.SCHEDULES: 'alphabetical', 'staleness' (least
+         recently refreshed first), 'downloads' (most downloaded first, from downloads_file) or 'fanin' (most depended
+         on by the packages in the database first)
+        :type schedule: str
+        :param downloads_file: Path to a file of '<package> <download count>' lines for the downloads schedule
+        :type downloads_file: str or None
+        :param mirror_urls: Base URLs of further mirrors to download from alongside index_url. Requests are spread across
+         all of them, weighted towards the mirrors with the lowest latency and error rate, and a failed request is
+         retried on another mirror (see pypianalyser.mirrors.MirrorPool)
+        :type mirror_urls: list or None
+        :param connect_timeout: Seconds to wait for a connection to the index before the request fails
+        :type connect_timeout: float
+        :param read_timeout: Seconds to wait for the next bytes of a response before the request fails
+        :type read_timeout: float
+        :param hedge_quantile: Quantile of the recent fetch latencies after which a duplicate request for the package is
+         made, the first response to arrive being used (see pypianalyser.hedging.HedgedRequester). 0 disables hedging
+        :type hedge_quantile: float
         """
         self.truncate_description = trunc_description
         self.truncate_releases = trunc_releases
@@ -46,11 +225,31 @@ class PyPiMetadataRetriever:
         self.package_regex = package_regex
         self.file_path_404 = file_404
         self.verbose = verbose
+        self.search_index = search_index
+        self.compress_descriptions = compress_descriptions
+        self.index_url = index_url
+        self.metrics_interval = metrics_interval
+        self.metrics_file = metrics_file
+        self.metrics = Metrics()
+        self.mirrors = MirrorPool([index_url] + list(mirror_urls or []), metrics=self.metrics)
+        self.timeout = (connect_timeout, read_timeout)
+        self.hedger = HedgedRequester(hedge_quantile, metrics=self.metrics) if hedge_quantile else None
+        self._metrics_reporter = None
+        self.progress_interval = progress_interval
+        self._progress_reporter = None
+        self.max_queued_packages = max_queued_packages
+        self.max_memory_mb = max_memory_mb
+        self.shard = shard
+        self.refresh = refresh
+        self.archive_dir = archive_dir
+        self._archive = None
+        self.filter_file = filter_file
+        self.scheduler = create_scheduler(schedule, downloads_file)
+        self._write_queue = None
+        self._writer_thread = None
         self.package_list = None
         self._threads = []
-        self._progress_counter_lock = threading.Lock()
         self._404_file_lock = threading.Lock()
-        self._progress_counter = 0
         self._start_time = 0
         self._shutdown = False
 
@@ -66,45 +265,62 @@ class PyPiMetadataRetriever:
         """
         Calculates the package list to be processed.
         This is the list downloaded from PyPi with the following values removed:
-        - Packages already in the database
+        - Packages already in the database (unless refreshing)
         - Packages that have previously returned a HTTP 404 on a previous run (recorded in the 404 file0
-        - Packages that do not match the package name regex (if supplied)
-        The list is finally reduced to max_packages (if supplied)
+        - Packages that do not match the package name regex or the filter file rules (if supplied)
+        - Packages that are assigned to other shards (if sharding)
+        The list is then ordered by the schedule, and finally reduced to the max_packages with the highest priority (if
+        supplied)
 
         :return: List of packages that match the input specifications
         :rtype: list
         """
         self._open_db()
         try:
-            # Obtain the list from PyPi
-            pypi_set = set(get_package_list())
-            logger.info('Obtained a list of {} packages from the mirror'.format(len(pypi_set)))
-
-            if self.package_regex:
-                regex = re.compile(self.package_regex)
-                pypi_set = set(filter(regex.search, pypi_set))
-                logger.info('Applied regex {}, reduced list to {}'.format(self.package_regex, len(pypi_set)))
-
-            # Remove packages that returned 404.txt on the previous run
-            failed_links = set(read_file_lines_into_list(self.file_path_404))
-            if failed_links:
-                pypi_set = pypi_set - failed_links
-                logger.info('Found {} broken links to packaged in {}, removing these from the list. List size is now {}'
-                             .format(len(failed_links), self.file_path_404, len(pypi_set)))
+            # Obtain the list from PyPi. Only a single set of names is held from here on, the other sources are streamed
+            # into it rather than being built into sets of their own
+            package_names = self.mirrors.request(lambda mirror: get_package_list(mirror.url, self.timeout))
+            logger.info('Obtained a list of {} packages from the mirror'.format(len(package_names)))
+            package_filter = self._build_package_filter()
+            if package_filter:
+                pypi_set = set(package_filter.filter(package_names))
+                logger.info('Applied the package filter, reduced list to {}'.format(len(pypi_set)))
+            else:
+                pypi_set = set(package_names)
+            del package_names
+
+            if self.shard:
+                shard_index, shard_count = self.shard
+                pypi_set = set(x for x in pypi_set if get_shard_index(x, shard_count) == shard_index)
+                logger.info('Selected shard {} of {}, reduced list to {}'.format(shard_index, shard_count,
+                                                                                 len(pypi_set)))
+
+            # Remove packages that returned 404.txt on the previous run. The names are streamed from an index of the
+            # file, which is only rebuilt when the file has changed
+            failed_links = self._open_404_index()
+            if failed_links is not None:
+                with failed_links:
+                    # Checked name by name, so the Bloom filter of the index rules out most names without a search
+                    pypi_set = set(x for x in pypi_set if x not in failed_links)
+                    logger.info('Found {} broken links to packaged in {}, removing these from the list. List size is '
+                                'now {}'.format(len(failed_links), self.file_path_404, len(pypi_set)))
 
             # Remove the package already present in the DB
-            already_in_db = set(self._db_helper.get_package_names())
-            if already_in_db:
-                pypi_set = pypi_set - already_in_db
-                logger.info('Found {} packages already in the DB, removing these from the list. List size is now {}'
-                             .format(len(already_in_db), len(pypi_set)))
-
-            pypi_set = sorted(list(pypi_set))
-            if self.max_packages and len(pypi_set) > self.max_packages:
+            if not self.refresh:
+                size_before = len(pypi_set)
+                with self._db_helper.open_name_index() as db_names:
+                    pypi_set = set(x for x in pypi_set if x not in db_names)
+                if len(pypi_set) < size_before:
+                    logger.info('Found {} packages already in the DB, removing these from the list. List size is now {}'
+                                .format(size_before - len(pypi_set), len(pypi_set)))
+
+            package_list = self.scheduler.order(pypi_set, self._db_helper)
+            del pypi_set
+            if self.max_packages and len(package_list) > self.max_packages:
                 logger.info('Reducing size of the package list down to {}'.format(self.max_packages))
-                pypi_set = pypi_set[:self.max_packages]
+                del package_list[self.max_packages:]
 
-            self.package_list = pypi_set
+            self.package_list = package_list
             return self.package_list
         finally:
             self._close_db()
@@ -120,7 +336,15 @@ class PyPiMetadataRetriever:
                 logger.warn('0 packages matched the input filter')
                 return
             self._open_db()
+            if self.archive_dir:
+                self._archive = ResponseArchive(self.archive_dir)
             self._start_time = datetime.now()
+            self._start_metrics_reporter()
+            if self.progress_interval:
+                self._progress_reporter = ProgressReporter(self.metrics, len(self.package_list), self.progress_interval)
+                self._progress_reporter.start()
+
+            self._start_writer()
 
             # Optimisation - little point in multi-threading if there's a small number of packages
             if len(self.package_list) < 100:
@@ -136,15 +360,191 @@ class PyPiMetadataRetriever:
 
                 for t in self._threads:
                     t.join()
-            time_diff = datetime.now() - self._start_time
-            logger.info('Runtime: {}, finished processing all packages'.format(time_diff))
+            self._stop_writer()
+            self._stop_progress_reporter()
+            self._update_derived_tables()
         except KeyboardInterrupt:
             logger.info('Keyboard interrupt, waiting for threads to finish')
             self._shutdown = True
             for t in self._threads:
                 t.join()
         finally:
+            self._stop_writer()
+            self._stop_progress_reporter()
+            self._stop_metrics_reporter()
+            self._close_archive()
             self._close_db()
+            if self.hedger:
+                self.hedger.close()
+
+    def rebuild(self):
+        """
+        Builds a new database from the response archive, without any network access. The latest archived response of
+        each package is decompressed, parsed and truncated by a pool of thread_count processes, and the results are
+        written in the order they are archived. Use this to apply new truncation settings or features to packages that
+        have already been downloaded
+        """
+        if not self.archive_dir or not os.path.isdir(self.archive_dir):
+            raise Exception('Response archive {} does not exist'.format(self.archive_dir))
+        if os.path.exists(self.db_path):
+            raise Exception('Database {} already exists, rebuild writes a new database'.format(self.db_path))
+
+        items = list(ResponseArchive(self.archive_dir).read_index().items())
+        package_filter = self._build_package_filter()
+        if package_filter:
+            items = [x for x in items if package_filter.matches(x[0])]
+        logger.info('Rebuilding {} packages from the archive {}'.format(len(items), self.archive_dir))
+        pool = None
+        try:
+            self._open_db()
+            self._start_time = datetime.now()
+            self._start_metrics_reporter()
+            if self.progress_interval:
+                self._progress_reporter = ProgressReporter(self.metrics, len(items), self.progress_interval)
+                self._progress_reporter.start()
+
+            init_args = (self.archive_dir, self.truncate_description, self.truncate_releases)
+            if self.thread_count > 1:
+                pool = multiprocessing.Pool(self.thread_count, initializer=_init_rebuild_worker, initargs=init_args)
+                results = pool.imap(_parse_archived_response, items, chunksize=REBUILD_CHUNK_SIZE)
+            else:
+                _init_rebuild_worker(*init_args)
+                results = (_parse_archived_response(x) for x in items)
+
+            for package_name, metadata, error in results:
+                self.metrics.increment(STARTED_COUNTER)
+                if error:
+                    self.metrics.increment('errors', labels={'type': error.split(':')[0]})
+                    self.metrics.increment(FINISHED_COUNTER)
+                    logger.error('Failed to rebuild {}: {}'.format(package_name, error))
+                    continue
+                self._commit_package(metadata)
+            if pool:
+                pool.close()
+                pool.join()
+            self._stop_progress_reporter()
+            self._update_derived_tables()
+        finally:
+            if pool:
+                pool.terminate()
+            self._stop_progress_reporter()
+            self._stop_metrics_reporter()
+            self._close_db()
+
+    def _open_404_index(self):
+        """
+        Opens a name index of the packages in the 404 file, rebuilding it first if the file has changed since it was
+        built
+
+        :return: Open index, or None if there is no 404 file
+        :rtype: pypianalyser.name_index.NameIndex or None
+        """
+        if not os.path.exists(self.file_path_404):
+            return None
+        stat = os.stat(self.file_path_404)
+        stamp = (stat.st_size, int(stat.st_mtime * 1000))
+        return load_name_index(self.file_path_404 + NAME_INDEX_SUFFIX, stamp,
+                               lambda: (x for x in read_file_lines_into_list(self.file_path_404) if x))
+
+    def _build_package_filter(self):
+        """
+        Builds the filter that selects the packages to process from the filter file and package regex
+
+        :return: Package filter, or None if every package is selected
+        :rtype: PackageFilter or None
+        """
+        if not self.filter_file and not self.package_regex:
+            return None
+        package_filter = PackageFilter.from_file(self.filter_file) if self.filter_file else PackageFilter()
+        if self.package_regex:
+            package_filter.add_rule(ACTION_INCLUDE, RULE_REGEX, self.package_regex)
+        return package_filter
+
+    def _update_derived_tables(self):
+        """
+        Brings the rollup tables and the description compression dictionary up to date at the end of a run
+        """
+        time_diff = datetime.now() - self._start_time
+        logger.info('Runtime: {}, finished processing all packages'.format(time_diff))
+
+        self._db_helper.update_rollups()
+        logger.info('Updated the rollup tables in {}'.format(datetime.now() - self._start_time - time_diff))
+        if self._db_helper.ensure_description_dictionary():
+            logger.info('Trained a compression dictionary for the descriptions and recompressed them')
+
+    def _close_archive(self):
+        """
+        Close the response archive if its open
+        """
+        if self._archive:
+            self._archive.close()
+            self._archive = None
+
+    def _start_writer(self):
+        """
+        Starts the thread that writes the downloaded packages to the database, and the bounded queue that feeds it
+        """
+        self._write_queue = queue.Queue(maxsize=max(self.max_queued_packages, 1))
+        self._writer_thread = threading.Thread(target=self._write_queued_packages, name='package-writer')
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def _stop_writer(self):
+        """
+        Waits for the writer thread to write every queued package and stops it
+        """
+        if self._writer_thread:
+            self._write_queue.put(None)
+            self._writer_thread.join()
+            self._writer_thread = None
+            self._write_queue = None
+
+    def _write_queued_packages(self):
+        """
+        Writer thread function that commits packages from the write queue until it receives None
+        """
+        for metadata in iter(self._write_queue.get, None):
+            self._commit_package(metadata)
+
+    def _start_metrics_reporter(self):
+        """
+        Starts the thread that periodically reports the metrics, if either form of reporting is enabled
+        """
+        if not self.metrics_interval and not self.metrics_file:
+            return
+        self._metrics_reporter = MetricsReporter(self.metrics, self.metrics_interval or DEFAULT_METRICS_FILE_INTERVAL,
+                                                 prometheus_file=self.metrics_file,
+                                                 log_metrics=bool(self.metrics_interval),
+                                                 samplers=[self._sample_db_queue_depth])
+        self._metrics_reporter.start()
+
+    def _stop_metrics_reporter(self):
+        """
+        Stops the metrics reporting thread, which makes a final report
+        """
+        if self._metrics_reporter:
+            self._metrics_reporter.stop()
+            self._metrics_reporter = None
+
+    def _stop_progress_reporter(self):
+        """
+        Stops the progress reporting thread
+        """
+        if self._progress_reporter:
+            self._progress_reporter.stop()
+            self._progress_reporter = None
+
+    def _sample_db_queue_depth(self):
+        """
+        Records the number of queries waiting on the SQLite worker thread. A queue that is constantly full means the
+        database writes are the bottleneck
+        """
+        db_helper = self._db_helper
+        if db_helper and db_helper.sql_worker:
+            self.metrics.set_gauge('db_queue_depth', db_helper.sql_worker.queue_size)
+        write_queue = self._write_queue
+        if write_queue:
+            self.metrics.set_gauge('write_queue_depth', write_queue.qsize())
 
     def _close_db(self):
         """
@@ -159,47 +559,199 @@ class PyPiMetadataRetriever:
         Open the database
         """
         if not self._db_helper:
-            self._db_helper = PyPiAnalyserSqliteHelper(self.db_path)
+            self._db_helper = PyPiAnalyserSqliteHelper(self.db_path,
+                                                       enable_search_index=self.search_index,
+                                                       compress_descriptions=self.compress_descriptions)
 
     def _threaded_process(self, package_list):
         """
-        Threaded function that downloads package metadata from PyPi
+        Threaded function that downloads package metadata from PyPi and transforms it ready to be written. If the writer
+        thread is running the packages are handed to it through the bounded write queue, otherwise they are committed
+        directly
 
         :param package_list: List of packages to obtain metadata for
         :type package_list: list
         """
         logger.debug('Thread {} started'.format(threading.current_thread().ident))
-        i = 0
-        # Calculate a sensible period to update a locked counter based on the size of the package list. This ensures we
-        # don't do an operation that requires obtaining a lock too often.
-        update_period = int(min(5000, max(len(package_list) / 10, 1)))
-
         for package in package_list:
             if self._shutdown:
                 break
+            self._wait_for_memory()
+            # These only touch this thread's shard of the metrics, so progress tracking doesn't take any locks
+            self.metrics.increment(STARTED_COUNTER)
             try:
                 logger.debug('Processing: {}'.format(package))
-                metadata = get_metadata_for_package(package)
-                if self.truncate_description >= 0:
-                    self._truncate_description(metadata)
-
-                if self.truncate_releases >= 0:
-                    self._truncate_releases(metadata)
-
-                self._db_helper.commit_package_to_db(metadata)
+                metadata = self._download_metadata(package)
+                start = time.time()
+                self._prepare_metadata(metadata)
+                self.metrics.observe('truncate_seconds', time.time() - start)
             except Exception404 as e:
                 # HTTP 404 exceptions are common if the package is no longer on PyPi. We save these to a file so that
                 # we don't bother connecting to them on future runs
                 self._report_404(package)
+                self.metrics.increment('errors', labels={'type': type(e).__name__})
+                self.metrics.increment(FINISHED_COUNTER)
                 logger.warn(e)
+                continue
             except Exception as e:
+                self.metrics.increment('errors', labels={'type': type(e).__name__})
+                self.metrics.increment(FINISHED_COUNTER)
                 logger.error(e)
-            i += 1
-            # Update the global progress counter
-            if i % update_period == 0:
-                self._update_progress(update_period)
+                continue
+
+            write_queue = self._write_queue
+            if write_queue is not None:
+                # Blocks while the queue is full, which holds the download threads back to the speed of the writes
+                write_queue.put(metadata)
+            else:
+                self._commit_package(metadata)
+            del metadata
         logger.debug('Thread {} finished'.format(threading.current_thread().ident))
 
+    def _download_metadata(self, package_name):
+        """
+        Downloads and parses the metadata of a package from one of the mirrors, archiving the raw response first if
+        there is an archive
+
+        :param package_name: Name of the package
+        :type package_name: str
+
+        :return: Package metadata
+        :rtype: dict
+        """
+        archive = self._archive
+        if archive is None:
+            return self._fetch(lambda mirror: get_metadata_for_package(package_name, mirror.metadata_url_format,
+                                                                       self.metrics, self.timeout))
+
+        def download(mirror):
+            start = time.time()
+            content = download_metadata_for_package(package_name, mirror.metadata_url_format, self.metrics,
+                                                    self.timeout)
+            self.metrics.observe('fetch_seconds', time.time() - start)
+            return content
+
+        content = self._fetch(download)
+        fetched = time.time()
+        _, is_new = archive.store(package_name, content)
+        self.metrics.increment('archived_responses', labels={'result': 'new' if is_new else 'duplicate'})
+        archived = time.time()
+        metadata = json.loads(content.decode('utf-8'))
+        self.metrics.observe('archive_seconds', archived - fetched)
+        self.metrics.observe('parse_seconds', time.time() - archived)
+        return metadata
+
+    def _fetch(self, func):
+        """
+        Makes a request to the mirrors, hedging it if hedging is enabled. Each attempt is recorded as fetch_seconds by
+        the function, and the time the package waited for the first successful attempt as package_fetch_seconds, so the
+        two show the latency before and after hedging
+
+        :param func: Function making the request, called with the Mirror to use
+        :type func: callable
+
+        :return: Result of the request
+        :rtype: object
+        """
+        start = time.time()
+        try:
+            if self.hedger is None:
+                return self.mirrors.request(func)
+            return self.hedger.call(lambda: self.mirrors.request(func))
+        finally:
+            self.metrics.observe('package_fetch_seconds', time.time() - start)
+
+    def _prepare_metadata(self, metadata):
+        """
+        Truncates the metadata of a package and removes the parts that aren't stored, ready to be written. The releases
+        are summarised first, so that the summary covers the releases that are truncated
+
+        :param metadata: Package metadata
+        :type metadata: dict
+        """
+        prepare_metadata(metadata, self.truncate_description, self.truncate_releases)
+
+    def _commit_package(self, metadata):
+        """
+        Commits a downloaded package to the database, recording the metrics for the write
+
+        :param metadata: Package metadata
+        :type metadata: dict
+        """
+        try:
+            # Count before committing, committing removes the classifiers from the metadata
+            row_count = self._count_rows(metadata)
+            start = time.time()
+            if self.refresh:
+                result = self._db_helper.refresh_package(metadata)
+                self.metrics.increment('packages_refreshed', labels={'result': result})
+                if result == REFRESH_UNCHANGED:
+                    row_count = 0
+            else:
+                self._db_helper.commit_package_to_db(metadata)
+            # Writes are queued on the worker thread, so this is mostly time spent blocked on a full queue
+            self.metrics.observe('db_write_seconds', time.time() - start)
+            self.metrics.increment('rows_written', row_count)
+            self.metrics.increment('packages_processed')
+        except Exception as e:
+            self.metrics.increment('errors', labels={'type': type(e).__name__})
+            logger.error(e)
+        finally:
+            self.metrics.increment(FINISHED_COUNTER)
+
+    def _wait_for_memory(self):
+        """
+        Pauses the calling download thread while the process is over the memory ceiling, until the writer has caught up
+        with the queued packages
+        """
+        if not self.max_memory_mb:
+            return
+        limit = self.max_memory_mb * 1024 * 1024
+        rss = get_rss_bytes()
+        if rss is None or rss <= limit:
+            return
+
+        self.metrics.increment('memory_pauses')
+        gc.collect()
+        start = time.time()
+        write_queue = self._write_queue
+        # Continue once the queue has drained even if still over the ceiling, freed memory isn't always returned to the
+        # OS so the RSS may never drop back below it
+        while not self._shutdown and write_queue is not None and not write_queue.empty() and rss > limit:
+            time.sleep(MEMORY_PAUSE_INTERVAL)
+            rss = get_rss_bytes()
+        self.metrics.observe('memory_pause_seconds', time.time() - start)
+
+    @staticmethod
+    def _remove_unused_fields(metadata):
+        """
+        Removes the parts of the metadata that aren't stored, such as the 'urls' list (a copy of the latest release's
+        files) and file digests, so that packages waiting in the write queue hold as little memory as possible
+
+        :param metadata: Package metadata
+        :type metadata: dict
+        """
+        remove_unknown_keys_from_dict(metadata, ['info', 'releases', RELEASE_SUMMARY_KEY])
+        remove_unknown_keys_from_dict(metadata['info'], STORED_INFO_FIELDS)
+        for release_files in (metadata.get('releases') or {}).values():
+            for release_file in release_files:
+                remove_unknown_keys_from_dict(release_file, PACKAGE_RELEASES_TABLE_COLUMNS)
+
+    @staticmethod
+    def _count_rows(metadata):
+        """
+        Counts the rows that committing the metadata will write: one package, its classifiers, its release files and its
+        release summary
+
+        :param metadata: Package metadata
+        :type metadata: dict
+
+        :return: Number of rows
+        :rtype: int
+        """
+        releases = metadata.get('releases') or {}
+        return 2 + len(metadata['info'].get('classifiers') or []) + sum(len(x) for x in releases.values())
+
     def _truncate_description(self, metadata):
         """
         Truncates the description and summary fields in the metadata dict to a specified length
@@ -207,13 +759,7 @@ class PyPiMetadataRetriever:
         :param metadata: Metadata containing the description
         :type metadata: dict
         """
-        description = metadata['info']['description']
-        if description:
-            metadata['info']['description'] = description[:self.truncate_description]
-
-        summary = metadata['info']['summary']
-        if summary:
-            metadata['info']['summary'] = summary[:self.truncate_description]
+        truncate_description(metadata, self.truncate_description)
 
     def _truncate_releases(self, metadata):
         """
@@ -222,21 +768,7 @@ class PyPiMetadataRetriever:
         :param metadata: Metadata containing the releases
         :type metadata: dict
         """
-        releases = metadata['releases'] or {}
-
-        # In Py3 by default we can't rely on the order of the release dictionary so order the releases using an
-        # OrderedDict
-        try:
-            ordered_releases_names = sorted(list(releases.keys()), key=LooseVersion, reverse=True)
-        except TypeError:
-            # Handle a Py3 issue when trying to compare two versions where one contains a string
-            # (https://bugs.python.org/issue14894). Instead sort by upload time of the first file of each release
-            ordered_releases_names = order_release_names_fallback(releases)
-
-        ordered_releases = OrderedDict()
-        for release_name in ordered_releases_names[:self.truncate_releases]:
-            ordered_releases[release_name] = releases[release_name]
-        metadata['releases'] = ordered_releases
+        truncate_releases(metadata, self.truncate_releases)
 
     def _report_404(self, package_name):
         """
@@ -247,16 +779,3 @@ class PyPiMetadataRetriever:
         """
         with self._404_file_lock:
             append_line_to_file(self.file_path_404, package_name)
-
-    def _update_progress(self, number_to_add):
-        """
-        Update the progress counter in a thread safe way and log out the progress
-
-        :param number_to_add: Number of packages processed by the calling thread since the last invocation
-        :type number_to_add: int
-        """
-        if self._start_time:
-            with self._progress_counter_lock:
-                self._progress_counter += number_to_add
-            time_diff = datetime.now() - self._start_time
-            logger.info('Runtime: {}, processed {}/{}'.format(time_diff, self._progress_counter, len(self.package_list)))
@@ -1,24 +1,126 @@
+from collections import namedtuple, OrderedDict
+from itertools import groupby
+from datetime import datetime
+import hashlib
+import json
+import sqlite3
 from pypianalyser.sql_queries import CREATE_TABLE_SQL_QUERIES, INSERT_PACKAGE_SQL, INSERT_CLASSIFIER_STRING_SQL, \
     INSERT_PACKAGE_CLASSIFIER_SQL, INSERT_PACKAGE_RELEASES_SQL, SELECT_ID_FOR_CLASSIFIER_STRING_SQL, \
     SELECT_CLASSIFIERS_FOR_PACKAGE_SQL, PACKAGE_TABLE_COLUMNS, PACKAGE_RELEASES_TABLE_COLUMNS, \
-    SELECT_RELEASE_FILES_FOR_PACKAGE_SQL
-from pypianalyser.utils import order_dict_by_key_name, remove_unknown_keys_from_dict, normalize_package_name
-from pypianalyser.sqlite_helper import SQLiteHelper
+    SELECT_RELEASE_FILES_FOR_PACKAGE_SQL, SELECT_PACKAGE_BY_NAME_SQL, SELECT_PACKAGE_NAMES_SQL, \
+    SELECT_ID_FOR_PACKAGE_NAME_SQL, SELECT_ALL_PACKAGES_SQL, SELECT_ALL_RELEASE_FILES_SQL, \
+    CREATE_PACKAGE_SEARCH_TABLE_SQL, DELETE_PACKAGE_SEARCH_ENTRY_SQL, INSERT_PACKAGE_SEARCH_ENTRY_SQL, \
+    INSERT_NEW_PACKAGE_SEARCH_ENTRY_SQL, \
+    REBUILD_PACKAGE_SEARCH_INDEX_SQL, SEARCH_PACKAGES_SQL, SEARCH_RESULT_COLUMNS, CREATE_ROLLUP_DIRTY_KEYS_TABLE_SQL, \
+    CREATE_ROLLUP_TABLE_SQL_QUERIES, INSERT_ROLLUP_FULL_REBUILD_MARKER_SQL, SELECT_ROLLUP_FULL_REBUILD_MARKER_SQL, \
+    ROLLUP_UPDATE_SQL, ROLLUP_DIRTY_KEYS_WHERE, DELETE_ROLLUP_SQL, DELETE_ROLLUP_DIRTY_KEYS_SQL, \
+    DELETE_ALL_ROLLUP_DIRTY_KEYS_SQL, SELECT_CLASSIFIER_COUNTS_SQL, SELECT_REQUIRES_PYTHON_COUNTS_SQL, \
+    SELECT_LICENSE_COUNTS_SQL, SELECT_MONTHLY_UPLOAD_COUNTS_SQL
+from pypianalyser.sql_queries import CREATE_COMPRESSION_DICTIONARIES_TABLE_SQL, CREATE_PACKAGE_DESCRIPTIONS_TABLE_SQL, \
+    INSERT_PACKAGE_DESCRIPTION_SQL, UPDATE_PACKAGE_DESCRIPTION_SQL, SELECT_DESCRIPTION_FOR_PACKAGE_NAME_SQL, \
+    SELECT_ALL_DESCRIPTIONS_SQL, SELECT_INLINE_DESCRIPTIONS_SQL, CLEAR_INLINE_DESCRIPTION_SQL, \
+    SELECT_COMPRESSED_DESCRIPTION_SAMPLE_SQL, SELECT_DESCRIPTIONS_TO_RECOMPRESS_SQL, COUNT_PACKAGE_DESCRIPTIONS_SQL, \
+    INSERT_COMPRESSION_DICTIONARY_SQL, SELECT_LATEST_COMPRESSION_DICTIONARY_SQL, SELECT_COMPRESSION_DICTIONARY_SQL, \
+    SELECT_ALL_PACKAGES_WITH_DESCRIPTIONS_SQL, TABLE_COLUMNS, SELECT_COLUMNS_SQL, CLEAR_PACKAGE_SEARCH_INDEX_SQL
+from pypianalyser.sql_queries import CREATE_PACKAGE_SYNC_STATE_TABLE_SQL, UPSERT_PACKAGE_SYNC_STATE_SQL, \
+    UPDATE_PACKAGE_LAST_FETCHED_SQL, SELECT_PACKAGE_SYNC_STATE_SQL, UPDATE_PACKAGE_SQL, \
+    SELECT_CLASSIFIER_IDS_FOR_PACKAGE_SQL, DELETE_PACKAGE_CLASSIFIER_SQL, DELETE_PACKAGE_DESCRIPTION_SQL, \
+    RELEASE_FILE_INSERT_COLUMNS, SELECT_RELEASE_FILES_FOR_PACKAGE_ID_SQL, UPDATE_PACKAGE_RELEASE_SQL, \
+    DELETE_PACKAGE_RELEASE_SQL, SELECT_PACKAGE_FETCH_TIMES_SQL, SELECT_PACKAGE_NAMES_STAMP_SQL, \
+    SELECT_PACKAGE_NAMES_ADDED_SINCE_SQL
+from pypianalyser.sql_queries import CREATE_PACKAGE_RELEASE_SUMMARY_TABLE_SQL, CREATE_PACKAGE_RELEASE_SUMMARY_INDEX_SQL, \
+    PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS, UPSERT_PACKAGE_RELEASE_SUMMARY_SQL, SELECT_RELEASE_SUMMARY_FOR_PACKAGE_SQL, \
+    SELECT_ALL_RELEASE_SUMMARIES_SQL, SELECT_RELEASE_FILES_WITHOUT_SUMMARY_SQL
+from pypianalyser.compression import TextCompressor, train_dictionary, DEFAULT_CODEC
+from pypianalyser.name_index import load_name_index, NAME_INDEX_SUFFIX
+from pypianalyser.utils import order_dict_by_key_name, remove_unknown_keys_from_dict, normalize_package_name, \
+    build_search_query, split_requires_dist, split_project_urls, summarise_releases
+from pypianalyser.sqlite_helper import SQLiteHelper, DEFAULT_FETCH_BATCH_SIZE, ROW_TYPE_DICT
+
+# Lightweight row types for the iter_* methods. namedtuples have no per-instance __dict__ so are considerably smaller
+# than a dict per row
+PackageRow = namedtuple('PackageRow', PACKAGE_TABLE_COLUMNS)
+PackageReleaseRow = namedtuple('PackageReleaseRow', PACKAGE_RELEASES_TABLE_COLUMNS)
+
+PACKAGE_SEARCH_TABLE = 'packages_fts'
+ROLLUP_DIRTY_KEYS_TABLE = 'rollup_dirty_keys'
+PACKAGE_DESCRIPTIONS_TABLE = 'package_descriptions'
+PACKAGE_RELEASE_SUMMARY_TABLE = 'package_release_summary'
+# Key of the release summary in package metadata, added by the retriever before the releases are truncated
+RELEASE_SUMMARY_KEY = 'release_summary'
+# Number of compressed descriptions needed before a shared dictionary is trained
+MIN_DICTIONARY_SAMPLES = 200
+DICTIONARY_SAMPLE_SIZE = 2000
+
+# Results of refresh_package()
+REFRESH_ADDED = 'added'
+REFRESH_UPDATED = 'updated'
+REFRESH_UNCHANGED = 'unchanged'
+# Parts of the payload that are stored, and therefore hashed to detect changes
+HASHED_INFO_FIELDS = sorted([x for x in PACKAGE_TABLE_COLUMNS if x != 'id'] + ['classifiers'])
+HASHED_RELEASE_FIELDS = [x for x in RELEASE_FILE_INSERT_COLUMNS if x not in ('package_id', 'version')]
+RELEASE_SUMMARY_COLUMNS = [x for x in PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS if x != 'package_id']
 
 
 class PyPiAnalyserSqliteHelper(SQLiteHelper):
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, read_pool_size=4, enable_search_index=False, compress_descriptions=False):
         """
         Constructor for PyPiAnalyserSqliteHelper. Opens a handle to the database and creates the tables if they do not
         exist
 
         :param db_path: Path to the database file
         :type db_path: str
+        :param read_pool_size: Maximum number of read-only connections used by the get_* queries
+        :type read_pool_size: int
+        :param enable_search_index: Create the full-text search index if the database doesn't have one. Once created,
+         the index is kept up to date on every ingest regardless of this flag
+        :type enable_search_index: bool
+        :param compress_descriptions: Store descriptions compressed in the package_descriptions table rather than in
+         the packages table. Existing descriptions are moved over when this is first enabled, after which it stays
+         enabled for the database regardless of this flag
+        :type compress_descriptions: bool
         """
-        SQLiteHelper.__init__(self, db_path)
+        SQLiteHelper.__init__(self, db_path, read_pool_size)
         for table_sql in CREATE_TABLE_SQL_QUERIES:
-            self.sql_worker.execute(table_sql)
+            self._execute_write(table_sql)
+        self._execute_write(CREATE_PACKAGE_SYNC_STATE_TABLE_SQL)
+        release_summary_exists = self._table_exists(PACKAGE_RELEASE_SUMMARY_TABLE)
+        self._execute_write(CREATE_PACKAGE_RELEASE_SUMMARY_TABLE_SQL)
+        self._execute_write(CREATE_PACKAGE_RELEASE_SUMMARY_INDEX_SQL)
+        if not release_summary_exists:
+            # Summarise the packages that were added before the summary table existed
+            self._add_missing_release_summaries()
+
+        rollups_exist = self._table_exists(ROLLUP_DIRTY_KEYS_TABLE)
+        self._execute_write(CREATE_ROLLUP_DIRTY_KEYS_TABLE_SQL)
+        for rollup_sql in CREATE_ROLLUP_TABLE_SQL_QUERIES:
+            self._execute_write(rollup_sql)
+        if not rollups_exist:
+            # Any packages already in the database were added before the triggers that track changes, so the first
+            # update has to count everything
+            self._execute_write(INSERT_ROLLUP_FULL_REBUILD_MARKER_SQL)
+
+        # Compressors keyed by (codec, dictionary ID), and the one used for new descriptions
+        self._description_compressors = {}
+        self._description_compressor = None
+        self._description_dictionary_id = None
+        self.compress_descriptions = self._table_exists(PACKAGE_DESCRIPTIONS_TABLE)
+        if compress_descriptions and not self.compress_descriptions:
+            self._execute_write(CREATE_COMPRESSION_DICTIONARIES_TABLE_SQL)
+            self._execute_write(CREATE_PACKAGE_DESCRIPTIONS_TABLE_SQL)
+            self.compress_descriptions = True
+            self._load_description_dictionary()
+            self._move_inline_descriptions()
+        elif self.compress_descriptions:
+            self._load_description_dictionary()
+
+        self.search_index_enabled = self._table_exists(PACKAGE_SEARCH_TABLE)
+        if enable_search_index and not self.search_index_enabled:
+            self._execute_write(CREATE_PACKAGE_SEARCH_TABLE_SQL)
+            # Index any packages that were added before the search index existed
+            self._rebuild_search_index()
+            self.search_index_enabled = True
 
         # Cache of classifier strings to reduce database querying
         self._classifier_ids_cache = {}
@@ -29,22 +131,173 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
 
         :param package_metadata: Metadata dictionary returned from PyPi's API
         :type package_metadata: dict
+
+        :return: Primary key ID of the package
+        :rtype: int
         """
         package_id = self.add_package_info(package_metadata['info'])
         for release_name, release in package_metadata['releases'].items():
             self.add_release(package_id, release_name, release)
+        self._write_release_summary(package_id, package_metadata)
+        return package_id
+
+    def refresh_package(self, package_metadata):
+        """
+        Adds a package, or brings it up to date if it is already in the database. A hash of the stored parts of the
+        payload is kept for every package, so a package that hasn't changed since it was last refreshed is skipped
+        without writing anything but its fetch time. A changed package is updated in place, and only the classifiers and
+        release files that were added, changed or removed are written
+
+        :param package_metadata: Metadata dictionary returned from PyPi's API
+        :type package_metadata: dict
+
+        :return: REFRESH_ADDED, REFRESH_UPDATED or REFRESH_UNCHANGED
+        :rtype: str
+        """
+        payload_hash = self._hash_payload(package_metadata)
+        package_name = normalize_package_name(package_metadata['info']['name'])
+        fetched_time = datetime.utcnow().isoformat()
+        # Queried through the worker so that packages refreshed earlier in the same run are seen
+        rows = self.sql_worker.execute(SELECT_PACKAGE_SYNC_STATE_SQL, (package_name,))
+        if rows and rows[0][1] == payload_hash:
+            self._execute_write(UPDATE_PACKAGE_LAST_FETCHED_SQL, (fetched_time, rows[0][0]))
+            return REFRESH_UNCHANGED
+
+        if rows:
+            package_id = self.add_package_info(package_metadata['info'], update=True)
+            self._sync_releases(package_id, package_metadata['releases'] or {})
+            self._write_release_summary(package_id, package_metadata)
+            result = REFRESH_UPDATED
+        else:
+            package_id = self.commit_package_to_db(package_metadata)
+            result = REFRESH_ADDED
+        self._execute_write(UPSERT_PACKAGE_SYNC_STATE_SQL, (package_id, payload_hash, fetched_time))
+        return result
 
-    def add_package_info(self, package_info):
+    @staticmethod
+    def _hash_payload(package_metadata):
+        """
+        Hashes the parts of a package's metadata that are stored in the database. Fields that aren't stored are left
+        out, so changes to them don't cause a rewrite
+
+        :param package_metadata: Metadata dictionary returned from PyPi's API
+        :type package_metadata: dict
+
+        :return: Hex digest
+        :rtype: str
+        """
+        info = package_metadata['info']
+        normalized = {
+            'info': [info.get(x) for x in HASHED_INFO_FIELDS],
+            'releases': dict((version, [[x.get(y) for y in HASHED_RELEASE_FIELDS] for x in release_files])
+                             for version, release_files in (package_metadata['releases'] or {}).items()),
+            # Covers the releases that were truncated before storage
+            'release_summary': package_metadata.get(RELEASE_SUMMARY_KEY),
+        }
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _write_release_summary(self, package_id, package_metadata):
+        """
+        Writes the release summary of a package, replacing any previous summary. The summary added to the metadata by
+        the retriever is used if there is one, otherwise the releases in the metadata are summarised
+
+        :param package_id: ID of the package
+        :type package_id: int
+        :param package_metadata: Metadata dictionary returned from PyPi's API
+        :type package_metadata: dict
+        """
+        summary = package_metadata.get(RELEASE_SUMMARY_KEY) or summarise_releases(package_metadata['releases'])
+        self._execute_write(UPSERT_PACKAGE_RELEASE_SUMMARY_SQL,
+                            (package_id,) + tuple(summary[x] for x in RELEASE_SUMMARY_COLUMNS))
+
+    def _add_missing_release_summaries(self):
+        """
+        Summarises the stored releases of every package that has release files but no release summary, e.g. packages
+        added before the summary table existed or merged from a shard without one. Only the releases that were stored
+        can be summarised, so the summaries of packages whose releases were truncated at ingest are partial
+        """
+        rows = self._iter_read(SELECT_RELEASE_FILES_WITHOUT_SUMMARY_SQL,
+                               row_factory=self._build_row_factory(ROW_TYPE_DICT, PACKAGE_RELEASES_TABLE_COLUMNS))
+        summaries = []
+        for package_id, release_files in groupby(rows, key=lambda x: x['package_id']):
+            releases = {}
+            for release_file in release_files:
+                releases.setdefault(release_file['version'], []).append(release_file)
+            summary = summarise_releases(releases)
+            summaries.append((package_id,) + tuple(summary[x] for x in RELEASE_SUMMARY_COLUMNS))
+        # Written once the read has finished, as reads flush the pending writes first
+        for values in summaries:
+            self._execute_write(UPSERT_PACKAGE_RELEASE_SUMMARY_SQL, values)
+
+    def _sync_releases(self, package_id, releases):
+        """
+        Brings the release files of a package in line with its latest metadata, inserting, updating and deleting only
+        the files that differ. Files are matched on their version and filename
+
+        :param package_id: ID of the package
+        :type package_id: int
+        :param releases: Release names mapped to lists of release files
+        :type releases: dict
+        """
+        version_index = RELEASE_FILE_INSERT_COLUMNS.index('version')
+        filename_index = RELEASE_FILE_INSERT_COLUMNS.index('filename')
+        existing_files = {}
+        for row in self.sql_worker.execute(SELECT_RELEASE_FILES_FOR_PACKAGE_ID_SQL, (package_id,)):
+            values = tuple(row[1:])
+            existing_files[(values[version_index], values[filename_index])] = (row[0], values)
+
+        for release_name, release in releases.items():
+            for release_file in release:
+                release_file = dict(release_file, package_id=package_id, version=release_name)
+                values = tuple(release_file.get(x) for x in RELEASE_FILE_INSERT_COLUMNS)
+                existing_file = existing_files.pop((release_name, release_file.get('filename')), None)
+                if existing_file is None:
+                    self._execute_write(INSERT_PACKAGE_RELEASES_SQL, values)
+                elif existing_file[1] != values:
+                    self._execute_write(UPDATE_PACKAGE_RELEASE_SQL, values + (existing_file[0],))
+
+        # Anything left over is no longer in the metadata
+        for release_id, _ in existing_files.values():
+            self._execute_write(DELETE_PACKAGE_RELEASE_SQL, (release_id,))
+
+    def _sync_classifiers(self, package_id, classifiers):
+        """
+        Brings the classifiers of a package in line with its latest metadata, adding and removing only those that
+        differ
+
+        :param package_id: ID of the package
+        :type package_id: int
+        :param classifiers: Classifier strings
+        :type classifiers: list
+        """
+        existing_ids = set(x[0] for x in self.sql_worker.execute(SELECT_CLASSIFIER_IDS_FOR_PACKAGE_SQL, (package_id,)))
+        wanted_ids = set()
+        for classifier in classifiers:
+            classifier_id = self._get_or_add_classifier_id(classifier)
+            wanted_ids.add(classifier_id)
+            if classifier_id not in existing_ids:
+                self._execute_write(INSERT_PACKAGE_CLASSIFIER_SQL, (classifier_id, package_id))
+        for classifier_id in existing_ids - wanted_ids:
+            self._execute_write(DELETE_PACKAGE_CLASSIFIER_SQL, (package_id, classifier_id))
+
+    def add_package_info(self, package_info, update=False):
         """
         Adds the main package metadata to the database
 
         :param package_info: Dictionary of metadata
         :type package_info: dict
+        :param update: The package is already in the database and is updated in place, replacing its description and
+         adding and removing classifiers as needed. Otherwise an existing package is left as it is
+        :type update: bool
 
         :return: Primary key ID of the entry added to the packages table
         :rtype int
         """
         package_info['name'] = normalize_package_name(package_info['name'])
+        description = package_info.get('description')
+        if self.compress_descriptions:
+            # The description is stored in its own table
+            package_info['description'] = None
         # Classifiers will go into their own table so remove here
         classifiers = package_info.pop('classifiers')
         # For simplicity concat project urls and store in one field
@@ -64,12 +317,33 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         ordered_package_info = order_dict_by_key_name(package_info)
 
         # Add to the database
-        self.sql_worker.execute(INSERT_PACKAGE_SQL, tuple(ordered_package_info.values()))
+        if update:
+            # An UPDATE rather than an upsert, the conflict handling of an upsert also applies to the rollup triggers
+            values = [v for k, v in ordered_package_info.items() if k != 'name'] + [package_info['name']]
+            self._execute_write(UPDATE_PACKAGE_SQL, tuple(values))
+        else:
+            self._execute_write(INSERT_PACKAGE_SQL, tuple(ordered_package_info.values()))
         package_id = self.get_package_id(package_info['name'])
 
         # Now process each classifier
-        for classifier in classifiers:
-            self.add_classifier(package_id, classifier)
+        if update:
+            self._sync_classifiers(package_id, classifiers)
+        else:
+            for classifier in classifiers:
+                self.add_classifier(package_id, classifier)
+
+        if self.compress_descriptions and update:
+            self._execute_write(DELETE_PACKAGE_DESCRIPTION_SQL, (package_id,))
+        if self.compress_descriptions and description:
+            self._add_compressed_description(package_id, description)
+
+        if self.search_index_enabled and update:
+            self._execute_write(DELETE_PACKAGE_SEARCH_ENTRY_SQL, (package_id,))
+            self._execute_write(INSERT_PACKAGE_SEARCH_ENTRY_SQL, (description, package_id))
+        elif self.search_index_enabled:
+            # The writes are queued on the worker thread so the row count of the insert isn't available here. The entry
+            # is only written if the package doesn't have one, i.e. if the insert wasn't skipped
+            self._execute_write(INSERT_NEW_PACKAGE_SEARCH_ENTRY_SQL, (description, package_id, package_id))
 
         return package_id
 
@@ -96,7 +370,7 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
             release_file['version'] = release_name
 
             ordered_release_dict = order_dict_by_key_name(release_file)
-            self.sql_worker.execute(INSERT_PACKAGE_RELEASES_SQL, tuple(ordered_release_dict.values()))
+            self._execute_write(INSERT_PACKAGE_RELEASES_SQL, tuple(ordered_release_dict.values()))
 
     def add_classifier(self, package_id, classifier):
         """
@@ -106,21 +380,34 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         :param classifier: Classifier string
         :type classifier: str
         """
-        if classifier in self._classifier_ids_cache:
-            classifier_id = self._classifier_ids_cache[classifier]
-        else:
-            # Insert the classifier string if this is the first time we've come across it
-            self.sql_worker.execute(INSERT_CLASSIFIER_STRING_SQL, (classifier,))
-            # Query for the ID
-            classifier_id = self.get_classifier_id(classifier)
-            self._classifier_ids_cache[classifier] = classifier_id
+        classifier_id = self._get_or_add_classifier_id(classifier)
 
         # Now add an entry in the package_classifiers table that links the package to that classifier
-        self.sql_worker.execute(INSERT_PACKAGE_CLASSIFIER_SQL, (classifier_id, package_id))
+        self._execute_write(INSERT_PACKAGE_CLASSIFIER_SQL, (classifier_id, package_id))
+
+    def _get_or_add_classifier_id(self, classifier):
+        """
+        Returns the ID of a classifier string, adding it to the classifier_strings table if it's new
+
+        :param classifier: Classifier string
+        :type classifier: str
+
+        :return: ID of the classifier
+        :rtype: int
+        """
+        if classifier in self._classifier_ids_cache:
+            return self._classifier_ids_cache[classifier]
+        # Insert the classifier string if this is the first time we've come across it
+        self._execute_write(INSERT_CLASSIFIER_STRING_SQL, (classifier,))
+        # Query for the ID
+        classifier_id = self.get_classifier_id(classifier)
+        self._classifier_ids_cache[classifier] = classifier_id
+        return classifier_id
 
     def get_classifier_id(self, classifier_str):
         """
-        Queries for the ID of a classifier string
+        Queries for the ID of a classifier string. Goes through the worker thread so that a classifier it has just
+        inserted is found
 
         :param classifier_str: Classifier string to query
         :type classifier_str: str
@@ -141,8 +428,7 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         :return: List of classifier strings
         :rtype: list
         """
-        ret = self.sql_worker.execute(SELECT_CLASSIFIERS_FOR_PACKAGE_SQL, (package_name,))
-        rows = ret
+        rows = self._execute_read(SELECT_CLASSIFIERS_FOR_PACKAGE_SQL, (package_name,))
 
         return [x[0] for x in rows]
 
@@ -153,12 +439,153 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         :return: List of package names
         :rtype: list
         """
-        rows = self.sql_worker.execute("SELECT name FROM packages")
-        return [x[0] for x in rows]
+        return list(self.iter_package_names())
+
+    def iter_package_names(self, batch_size=DEFAULT_FETCH_BATCH_SIZE):
+        """
+        Generator that yields the names of packages that are in the database
+
+        :param batch_size: Number of rows to fetch from the database at a time
+        :type batch_size: int
+
+        :return: Generator of package names
+        :rtype: generator
+        """
+        for row in self._iter_read(SELECT_PACKAGE_NAMES_SQL, batch_size=batch_size):
+            yield row[0]
+
+    def open_name_index(self, index_path=None):
+        """
+        Opens a compact, memory-mapped index of the names of the packages in the database, for membership checks that
+        don't load every name into memory. The index is kept in a file next to the database and is brought up to date
+        first if packages have been added since it was built, by adding only the new packages to it
+
+        :param index_path: Path to the index file, or None for the database path with a .names suffix
+        :type index_path: str or None
+
+        :return: Open index. Close it once finished with
+        :rtype: pypianalyser.name_index.NameIndex
+        """
+        stamp = self._execute_read(SELECT_PACKAGE_NAMES_STAMP_SQL)[0]
+        return load_name_index(index_path or self._db_path + NAME_INDEX_SUFFIX, stamp, self.iter_package_names,
+                               lambda index_stamp: self._get_package_names_added_since(index_stamp, stamp))
+
+    def _get_package_names_added_since(self, index_stamp, stamp):
+        """
+        Gets the names of the packages added since a name index was built. Package IDs only increase, so if no package
+        has been removed since, the added packages are those with an ID above the maximum when the index was built
+
+        :param index_stamp: Number of packages and maximum package ID when the index was built
+        :type index_stamp: tuple
+        :param stamp: Current number of packages and maximum package ID
+        :type stamp: tuple
+
+        :return: Names of the added packages, or None if packages have also been removed
+        :rtype: list or None
+        """
+        names = [x[0] for x in self._execute_read(SELECT_PACKAGE_NAMES_ADDED_SINCE_SQL, (index_stamp[1],))]
+        if index_stamp[0] + len(names) != stamp[0]:
+            return None
+        return names
+
+    def iter_package_fetch_times(self, batch_size=DEFAULT_FETCH_BATCH_SIZE):
+        """
+        Generator that yields the name of every package in the database along with when it was last fetched by a refresh
+
+        :param batch_size: Number of rows to fetch from the database at a time
+        :type batch_size: int
+
+        :return: Generator of (name, last fetched ISO 8601 UTC timestamp) tuples. The timestamp is None for packages that
+         have never been refreshed
+        :rtype: generator
+        """
+        for row in self._iter_read(SELECT_PACKAGE_FETCH_TIMES_SQL, batch_size=batch_size):
+            yield row[0], row[1]
+
+    def iter_packages(self, batch_size=DEFAULT_FETCH_BATCH_SIZE, row_type=ROW_TYPE_DICT, with_descriptions=False):
+        """
+        Generator that yields every row of the packages table
+
+        :param batch_size: Number of rows to fetch from the database at a time
+        :type batch_size: int
+        :param row_type: Type of row to yield, 'dict', 'namedtuple' (PackageRow) or 'tuple'
+        :type row_type: str
+        :param with_descriptions: Decompress and include descriptions that are stored compressed. When False the
+         description of these packages is None
+        :type with_descriptions: bool
+
+        :return: Generator of package rows
+        :rtype: generator
+        """
+        row_factory = self._build_row_factory(row_type, PACKAGE_TABLE_COLUMNS, PackageRow)
+        if not (with_descriptions and self.compress_descriptions):
+            return self._iter_read(SELECT_ALL_PACKAGES_SQL, batch_size=batch_size, row_factory=row_factory)
+
+        description_index = PACKAGE_TABLE_COLUMNS.index('description')
+        column_count = len(PACKAGE_TABLE_COLUMNS)
+
+        def decompress_row(row):
+            codec, dictionary_id, data = row[column_count:]
+            row = row[:column_count]
+            if data is not None:
+                description = self._get_description_compressor(codec, dictionary_id).decompress(data)
+                row = row[:description_index] + (description,) + row[description_index + 1:]
+            return row_factory(row) if row_factory else row
+
+        return self._iter_read(SELECT_ALL_PACKAGES_WITH_DESCRIPTIONS_SQL, batch_size=batch_size,
+                               row_factory=decompress_row)
+
+    def iter_table(self, table_name, batch_size=DEFAULT_FETCH_BATCH_SIZE, row_type=ROW_TYPE_DICT, columns=None):
+        """
+        Generator that yields every row of one of the core tables: packages, package_releases, classifier_strings or
+        package_classifiers
+
+        :param table_name: Name of the table
+        :type table_name: str
+        :param batch_size: Number of rows to fetch from the database at a time
+        :type batch_size: int
+        :param row_type: Type of row to yield, 'dict', 'namedtuple' or 'tuple'
+        :type row_type: str
+        :param columns: Names of the columns to query, or None for all of them
+        :type columns: list or None
+
+        :return: Generator of rows
+        :rtype: generator
+        """
+        if table_name not in TABLE_COLUMNS:
+            raise ValueError('Unknown table: {}. Must be one of {}'.format(table_name, ', '.join(TABLE_COLUMNS)))
+        unknown_columns = set(columns or []) - set(TABLE_COLUMNS[table_name])
+        if unknown_columns:
+            raise ValueError('Unknown columns for table {}: {}'.format(table_name, ', '.join(sorted(unknown_columns))))
+        columns = columns or TABLE_COLUMNS[table_name]
+        row_factory = self._build_row_factory(row_type, columns)
+        return self._iter_read(SELECT_COLUMNS_SQL.format(columns=', '.join(columns), table=table_name),
+                               batch_size=batch_size, row_factory=row_factory)
+
+    def iter_releases(self, package_name=None, batch_size=DEFAULT_FETCH_BATCH_SIZE, row_type=ROW_TYPE_DICT):
+        """
+        Generator that yields release file rows, either for every package or for a single package
+
+        :param package_name: Name of the package to query, or None for the releases of all packages
+        :type package_name: str or None
+        :param batch_size: Number of rows to fetch from the database at a time
+        :type batch_size: int
+        :param row_type: Type of row to yield, 'dict', 'namedtuple' (PackageReleaseRow) or 'tuple'
+        :type row_type: str
+
+        :return: Generator of release file rows
+        :rtype: generator
+        """
+        row_factory = self._build_row_factory(row_type, PACKAGE_RELEASES_TABLE_COLUMNS, PackageReleaseRow)
+        if package_name is None:
+            return self._iter_read(SELECT_ALL_RELEASE_FILES_SQL, batch_size=batch_size, row_factory=row_factory)
+        return self._iter_read(SELECT_RELEASE_FILES_FOR_PACKAGE_SQL, (package_name,), batch_size=batch_size,
+                               row_factory=row_factory)
 
     def get_package_id(self, package_name):
         """
-        Queries the database and returns the ID for a given package name
+        Queries the database and returns the ID for a given package name, through the worker thread as the package
+        row may not have been committed yet
 
         :param package_name: Name of the package to query
         :type package_name: str
@@ -166,7 +593,7 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         :return: Package ID
         :rtype: int
         """
-        rows = self.sql_worker.execute("SELECT id FROM packages WHERE name=?", (package_name,))
+        rows = self.sql_worker.execute(SELECT_ID_FOR_PACKAGE_NAME_SQL, (package_name,))
         row = rows[0]
 
         return row[0]
@@ -182,11 +609,9 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         :rtype: list
         """
         ret_val = {}
-        rows = self.sql_worker.execute(SELECT_RELEASE_FILES_FOR_PACKAGE_SQL, (package_name,))
-        rows = self._map_data_to_column_names(rows, PACKAGE_RELEASES_TABLE_COLUMNS)
 
         # Take the releases and put it back into a dictionary like it was when it was downloaded from PyPi
-        for row_dict in rows:
+        for row_dict in self.iter_releases(package_name):
             release_name = row_dict['version']
             if release_name not in ret_val:
                 ret_val[release_name] = [row_dict]
@@ -203,6 +628,344 @@ class PyPiAnalyserSqliteHelper(SQLiteHelper):
         :return: List of dictionary rows
         :rtype: list
         """
-        rows = self.sql_worker.execute("SELECT * FROM packages WHERE name=?", (package_name,))
+        rows = self._execute_read(SELECT_PACKAGE_BY_NAME_SQL, (package_name,))
         rows = self._map_data_to_column_names(rows, PACKAGE_TABLE_COLUMNS)
-        return rows[0]
+        row = rows[0]
+        if row['description'] is None and self.compress_descriptions:
+            row['description'] = self.get_package_description(package_name)
+        return row
+
+    def get_package_metadata(self, package_name):
+        """
+        Rebuilds the metadata of a package in the form served by the PyPi JSON API (/pypi/<package>/json), from the
+        packages, package_releases and package_classifiers tables. Only what was stored can be rebuilt, so fields and
+        releases that were truncated or dropped at ingest are missing
+
+        :param package_name: Name of the package to query
+        :type package_name: str
+
+        :return: Metadata with 'info', 'releases' and 'urls' (the files of the latest release) keys, or None if the
+         package isn't in the database
+        :rtype: dict or None
+        """
+        package_name = normalize_package_name(package_name)
+        rows = self._execute_read(SELECT_PACKAGE_BY_NAME_SQL, (package_name,))
+        if not rows:
+            return None
+        info = self._map_data_to_column_names(rows, PACKAGE_TABLE_COLUMNS)[0]
+        del info['id']
+        if info['description'] is None and self.compress_descriptions:
+            info['description'] = self.get_package_description(package_name)
+        info['classifiers'] = self.get_classifiers_for_package_name(package_name)
+        info['project_urls'] = split_project_urls(info['project_urls'])
+        info['requires_dist'] = split_requires_dist(info['requires_dist'])
+
+        releases = OrderedDict()
+        for release_file in self.iter_releases(package_name):
+            version = release_file.pop('version')
+            del release_file['id'], release_file['package_id']
+            if release_file['has_sig'] is not None:
+                release_file['has_sig'] = bool(release_file['has_sig'])
+            releases.setdefault(version, []).append(release_file)
+        return {'info': info, 'releases': releases, 'urls': releases.get(info['version'], [])}
+
+    def get_release_summary(self, package_name):
+        """
+        Queries the release summary of a package
+
+        :param package_name: Name of the package to query
+        :type package_name: str
+
+        :return: The latest version, first and last upload times, release and file counts, total size and whether any
+         file is a wheel, or None if the package has no summary
+        :rtype: dict or None
+        """
+        rows = self._execute_read(SELECT_RELEASE_SUMMARY_FOR_PACKAGE_SQL, (package_name,))
+        if not rows:
+            return None
+        row = self._map_data_to_column_names(rows, PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS)[0]
+        row['has_wheel'] = bool(row['has_wheel'])
+        return row
+
+    def iter_release_summaries(self, batch_size=DEFAULT_FETCH_BATCH_SIZE, row_type=ROW_TYPE_DICT):
+        """
+        Generator that yields the release summary of every package, with the package name, ordered by the time of the
+        last upload, oldest first. This is a single scan of the summary table's upload time index, for freshness reports
+
+        :param batch_size: Number of rows to fetch from the database at a time
+        :type batch_size: int
+        :param row_type: Type of row to yield, 'dict', 'namedtuple' or 'tuple'
+        :type row_type: str
+
+        :return: Generator of rows with the name column and the columns of the package_release_summary table other than
+         package_id
+        :rtype: generator
+        """
+        row_factory = self._build_row_factory(row_type, ['name'] + RELEASE_SUMMARY_COLUMNS)
+        return self._iter_read(SELECT_ALL_RELEASE_SUMMARIES_SQL, batch_size=batch_size, row_factory=row_factory)
+
+    def get_package_description(self, package_name):
+        """
+        Queries the description of a package, decompressing it if it's stored compressed. When iterating over packages
+        with iter_packages() compressed descriptions are left out, use this to load them only when they're needed
+
+        :param package_name: Name of the package to query
+        :type package_name: str
+
+        :return: Description of the package
+        :rtype: str or None
+        """
+        rows = self._execute_read(SELECT_DESCRIPTION_FOR_PACKAGE_NAME_SQL, (package_name,))
+        if not rows:
+            return None
+        inline_description, codec, dictionary_id, data = rows[0]
+        if data is None:
+            return inline_description
+        return self._get_description_compressor(codec, dictionary_id).decompress(data)
+
+    def ensure_description_dictionary(self, min_samples=MIN_DICTIONARY_SAMPLES):
+        """
+        Trains a shared compression dictionary for the descriptions once enough of them have been stored, and
+        recompresses the existing descriptions with it. Does nothing if description compression is disabled or a
+        dictionary has already been trained
+
+        :param min_samples: Number of stored descriptions needed before training
+        :type min_samples: int
+
+        :return: True if a dictionary was trained
+        :rtype: bool
+        """
+        if not self.compress_descriptions or self._description_dictionary_id is not None:
+            return False
+        if self._execute_read(COUNT_PACKAGE_DESCRIPTIONS_SQL)[0][0] < min_samples:
+            return False
+        if self.train_description_dictionary() is None:
+            return False
+        self.recompress_descriptions()
+        return True
+
+    def train_description_dictionary(self, sample_size=DICTIONARY_SAMPLE_SIZE):
+        """
+        Trains a new compression dictionary from a random sample of the stored descriptions. Descriptions added from
+        now on are compressed with it. Use recompress_descriptions() to apply it to existing descriptions
+
+        :param sample_size: Number of descriptions to train the dictionary from
+        :type sample_size: int
+
+        :return: ID of the new dictionary, or None if one could not be trained from the descriptions
+        :rtype: int or None
+        """
+        samples = [self._get_description_compressor(codec, dictionary_id).decompress(data)
+                   for _, codec, dictionary_id, data in
+                   self._execute_read(SELECT_COMPRESSED_DESCRIPTION_SAMPLE_SQL, (sample_size,))]
+        dictionary = train_dictionary(DEFAULT_CODEC, samples)
+        if dictionary is None:
+            return None
+        # Wrapped so that Python 2 stores the str as a blob rather than rejecting it as an 8-bit bytestring
+        self._execute_write(INSERT_COMPRESSION_DICTIONARY_SQL, (DEFAULT_CODEC, sqlite3.Binary(dictionary)))
+        self.flush()
+        self._load_description_dictionary()
+        return self._description_dictionary_id
+
+    def recompress_descriptions(self):
+        """
+        Recompresses every description that isn't compressed with the current codec and dictionary
+
+        :return: Number of descriptions recompressed
+        :rtype: int
+        """
+        count = 0
+        query_values = (self._description_compressor.codec, self._description_dictionary_id or -1)
+        for package_id, codec, dictionary_id, data in self._iter_read(SELECT_DESCRIPTIONS_TO_RECOMPRESS_SQL,
+                                                                      query_values):
+            description = self._get_description_compressor(codec, dictionary_id).decompress(data)
+            self._execute_write(UPDATE_PACKAGE_DESCRIPTION_SQL, (self._description_compressor.codec,
+                                                                 self._description_dictionary_id,
+                                                                 self._compress_description(description),
+                                                                 package_id))
+            count += 1
+        self.flush()
+        return count
+
+    def _add_compressed_description(self, package_id, description):
+        """
+        Compresses a description with the current dictionary and adds it to the package_descriptions table
+
+        :param package_id: ID of the package the description belongs to
+        :type package_id: int
+        :param description: Description text
+        :type description: str
+        """
+        self._execute_write(INSERT_PACKAGE_DESCRIPTION_SQL, (package_id,
+                                                             self._description_compressor.codec,
+                                                             self._description_dictionary_id,
+                                                             self._compress_description(description)))
+
+    def _compress_description(self, description):
+        """
+        Compresses a description with the current dictionary, ready to be written to the package_descriptions table
+
+        :param description: Description text
+        :type description: str
+
+        :return: Compressed description, wrapped so that Python 2 stores it as a blob rather than rejecting it as an
+         8-bit bytestring
+        :rtype: sqlite3.Binary
+        """
+        return sqlite3.Binary(self._description_compressor.compress(description))
+
+    def _load_description_dictionary(self):
+        """
+        Loads the most recently trained dictionary for the default codec, which is used to compress new descriptions
+        """
+        rows = self.sql_worker.execute(SELECT_LATEST_COMPRESSION_DICTIONARY_SQL, (DEFAULT_CODEC,))
+        if rows:
+            self._description_dictionary_id, dictionary = rows[0]
+            self._description_compressor = TextCompressor(DEFAULT_CODEC, bytes(dictionary))
+            self._description_compressors[(DEFAULT_CODEC, self._description_dictionary_id)] = \
+                self._description_compressor
+        else:
+            self._description_compressor = self._get_description_compressor(DEFAULT_CODEC, None)
+
+    def _get_description_compressor(self, codec, dictionary_id):
+        """
+        Returns the compressor for a codec and dictionary, loading the dictionary if needed
+
+        :param codec: Compression codec
+        :type codec: str
+        :param dictionary_id: ID of the dictionary, or None if no dictionary was used
+        :type dictionary_id: int or None
+
+        :return: Compressor
+        :rtype: TextCompressor
+        """
+        key = (codec, dictionary_id)
+        if key not in self._description_compressors:
+            dictionary = None
+            if dictionary_id is not None:
+                # Queried through the worker so that this can be called while iterating over a read-only connection
+                # without needing a second one from the pool
+                dictionary = bytes(self.sql_worker.execute(SELECT_COMPRESSION_DICTIONARY_SQL, (dictionary_id,))[0][0])
+            self._description_compressors[key] = TextCompressor(codec, dictionary)
+        return self._description_compressors[key]
+
+    def _move_inline_descriptions(self):
+        """
+        Moves descriptions stored in the packages table into the package_descriptions table
+        """
+        for package_id, description in self._iter_read(SELECT_INLINE_DESCRIPTIONS_SQL):
+            self._add_compressed_description(package_id, description)
+            self._execute_write(CLEAR_INLINE_DESCRIPTION_SQL, (package_id,))
+        self.flush()
+
+    def _rebuild_search_index(self):
+        """
+        Adds every package to the search index
+        """
+        if not self.compress_descriptions:
+            self._execute_write(REBUILD_PACKAGE_SEARCH_INDEX_SQL)
+            return
+        # Compressed descriptions can only be decompressed here rather than in SQL, so index the packages one at a time
+        for package_id, inline_description, codec, dictionary_id, data in self._iter_read(SELECT_ALL_DESCRIPTIONS_SQL):
+            description = inline_description
+            if data is not None:
+                description = self._get_description_compressor(codec, dictionary_id).decompress(data)
+            self._execute_write(INSERT_PACKAGE_SEARCH_ENTRY_SQL, (description, package_id))
+
+    def search_packages(self, search_terms, limit=20, raw_query=False):
+        """
+        Searches the name, summary, keywords and description of packages using the full-text search index. Results are
+        ranked by relevance, best match first
+
+        :param search_terms: Terms to search for. Every term must match
+        :type search_terms: str
+        :param limit: Maximum number of results to return
+        :type limit: int
+        :param raw_query: Pass search_terms straight through as an FTS5 query, allowing OR, NOT, prefix* and column
+         filters
+        :type raw_query: bool
+
+        :return: List of dictionary rows with the keys name, version, summary and score
+        :rtype: list
+        """
+        if not self.search_index_enabled:
+            raise Exception('The database does not have a search index. Rebuild it with the search index enabled')
+        match_query = search_terms if raw_query else build_search_query(search_terms)
+        rows = self._execute_read(SEARCH_PACKAGES_SQL, (match_query, limit))
+        return self._map_data_to_column_names(rows, SEARCH_RESULT_COLUMNS)
+
+    def update_rollups(self, full_rebuild=False):
+        """
+        Brings the rollup tables up to date. Only the keys affected by packages, classifiers and releases that have been
+        added, changed or removed since the last update are recounted. This should be run once ingest has finished
+        writing to the database
+
+        :param full_rebuild: Recount every key rather than just those that have changed
+        :type full_rebuild: bool
+        """
+        full_rebuild = full_rebuild or bool(self.sql_worker.execute(SELECT_ROLLUP_FULL_REBUILD_MARKER_SQL))
+        for rollup, (table, key_column, source_key, insert_sql) in ROLLUP_UPDATE_SQL.items():
+            if full_rebuild:
+                delete_where = insert_where = ''
+            else:
+                delete_where = ROLLUP_DIRTY_KEYS_WHERE.format(column=key_column, rollup=rollup)
+                insert_where = ROLLUP_DIRTY_KEYS_WHERE.format(column=source_key, rollup=rollup)
+            self._execute_write(DELETE_ROLLUP_SQL.format(table=table, where=delete_where))
+            self._execute_write(insert_sql.format(where=insert_where))
+            self._execute_write(DELETE_ROLLUP_DIRTY_KEYS_SQL, (rollup,))
+        if full_rebuild:
+            self._execute_write(DELETE_ALL_ROLLUP_DIRTY_KEYS_SQL)
+        self.flush()
+
+    def rebuild_derived_tables(self):
+        """
+        Rebuilds everything that is derived from the core tables: moves any uncompressed descriptions into the
+        package_descriptions table when compression is enabled, summarises the releases of packages without a release
+        summary, rebuilds the search index if there is one and recounts the rollup tables. Use after bulk changes that
+        bypass add_package_info(), such as merging databases
+        """
+        if self.compress_descriptions:
+            self._move_inline_descriptions()
+        self._add_missing_release_summaries()
+        if self.search_index_enabled:
+            self._execute_write(CLEAR_PACKAGE_SEARCH_INDEX_SQL)
+            self._rebuild_search_index()
+        self.update_rollups(full_rebuild=True)
+
+    def get_classifier_counts(self):
+        """
+        Returns the number of packages that have each classifier, from the rollup tables
+
+        :return: Classifier strings mapped to package counts, most common first
+        :rtype: OrderedDict
+        """
+        return OrderedDict(self._execute_read(SELECT_CLASSIFIER_COUNTS_SQL))
+
+    def get_requires_python_counts(self):
+        """
+        Returns the number of packages that have each requires_python specifier, from the rollup tables. Packages with
+        no specifier are counted under an empty string
+
+        :return: requires_python specifiers mapped to package counts, most common first
+        :rtype: OrderedDict
+        """
+        return OrderedDict(self._execute_read(SELECT_REQUIRES_PYTHON_COUNTS_SQL))
+
+    def get_license_counts(self):
+        """
+        Returns the number of packages that have each license, from the rollup tables. Packages with no license are
+        counted under an empty string
+
+        :return: Licenses mapped to package counts, most common first
+        :rtype: OrderedDict
+        """
+        return OrderedDict(self._execute_read(SELECT_LICENSE_COUNTS_SQL))
+
+    def get_monthly_upload_counts(self):
+        """
+        Returns the number of release files uploaded each month, from the rollup tables
+
+        :return: Months (YYYY-MM) mapped to upload counts, in chronological order
+        :rtype: OrderedDict
+        """
+        return OrderedDict(self._execute_read(SELECT_MONTHLY_UPLOAD_COUNTS_SQL))
@@ -0,0 +1,219 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+from pypianalyser.compression import TextCompressor
+from pypianalyser.sql_queries import PACKAGE_TABLE_COLUMNS, PACKAGE_RELEASES_TABLE_COLUMNS, QUERY_PACKAGE_INFO_SQL, \
+    QUERY_PACKAGE_DESCRIPTION_SQL, QUERY_PACKAGE_RELEASES_SQL, QUERY_PACKAGE_CLASSIFIERS_SQL, \
+    QUERY_REVERSE_DEPENDENCY_CANDIDATES_SQL, QUERY_PACKAGES_WITH_CLASSIFIER_SQL, SELECT_COMPRESSION_DICTIONARY_SQL
+from pypianalyser.sqlite_helper import connect_read_only
+from pypianalyser.utils import normalize_package_name, parse_requirement_names
+
+logger = logging.getLogger(__file__)
+
+QUERY_INFO = 'info'
+QUERY_RELEASES = 'releases'
+QUERY_CLASSIFIERS = 'classifiers'
+QUERY_REVERSE_DEPENDENCIES = 'rdeps'
+QUERY_CLASSIFIER_SEARCH = 'classifier'
+QUERY_TYPES = [QUERY_INFO, QUERY_RELEASES, QUERY_CLASSIFIERS, QUERY_REVERSE_DEPENDENCIES, QUERY_CLASSIFIER_SEARCH]
+
+# Output columns of each query
+QUERY_COLUMNS = {
+    QUERY_INFO: [x for x in PACKAGE_TABLE_COLUMNS if x != 'id'],
+    QUERY_RELEASES: ['name'] + [x for x in PACKAGE_RELEASES_TABLE_COLUMNS if x not in ('id', 'package_id')],
+    QUERY_CLASSIFIERS: ['name', 'classifier'],
+    QUERY_REVERSE_DEPENDENCIES: ['name', 'required_by', 'version'],
+    QUERY_CLASSIFIER_SEARCH: ['classifier', 'name', 'version', 'summary'],
+}
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_TSV = 'tsv'
+OUTPUT_FORMATS = [FORMAT_JSONL, FORMAT_TSV]
+
+# Enough for every lookup statement, and then some for ad hoc use of the connection
+STATEMENT_CACHE_SIZE = 256
+# Characters escaped in TSV values so that every row stays on one line
+TSV_ESCAPES = [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]
+
+
+class PackageQueries(object):
+    """
+    Lookups against a database created by the ingest command, for scripts that run many of them.
+
+    Unlike PyPiAnalyserSqliteHelper, which starts a writer thread and a pool of connections, this opens a single
+    read-only connection. The lookups are constant parameterised statements, so after the first lookup of each kind the
+    statement is reused from the connection's cache of prepared statements rather than being parsed again. Rows are
+    streamed from the cursor as they are read
+    """
+    def __init__(self, db_path):
+        """
+        Constructor for PackageQueries
+
+        :param db_path: Path to the database file
+        :type db_path: str
+        """
+        if not os.path.exists(db_path):
+            raise Exception('Database {} does not exist, run the ingest command first'.format(db_path))
+        self.db_path = db_path
+        self._conn = connect_read_only(db_path, cached_statements=STATEMENT_CACHE_SIZE)
+        self._description_compressors = {}
+        self._description_index = QUERY_COLUMNS[QUERY_INFO].index('description')
+        self._has_compressed_descriptions = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='package_descriptions'").fetchone() is not None
+
+    def _get_description_compressor(self, codec, dictionary_id):
+        key = (codec, dictionary_id)
+        if key not in self._description_compressors:
+            dictionary = None
+            if dictionary_id is not None:
+                dictionary = bytes(self._conn.execute(SELECT_COMPRESSION_DICTIONARY_SQL, (dictionary_id,)).fetchone()[0])
+            self._description_compressors[key] = TextCompressor(codec, dictionary)
+        return self._description_compressors[key]
+
+    def package_info(self, name):
+        """
+        Looks up the metadata of a package. A description stored compressed is decompressed
+
+        :param name: Package name
+        :type name: str
+
+        :return: Generator of at most one row, with the columns of QUERY_COLUMNS['info']
+        :rtype: generator
+        """
+        for row in self._conn.execute(QUERY_PACKAGE_INFO_SQL, (normalize_package_name(name),)):
+            package_id, row = row[0], row[1:]
+            if self._has_compressed_descriptions and row[self._description_index] is None:
+                compressed = self._conn.execute(QUERY_PACKAGE_DESCRIPTION_SQL, (package_id,)).fetchone()
+                if compressed:
+                    codec, dictionary_id, data = compressed
+                    description = self._get_description_compressor(codec, dictionary_id).decompress(data)
+                    row = row[:self._description_index] + (description,) + row[self._description_index + 1:]
+            yield row
+
+    def releases(self, name):
+        """
+        Looks up the stored release files of a package
+
+        :param name: Package name
+        :type name: str
+
+        :return: Generator of rows, with the columns of QUERY_COLUMNS['releases']
+        :rtype: generator
+        """
+        return iter(self._conn.execute(QUERY_PACKAGE_RELEASES_SQL, (normalize_package_name(name),)))
+
+    def classifiers(self, name):
+        """
+        Looks up the classifiers of a package
+
+        :param name: Package name
+        :type name: str
+
+        :return: Generator of rows, with the columns of QUERY_COLUMNS['classifiers']
+        :rtype: generator
+        """
+        return iter(self._conn.execute(QUERY_PACKAGE_CLASSIFIERS_SQL, (normalize_package_name(name),)))
+
+    def reverse_dependencies(self, name):
+        """
+        Looks up the packages whose latest release requires a package, in any of its extras or environments
+
+        :param name: Package name
+        :type name: str
+
+        :return: Generator of rows, with the columns of QUERY_COLUMNS['rdeps']
+        :rtype: generator
+        """
+        name = normalize_package_name(name)
+        pattern = u'%{}%'.format(name.replace('-', '_'))
+        for dependent, version, requires_dist in self._conn.execute(QUERY_REVERSE_DEPENDENCY_CANDIDATES_SQL,
+                                                                    (pattern,)):
+            if name in parse_requirement_names(requires_dist):
+                yield name, dependent, version
+
+    def packages_with_classifier(self, classifier):
+        """
+        Looks up the packages with a classifier, or any classifier below it
+
+        :param classifier: Classifier, e.g. 'Framework :: Django'
+        :type classifier: str
+
+        :return: Generator of rows, with the columns of QUERY_COLUMNS['classifier']
+        :rtype: generator
+        """
+        escaped = classifier.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        for row in self._conn.execute(QUERY_PACKAGES_WITH_CLASSIFIER_SQL, (classifier, escaped + u' :: %')):
+            yield (classifier,) + row
+
+    def run(self, query_type, term):
+        """
+        Runs one of the QUERY_TYPES
+
+        :param query_type: One of QUERY_TYPES
+        :type query_type: str
+        :param term: Package name, or the classifier for the classifier search
+        :type term: str
+
+        :return: Generator of rows, with the columns of QUERY_COLUMNS[query_type]
+        :rtype: generator
+        """
+        if query_type == QUERY_INFO:
+            return self.package_info(term)
+        elif query_type == QUERY_RELEASES:
+            return self.releases(term)
+        elif query_type == QUERY_CLASSIFIERS:
+            return self.classifiers(term)
+        elif query_type == QUERY_REVERSE_DEPENDENCIES:
+            return self.reverse_dependencies(term)
+        elif query_type == QUERY_CLASSIFIER_SEARCH:
+            return self.packages_with_classifier(term)
+        raise ValueError('Unknown query: {}. Must be one of {}'.format(query_type, ', '.join(QUERY_TYPES)))
+
+    def close(self):
+        """
+        Closes the connection
+        """
+        self._conn.close()
+
+
+def _format_tsv_value(value):
+    if value is None:
+        return u''
+    value = u'{}'.format(value)
+    for char, escaped in TSV_ESCAPES:
+        value = value.replace(char, escaped)
+    return value
+
+
+def write_rows(rows, columns, output_format, fp, header=True):
+    """
+    Writes rows as they are generated, one per line
+
+    :param rows: Rows to write
+    :type rows: iterable
+    :param columns: Column names of the rows
+    :type columns: list
+    :param output_format: 'jsonl' for a JSON object per row, or 'tsv' for tab separated values with tabs, newlines and
+     backslashes in the values escaped
+    :type output_format: str
+    :param fp: Text file to write to
+    :type fp: file
+    :param header: Whether to write a header line of the column names, for TSV
+    :type header: bool
+
+    :return: Number of rows written
+    :rtype: int
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError('Unknown output format: {}. Must be one of {}'.format(output_format, ', '.join(OUTPUT_FORMATS)))
+    if output_format == FORMAT_TSV and header:
+        fp.write(u'\t'.join(columns) + u'\n')
+    count = 0
+    for row in rows:
+        if output_format == FORMAT_JSONL:
+            fp.write(u'{}\n'.format(json.dumps(OrderedDict(zip(columns, row)))))
+        else:
+            fp.write(u'\t'.join(_format_tsv_value(x) for x in row) + u'\n')
+        count += 1
+    return count
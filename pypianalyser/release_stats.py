@@ -0,0 +1,230 @@
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from itertools import islice
+from pypianalyser.utils import lazy_import
+
+# numpy is an optional dependency, loaded on first use
+np = lazy_import('numpy')
+
+DEFAULT_LOAD_BATCH_SIZE = 100000
+PACKAGETYPE_OTHER = 0
+PACKAGETYPE_WHEEL = 1
+PACKAGETYPE_SDIST = 2
+PACKAGETYPE_CODES = {'bdist_wheel': PACKAGETYPE_WHEEL, 'sdist': PACKAGETYPE_SDIST}
+SECONDS_PER_DAY = 86400.0
+RELEASE_COLUMNS = ['package_id', 'version', 'upload_time_iso_8601', 'size', 'packagetype']
+
+# Columns of the package_releases table loaded into arrays, one element per release file. Versions are converted to
+# integer codes so that releases can be grouped without comparing strings
+ReleaseArrays = namedtuple('ReleaseArrays', ['package_ids', 'version_codes', 'upload_times', 'sizes',
+                                             'packagetypes'])
+
+STAT_NAMES = ['file_count', 'release_count', 'total_size', 'wheel_count', 'sdist_count', 'wheel_ratio',
+              'first_upload', 'last_upload', 'days_since_last_upload', 'mean_days_between_releases']
+
+
+def load_release_arrays(db_helper, batch_size=DEFAULT_LOAD_BATCH_SIZE):
+    """
+    Loads the columns of the package_releases table that are needed for the statistics into NumPy arrays. Rows are
+    streamed from the database and converted a batch at a time
+
+    :param db_helper: Database to load from
+    :type db_helper: PyPiAnalyserSqliteHelper
+    :param batch_size: Number of rows to convert at a time
+    :type batch_size: int
+
+    :return: Release arrays
+    :rtype: ReleaseArrays
+    """
+    if np is None:
+        raise Exception('The numpy package is required to calculate release statistics')
+
+    rows = db_helper.iter_table('package_releases', batch_size, row_type='tuple', columns=RELEASE_COLUMNS)
+    version_codes = {}
+    batches = []
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        package_ids, versions, upload_times, sizes, packagetypes = zip(*batch)
+        batches.append(ReleaseArrays(
+            np.array(package_ids, dtype=np.int64),
+            np.array([version_codes.setdefault((package_id, version), len(version_codes))
+                      for package_id, version in zip(package_ids, versions)], dtype=np.int64),
+            # numpy doesn't accept the trailing Z (UTC) timezone designator
+            np.array([x.rstrip('Z') if x else 'NaT' for x in upload_times], dtype='datetime64[us]'),
+            np.array([x or 0 for x in sizes], dtype=np.int64),
+            np.array([PACKAGETYPE_CODES.get(x, PACKAGETYPE_OTHER) for x in packagetypes], dtype=np.int8)))
+
+    if not batches:
+        return ReleaseArrays(np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                             np.array([], dtype='datetime64[us]'), np.array([], dtype=np.int64),
+                             np.array([], dtype=np.int8))
+    return ReleaseArrays(*[np.concatenate(x) for x in zip(*batches)])
+
+
+def _group_starts(sorted_keys):
+    """
+    Returns the index of the first element of each run of equal keys in a sorted array
+
+    :param sorted_keys: Sorted array
+    :type sorted_keys: numpy.ndarray
+
+    :return: Start index of each group
+    :rtype: numpy.ndarray
+    """
+    if not len(sorted_keys):
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+
+
+def calculate_release_stats(arrays, now=None):
+    """
+    Calculates per-package release statistics using vectorised group-by operations. All of the returned arrays are
+    aligned with the 'package_id' array, which is sorted
+
+    - file_count: number of release files
+    - release_count: number of distinct versions
+    - total_size: total size of the release files in bytes
+    - wheel_count / sdist_count: number of wheel and source distribution files
+    - wheel_ratio: wheels / (wheels + sdists), NaN if the package has neither
+    - first_upload / last_upload: earliest and latest file upload time
+    - days_since_last_upload: days between the last upload and now
+    - mean_days_between_releases: mean interval between the first upload of each version, NaN with a single release
+
+    :param arrays: Release arrays from load_release_arrays()
+    :type arrays: ReleaseArrays
+    :param now: Time to calculate days_since_last_upload from. Defaults to the current UTC time
+    :type now: datetime or None
+
+    :return: Statistic names mapped to arrays, plus 'package_id'
+    :rtype: OrderedDict
+    """
+    now = np.datetime64(now or datetime.utcnow(), 'us')
+    # Sort by package, then version, so that both can be grouped with reduceat
+    order = np.lexsort((arrays.version_codes, arrays.package_ids))
+    package_ids = arrays.package_ids[order]
+    version_codes = arrays.version_codes[order]
+    upload_times = arrays.upload_times[order]
+    sizes = arrays.sizes[order]
+    packagetypes = arrays.packagetypes[order]
+
+    package_starts = _group_starts(package_ids)
+    stats = OrderedDict()
+    stats['package_id'] = package_ids[package_starts]
+    if not len(package_starts):
+        for name in STAT_NAMES:
+            stats[name] = np.array([])
+        return stats
+
+    stats['file_count'] = np.diff(np.append(package_starts, len(package_ids)))
+    stats['total_size'] = np.add.reduceat(sizes, package_starts)
+    stats['wheel_count'] = np.add.reduceat((packagetypes == PACKAGETYPE_WHEEL).astype(np.int64), package_starts)
+    stats['sdist_count'] = np.add.reduceat((packagetypes == PACKAGETYPE_SDIST).astype(np.int64), package_starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['wheel_ratio'] = stats['wheel_count'] / (stats['wheel_count'] + stats['sdist_count']).astype(np.float64)
+
+    # NaT sorts as the smallest value in maximum() and minimum(), so treat missing times as the opposite extreme
+    upload_seconds = upload_times.astype('datetime64[s]').astype(np.int64)
+    missing = np.isnat(upload_times)
+    int64_info = np.iinfo(np.int64)
+    first_upload = np.minimum.reduceat(np.where(missing, int64_info.max, upload_seconds), package_starts)
+    last_upload = np.maximum.reduceat(np.where(missing, int64_info.min, upload_seconds), package_starts)
+    stats['first_upload'] = _seconds_to_datetimes(first_upload, int64_info.max)
+    stats['last_upload'] = _seconds_to_datetimes(last_upload, int64_info.min)
+    stats['days_since_last_upload'] = (now - stats['last_upload']) / np.timedelta64(1, 'D')
+
+    # A release is uploaded when its first file is. Version codes are unique per package so group on them alone
+    release_starts = _group_starts(version_codes)
+    release_package_ids = package_ids[release_starts]
+    release_times = np.minimum.reduceat(np.where(missing, int64_info.max, upload_seconds), release_starts)
+    release_package_starts = _group_starts(release_package_ids)
+    stats['release_count'] = np.diff(np.append(release_package_starts, len(release_package_ids)))
+    has_time = release_times != int64_info.max
+    first_release = np.minimum.reduceat(release_times, release_package_starts)
+    last_release = np.maximum.reduceat(np.where(has_time, release_times, int64_info.min), release_package_starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        intervals = (last_release - first_release) / SECONDS_PER_DAY / (stats['release_count'] - 1)
+    has_interval = (stats['release_count'] > 1) & (first_release != int64_info.max)
+    stats['mean_days_between_releases'] = np.where(has_interval, intervals, np.nan)
+
+    return OrderedDict((name, stats[name]) for name in ['package_id'] + STAT_NAMES)
+
+
+def _seconds_to_datetimes(seconds, missing_value):
+    times = seconds.astype('datetime64[s]')
+    times[seconds == missing_value] = np.datetime64('NaT')
+    return times
+
+
+def get_release_stats(db_helper, now=None, batch_size=DEFAULT_LOAD_BATCH_SIZE):
+    """
+    Loads the releases from the database and calculates the per-package statistics, adding the package names under
+    'name'
+
+    :param db_helper: Database to load from
+    :type db_helper: PyPiAnalyserSqliteHelper
+    :param now: Time to calculate days_since_last_upload from. Defaults to the current UTC time
+    :type now: datetime or None
+    :param batch_size: Number of rows to convert at a time
+    :type batch_size: int
+
+    :return: Statistic names mapped to arrays, see calculate_release_stats()
+    :rtype: OrderedDict
+    """
+    stats = calculate_release_stats(load_release_arrays(db_helper, batch_size), now)
+    names = dict(db_helper.iter_table('packages', batch_size, row_type='tuple', columns=['id', 'name']))
+    named_stats = OrderedDict(name=np.array([names.get(x) for x in stats['package_id']], dtype=object))
+    named_stats.update(stats)
+    return named_stats
+
+
+def summarise_release_stats(stats):
+    """
+    Summarises per-package statistics across the whole ecosystem
+
+    :param stats: Per-package statistics from calculate_release_stats()
+    :type stats: OrderedDict
+
+    :return: Summary names mapped to values
+    :rtype: OrderedDict
+    """
+    summary = OrderedDict()
+    summary['packages'] = len(stats['package_id'])
+    summary['release_files'] = int(np.sum(stats['file_count']))
+    summary['releases'] = int(np.sum(stats['release_count']))
+    summary['total_size_gb'] = float(np.sum(stats['total_size'])) / 1024 ** 3
+    wheel_files = int(np.sum(stats['wheel_count']))
+    sdist_files = int(np.sum(stats['sdist_count']))
+    summary['wheel_ratio'] = wheel_files / float(wheel_files + sdist_files) if wheel_files + sdist_files else np.nan
+    summary['packages_with_wheels'] = int(np.count_nonzero(stats['wheel_count']))
+    if summary['packages']:
+        summary['median_days_since_last_upload'] = float(np.nanmedian(stats['days_since_last_upload']))
+        cadence = stats['mean_days_between_releases']
+        summary['median_days_between_releases'] = \
+            float(np.nanmedian(cadence)) if np.count_nonzero(~np.isnan(cadence)) else np.nan
+    return summary
+
+
+def top_packages(stats, stat_name, count):
+    """
+    Returns the indices of the packages with the largest values of a statistic. Packages without a value (NaN or NaT)
+    are ranked last
+
+    :param stats: Per-package statistics from calculate_release_stats()
+    :type stats: OrderedDict
+    :param stat_name: Name of the statistic to rank by
+    :type stat_name: str
+    :param count: Number of packages to return
+    :type count: int
+
+    :return: Indices into the statistic arrays, largest value first
+    :rtype: numpy.ndarray
+    """
+    values = stats[stat_name]
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = np.where(np.isnat(values), np.iinfo(np.int64).min, values.astype(np.int64))
+    else:
+        values = np.where(np.isnan(values.astype(np.float64)), -np.inf, values)
+    # Stable sort of the negated values keeps ties in package order
+    return np.argsort(-values.astype(np.float64), kind='stable')[:count]
@@ -0,0 +1,162 @@
+from collections import Counter
+from datetime import datetime
+from io import open
+import logging
+from pypianalyser.sqlite_helper import ROW_TYPE_TUPLE
+from pypianalyser.utils import normalize_package_name, parse_requirement_names
+
+logger = logging.getLogger(__file__)
+
+SCHEDULE_ALPHABETICAL = 'alphabetical'
+SCHEDULE_STALENESS = 'staleness'
+SCHEDULE_DOWNLOADS = 'downloads'
+SCHEDULE_FAN_IN = 'fanin'
+SCHEDULES = [SCHEDULE_ALPHABETICAL, SCHEDULE_STALENESS, SCHEDULE_DOWNLOADS, SCHEDULE_FAN_IN]
+
+
+class Scheduler(object):
+    """
+    Orders the packages of a run by a priority score, highest first, so that a run cut short by max_packages spends its
+    budget on the packages that matter most. Packages with the same score are ordered by name. Subclasses implement
+    score()
+    """
+    def score(self, package_names, db_helper):
+        """
+        Scores the packages
+
+        :param package_names: Names of the packages to schedule
+        :type package_names: set
+        :param db_helper: Open database of the run
+        :type db_helper: pypianalyser.pypi_sqlite_helper.PyPiAnalyserSqliteHelper
+
+        :return: Package names mapped to their priority. Packages that aren't in it score 0
+        :rtype: dict
+        """
+        raise NotImplementedError()
+
+    def order(self, package_names, db_helper):
+        """
+        Orders packages by priority
+
+        :param package_names: Names of the packages to schedule
+        :type package_names: set
+        :param db_helper: Open database of the run
+        :type db_helper: pypianalyser.pypi_sqlite_helper.PyPiAnalyserSqliteHelper
+
+        :return: Package names, highest priority first
+        :rtype: list
+        """
+        scores = self.score(package_names, db_helper)
+        # Two stable sorts: by name, then by score
+        ret_val = sorted(package_names)
+        ret_val.sort(key=lambda x: scores.get(x, 0), reverse=True)
+        return ret_val
+
+
+class AlphabeticalScheduler(Scheduler):
+    """
+    Orders packages by name
+    """
+    def score(self, package_names, db_helper):
+        return {}
+
+
+class StalenessScheduler(Scheduler):
+    """
+    Orders packages by how long it has been since they were last fetched by a refresh, oldest first. Packages that are
+    new to the database, or have never been refreshed, come before all of the others
+    """
+    def __init__(self, now=None):
+        """
+        Constructor for StalenessScheduler
+
+        :param now: Current UTC time, or None to use the time of scheduling
+        :type now: datetime or None
+        """
+        self.now = now
+
+    def score(self, package_names, db_helper):
+        now = self.now or datetime.utcnow()
+        never_fetched = float('inf')
+        scores = dict.fromkeys(package_names, never_fetched)
+        for name, last_fetched in db_helper.iter_package_fetch_times():
+            if name in scores and last_fetched:
+                fetched_time = datetime.strptime(last_fetched[:19], '%Y-%m-%dT%H:%M:%S')
+                scores[name] = (now - fetched_time).total_seconds()
+        return scores
+
+
+class DownloadsScheduler(Scheduler):
+    """
+    Orders packages by their download counts, most downloaded first, read from a local file of '<package> <count>'
+    lines (separated by whitespace or a comma), such as an export of the public PyPi downloads dataset. Packages that
+    aren't in the file come last
+    """
+    def __init__(self, downloads_file):
+        """
+        Constructor for DownloadsScheduler
+
+        :param downloads_file: Path to the download counts file
+        :type downloads_file: str
+        """
+        self.downloads_file = downloads_file
+
+    def score(self, package_names, db_helper):
+        scores = {}
+        with open(self.downloads_file, 'r', encoding='utf-8') as fp:
+            for line_number, line in enumerate(fp, 1):
+                parts = line.replace(',', ' ').split()
+                if not parts or line.startswith('#'):
+                    continue
+                try:
+                    count = float(parts[1])
+                except (IndexError, ValueError):
+                    # Allow a header line
+                    if line_number == 1:
+                        continue
+                    raise ValueError('Invalid line {} of {}: {}'.format(line_number, self.downloads_file, line.strip()))
+                name = normalize_package_name(parts[0])
+                if name in package_names:
+                    scores[name] = scores.get(name, 0) + count
+        logger.info('Read the download counts of {} packages from {}'.format(len(scores), self.downloads_file))
+        return scores
+
+
+class FanInScheduler(Scheduler):
+    """
+    Orders packages by dependency fan-in, the number of packages in the database that require them, most depended on
+    first. Fan-in is calculated from the requires_dist field of the packages already downloaded, so it is only as
+    complete as the database
+    """
+    def score(self, package_names, db_helper):
+        scores = Counter()
+        for _, requires_dist in db_helper.iter_table('packages', row_type=ROW_TYPE_TUPLE,
+                                                     columns=['name', 'requires_dist']):
+            scores.update(x for x in parse_requirement_names(requires_dist) if x in package_names)
+        return scores
+
+
+def create_scheduler(schedule, downloads_file=None):
+    """
+    Creates a scheduler
+
+    :param schedule: One of SCHEDULES: 'alphabetical', 'staleness' (least recently refreshed first), 'downloads' (most
+     downloaded first, from downloads_file) or 'fanin' (most depended on first)
+    :type schedule: str
+    :param downloads_file: Path to the download counts file, required by the downloads schedule
+    :type downloads_file: str or None
+
+    :return: Scheduler
+    :rtype: Scheduler
+    """
+    if schedule == SCHEDULE_ALPHABETICAL:
+        return AlphabeticalScheduler()
+    elif schedule == SCHEDULE_STALENESS:
+        return StalenessScheduler()
+    elif schedule == SCHEDULE_DOWNLOADS:
+        if not downloads_file:
+            raise ValueError('The downloads schedule requires a download counts file')
+        return DownloadsScheduler(downloads_file)
+    elif schedule == SCHEDULE_FAN_IN:
+        return FanInScheduler()
+    raise ValueError('Unknown schedule: {}. Must be one of {}'.format(schedule, ', '.join(SCHEDULES)))
@@ -0,0 +1,258 @@
+from collections import OrderedDict
+import json
+import logging
+import re
+import threading
+import time
+import six.moves.urllib as urllib
+from pypianalyser.exceptions import Exception404, UpstreamError
+from pypianalyser.metrics import Metrics
+from pypianalyser.pypi_index_helpers import get_metadata_for_package, DEFAULT_INDEX_URL, METADATA_URL_PATH, \
+    HTTP_SUCCESS, HTTP_NOT_FOUND, join_index_url
+from pypianalyser.pypi_metadata_retriever import prepare_metadata
+from pypianalyser.options import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_CACHE_SIZE
+from pypianalyser.utils import normalize_package_name
+
+logger = logging.getLogger(__file__)
+
+METADATA_PATH_REGEX = re.compile(r'^/pypi/([^/]+)/json/?$')
+METRICS_PATH = '/metrics'
+HTTP_INTERNAL_ERROR = 500
+HTTP_BAD_GATEWAY = 502
+NOT_FOUND_BODY = b'{"message": "Not Found"}'
+
+# Where a response came from, reported in the X-Cache header and the metrics
+SOURCE_CACHE = 'cache'
+SOURCE_DATABASE = 'database'
+SOURCE_UPSTREAM = 'upstream'
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used cache with a maximum number of items
+    """
+    def __init__(self, max_size):
+        """
+        Constructor for LRUCache
+
+        :param max_size: Maximum number of items. The least recently used item is evicted to make room for a new one
+         once it's reached. 0 disables the cache
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """
+        Gets an item, marking it as the most recently used
+
+        :param key: Key of the item
+        :type key: str
+
+        :return: The item, or None if it isn't cached
+        :rtype: object or None
+        """
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        """
+        Caches an item, evicting the least recently used item if the cache is full
+
+        :param key: Key of the item
+        :type key: str
+        :param value: Item to cache
+        :type value: object
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class MetadataService(object):
+    """
+    Serves /pypi/<package>/json compatible responses, rebuilt from the database. Responses are looked up in an in-process
+    LRU cache of the most recently requested packages first, then the database. A package that isn't in the database is
+    downloaded from the upstream index, stored with the same truncation as an ingest, and served from the database
+    """
+    def __init__(self, db_helper, cache_size=DEFAULT_CACHE_SIZE, index_url=DEFAULT_INDEX_URL, fetch_missing=True,
+                 trunc_description=-1, trunc_releases=-1, metrics=None):
+        """
+        Constructor for MetadataService
+
+        :param db_helper: Open database to serve from
+        :type db_helper: pypianalyser.pypi_sqlite_helper.PyPiAnalyserSqliteHelper
+        :param cache_size: Maximum number of responses to keep in memory
+        :type cache_size: int
+        :param index_url: Base URL of the PyPi index or mirror to download missing packages from
+        :type index_url: str
+        :param fetch_missing: Download packages that aren't in the database. Otherwise they are reported as not found
+        :type fetch_missing: bool
+        :param trunc_description: Number of characters to truncate the description of downloaded packages to, -1 for no
+         truncation
+        :type trunc_description: int
+        :param trunc_releases: Number of releases to store for downloaded packages, -1 for all
+        :type trunc_releases: int
+        :param metrics: Metrics to record the requests in, or None to create them
+        :type metrics: pypianalyser.metrics.Metrics or None
+        """
+        self.db_helper = db_helper
+        self.cache = LRUCache(cache_size)
+        self.fetch_missing = fetch_missing
+        self.metrics = metrics or Metrics()
+        self._metadata_url_format = join_index_url(index_url, METADATA_URL_PATH)
+        # Applied to downloaded packages, as in an ingest
+        self.trunc_description = trunc_description
+        self.trunc_releases = trunc_releases
+        self._fetch_locks = {}
+        self._fetch_locks_lock = threading.Lock()
+
+    def get_response(self, package_name):
+        """
+        Gets the JSON response of a package
+
+        :param package_name: Name of the package
+        :type package_name: str
+
+        :return: The encoded JSON response and where it came from ('cache', 'database' or 'upstream'), or None and the
+         source that was last tried if the package doesn't exist
+        :rtype: tuple
+        """
+        name = normalize_package_name(package_name)
+        response = self.cache.get(name)
+        if response is not None:
+            return response, SOURCE_CACHE
+
+        source = SOURCE_DATABASE
+        metadata = self.db_helper.get_package_metadata(name)
+        if metadata is None and self.fetch_missing:
+            source = SOURCE_UPSTREAM
+            metadata = self._fetch_package(name)
+        if metadata is None:
+            return None, source
+
+        response = json.dumps(metadata).encode('utf-8')
+        self.cache.put(name, response)
+        return response, source
+
+    def _fetch_package(self, name):
+        """
+        Downloads a package that isn't in the database and stores it. Concurrent requests for the same package wait for
+        a single download
+
+        :param name: Normalized package name
+        :type name: str
+
+        :return: Metadata rebuilt from the database once stored, or None if the upstream index doesn't have the package
+        :rtype: dict or None
+        """
+        with self._fetch_locks_lock:
+            lock = self._fetch_locks.setdefault(name, threading.Lock())
+        try:
+            with lock:
+                # Stored by another request while this one was waiting
+                metadata = self.db_helper.get_package_metadata(name)
+                if metadata is not None:
+                    return metadata
+                try:
+                    upstream_metadata = get_metadata_for_package(name, self._metadata_url_format, self.metrics)
+                except Exception404:
+                    return None
+                except Exception as e:
+                    raise UpstreamError('Failed to download {}: {}'.format(name, e))
+                prepare_metadata(upstream_metadata, self.trunc_description, self.trunc_releases)
+                self.db_helper.commit_package_to_db(upstream_metadata)
+                self.metrics.increment('packages_stored')
+                return self.db_helper.get_package_metadata(name)
+        finally:
+            with self._fetch_locks_lock:
+                self._fetch_locks.pop(name, None)
+
+    def handle_request(self, path):
+        """
+        Handles a GET request
+
+        :param path: Request path, e.g. /pypi/requests/json
+        :type path: str
+
+        :return: HTTP status, content type, body and extra headers
+        :rtype: tuple
+        """
+        start = time.time()
+        path = urllib.parse.urlparse(path).path
+        if path == METRICS_PATH:
+            self.metrics.set_gauge('cached_responses', len(self.cache))
+            return HTTP_SUCCESS, 'text/plain; version=0.0.4', self.metrics.to_prometheus().encode('utf-8'), {}
+
+        match = METADATA_PATH_REGEX.match(path)
+        if not match:
+            self.metrics.increment('requests', labels={'status': HTTP_NOT_FOUND})
+            return HTTP_NOT_FOUND, 'application/json', NOT_FOUND_BODY, {}
+
+        source = None
+        try:
+            body, source = self.get_response(urllib.parse.unquote(match.group(1)))
+            status = HTTP_SUCCESS if body is not None else HTTP_NOT_FOUND
+        except Exception as e:
+            logger.error('Failed to serve {}: {}'.format(path, e))
+            self.metrics.increment('errors', labels={'type': type(e).__name__})
+            body = json.dumps({'message': str(e)}).encode('utf-8')
+            status = HTTP_BAD_GATEWAY if isinstance(e, UpstreamError) else HTTP_INTERNAL_ERROR
+        if status == HTTP_NOT_FOUND:
+            body = NOT_FOUND_BODY
+        labels = {'status': status, 'source': source} if source else {'status': status}
+        self.metrics.increment('requests', labels=labels)
+        self.metrics.observe('request_seconds', time.time() - start)
+        headers = {'X-Cache': 'HIT' if source == SOURCE_CACHE else 'MISS'}
+        return status, 'application/json', body, headers
+
+
+def create_http_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Creates a threaded HTTP server for a metadata service, with a thread per connection
+
+    :param service: Service to handle the requests
+    :type service: MetadataService
+    :param host: Address to listen on
+    :type host: str
+    :param port: Port to listen on, 0 to pick a free port
+    :type port: int
+
+    :return: HTTP server. Call serve_forever() to start handling requests and shutdown() from another thread to stop
+    :rtype: six.moves.BaseHTTPServer.HTTPServer
+    """
+    # The HTTP server modules are slow to import, so they are only imported by the serve command
+    from six.moves import BaseHTTPServer, socketserver
+
+    class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        # Keep-alive, so that clients making many lookups don't pay for a new connection each time
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            status, content_type, body, headers = service.handle_request(self.path)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    return ThreadingHTTPServer((host, port), RequestHandler)
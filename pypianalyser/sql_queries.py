@@ -72,6 +72,14 @@ PACKAGE_RELEASES_TABLE_COLUMNS = \
     ["id", "package_id", "version", "has_sig", "upload_time", "comment_text", "python_version",
      "url", "md5_digest", "requires_python", "filename", "packagetype", "upload_time_iso_8601", "size"]
 
+# Columns of each of the core tables, in table order
+TABLE_COLUMNS = {
+    'packages': PACKAGE_TABLE_COLUMNS,
+    'classifier_strings': CLASSIFIER_STRING_TABLE_COLUMNS,
+    'package_classifiers': PACKAGE_CLASSIFIERS_TABLE_COLUMNS,
+    'package_releases': PACKAGE_RELEASES_TABLE_COLUMNS,
+}
+
 CREATE_TABLE_SQL_QUERIES = [CREATE_PACKAGE_TABLE_SQL,
                             CREATE_CLASSIFIER_STRING_TABLE_SQL,
                             CREATE_PACKAGE_CLASSIFIERS_TABLE_SQL,
@@ -148,6 +156,16 @@ SELECT_RELEASE_FILES_FOR_PACKAGE_SQL = \
     WHERE packages.name = ?
     """
 
+SELECT_PACKAGE_NAMES_SQL = "SELECT name FROM packages"
+
+SELECT_ALL_PACKAGES_SQL = "SELECT * FROM packages"
+
+SELECT_ALL_RELEASE_FILES_SQL = "SELECT * FROM package_releases"
+
+SELECT_COLUMNS_SQL = "SELECT {columns} FROM {table}"
+
+SELECT_ID_FOR_PACKAGE_NAME_SQL = "SELECT id FROM packages WHERE name=?"
+
 SELECT_PACKAGE_BY_NAME_SQL = \
     """
     SELECT * FROM packages
@@ -164,4 +182,624 @@ SELECT_PACKAGES_WITH_PY3_CLASSIFIER = \
         ON classifier_strings.id = package_classifiers.classifier_id
     WHERE
         classifier_strings.name LIKE "Programming Language :: Python :: 3%"
-    """
\ No newline at end of file
+    """
+CREATE_PACKAGE_SEARCH_TABLE_SQL = \
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5(
+    name,
+    summary,
+    keywords,
+    description,
+    tokenize = 'porter unicode61');
+    """
+
+DELETE_PACKAGE_SEARCH_ENTRY_SQL = "DELETE FROM packages_fts WHERE rowid=?"
+
+# The search index rowid is the ID of the package in the packages table. The description is passed in because it may
+# be stored compressed in package_descriptions rather than in the packages table
+INSERT_PACKAGE_SEARCH_ENTRY_SQL = \
+    """
+    INSERT INTO packages_fts(rowid, name, summary, keywords, description)
+    SELECT id, name, summary, keywords, ? FROM packages
+    WHERE id=?
+    """
+
+# For a package that INSERT OR IGNORE may have skipped. A package that was already stored already has an entry, so
+# one is only added for a package that was actually inserted
+INSERT_NEW_PACKAGE_SEARCH_ENTRY_SQL = \
+    """
+    INSERT INTO packages_fts(rowid, name, summary, keywords, description)
+    SELECT id, name, summary, keywords, ? FROM packages
+    WHERE id=? AND NOT EXISTS (SELECT 1 FROM packages_fts WHERE rowid=?)
+    """
+
+REBUILD_PACKAGE_SEARCH_INDEX_SQL = \
+    """
+    INSERT INTO packages_fts(rowid, name, summary, keywords, description)
+    SELECT id, name, summary, keywords, description FROM packages
+    """
+
+# bm25() returns lower values for better matches. Matches in the name are weighted highest, then summary and keywords,
+# then the description
+SEARCH_PACKAGES_SQL = \
+    """
+    SELECT packages.name, packages.version, packages.summary, bm25(packages_fts, 10.0, 5.0, 5.0, 1.0) AS score
+    FROM packages_fts
+    INNER JOIN packages ON packages.id = packages_fts.rowid
+    WHERE packages_fts MATCH ?
+    ORDER BY score
+    LIMIT ?
+    """
+SEARCH_RESULT_COLUMNS = ["name", "version", "summary", "score"]
+
+# Rollup tables hold precomputed aggregates for analytics queries. Triggers on the source tables record which keys of
+# each rollup have been affected by an insert, update or delete in rollup_dirty_keys, so that only those keys need to
+# be recounted when the rollups are next updated. NULL values are counted under an empty string key
+ROLLUP_CLASSIFIERS = 'classifiers'
+ROLLUP_REQUIRES_PYTHON = 'requires_python'
+ROLLUP_LICENSES = 'licenses'
+ROLLUP_MONTHLY_UPLOADS = 'monthly_uploads'
+# Marker row in rollup_dirty_keys that requests a full rebuild of every rollup
+ROLLUP_FULL_REBUILD_MARKER = '*'
+
+CREATE_ROLLUP_DIRTY_KEYS_TABLE_SQL = \
+    """
+    CREATE TABLE IF NOT EXISTS rollup_dirty_keys (
+    rollup text NOT NULL,
+    key NOT NULL,
+    PRIMARY KEY (rollup, key));
+    """
+
+CREATE_ROLLUP_TABLE_SQL_QUERIES = [
+    """
+    CREATE TABLE IF NOT EXISTS rollup_classifier_counts (
+    classifier_id integer PRIMARY KEY,
+    package_count integer NOT NULL,
+    FOREIGN KEY(classifier_id) REFERENCES classifier_strings(id));
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_requires_python_counts (
+    requires_python text PRIMARY KEY,
+    package_count integer NOT NULL);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_license_counts (
+    license text PRIMARY KEY,
+    package_count integer NOT NULL);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS rollup_monthly_upload_counts (
+    month text PRIMARY KEY,
+    upload_count integer NOT NULL);
+    """,
+    # Indexes so that recounting a handful of dirty keys doesn't need a full table scan
+    "CREATE INDEX IF NOT EXISTS package_classifiers_classifier_idx ON package_classifiers(classifier_id, package_id)",
+    "CREATE INDEX IF NOT EXISTS packages_requires_python_idx ON packages(IFNULL(requires_python, ''))",
+    "CREATE INDEX IF NOT EXISTS packages_license_idx ON packages(IFNULL(license, ''))",
+    "CREATE INDEX IF NOT EXISTS package_releases_month_idx ON package_releases(IFNULL(substr(upload_time, 1, 7), ''))",
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_packages_insert AFTER INSERT ON packages BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES
+            ('requires_python', IFNULL(NEW.requires_python, '')),
+            ('licenses', IFNULL(NEW.license, ''));
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_packages_update AFTER UPDATE OF requires_python, license ON packages BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES
+            ('requires_python', IFNULL(OLD.requires_python, '')),
+            ('requires_python', IFNULL(NEW.requires_python, '')),
+            ('licenses', IFNULL(OLD.license, '')),
+            ('licenses', IFNULL(NEW.license, ''));
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_packages_delete AFTER DELETE ON packages BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES
+            ('requires_python', IFNULL(OLD.requires_python, '')),
+            ('licenses', IFNULL(OLD.license, ''));
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_package_classifiers_insert AFTER INSERT ON package_classifiers BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES ('classifiers', NEW.classifier_id);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_package_classifiers_delete AFTER DELETE ON package_classifiers BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES ('classifiers', OLD.classifier_id);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_package_releases_insert AFTER INSERT ON package_releases BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES
+            ('monthly_uploads', IFNULL(substr(NEW.upload_time, 1, 7), ''));
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_package_releases_update AFTER UPDATE OF upload_time ON package_releases BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES
+            ('monthly_uploads', IFNULL(substr(OLD.upload_time, 1, 7), '')),
+            ('monthly_uploads', IFNULL(substr(NEW.upload_time, 1, 7), ''));
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rollup_package_releases_delete AFTER DELETE ON package_releases BEGIN
+        INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES
+            ('monthly_uploads', IFNULL(substr(OLD.upload_time, 1, 7), ''));
+    END;
+    """]
+
+INSERT_ROLLUP_FULL_REBUILD_MARKER_SQL = \
+    "INSERT OR IGNORE INTO rollup_dirty_keys(rollup, key) VALUES ('*', '*')"
+
+SELECT_ROLLUP_FULL_REBUILD_MARKER_SQL = "SELECT rollup FROM rollup_dirty_keys WHERE rollup='*'"
+
+# For each rollup: the rollup table, its key column, the matching expression in the source table and the statement that
+# recounts the keys. On an incremental update the recount is restricted to the dirty keys using ROLLUP_DIRTY_KEYS_WHERE
+ROLLUP_UPDATE_SQL = {
+    ROLLUP_CLASSIFIERS: (
+        'rollup_classifier_counts', 'classifier_id', 'classifier_id',
+        """
+        INSERT INTO rollup_classifier_counts(classifier_id, package_count)
+        SELECT classifier_id, COUNT(DISTINCT package_id) FROM package_classifiers
+        {where}
+        GROUP BY classifier_id
+        """),
+    ROLLUP_REQUIRES_PYTHON: (
+        'rollup_requires_python_counts', 'requires_python', "IFNULL(requires_python, '')",
+        """
+        INSERT INTO rollup_requires_python_counts(requires_python, package_count)
+        SELECT IFNULL(requires_python, ''), COUNT(*) FROM packages
+        {where}
+        GROUP BY IFNULL(requires_python, '')
+        """),
+    ROLLUP_LICENSES: (
+        'rollup_license_counts', 'license', "IFNULL(license, '')",
+        """
+        INSERT INTO rollup_license_counts(license, package_count)
+        SELECT IFNULL(license, ''), COUNT(*) FROM packages
+        {where}
+        GROUP BY IFNULL(license, '')
+        """),
+    ROLLUP_MONTHLY_UPLOADS: (
+        'rollup_monthly_upload_counts', 'month', "IFNULL(substr(upload_time, 1, 7), '')",
+        """
+        INSERT INTO rollup_monthly_upload_counts(month, upload_count)
+        SELECT IFNULL(substr(upload_time, 1, 7), ''), COUNT(*) FROM package_releases
+        {where}
+        GROUP BY IFNULL(substr(upload_time, 1, 7), '')
+        """),
+}
+ROLLUP_DIRTY_KEYS_WHERE = "WHERE {column} IN (SELECT key FROM rollup_dirty_keys WHERE rollup='{rollup}')"
+
+DELETE_ROLLUP_SQL = "DELETE FROM {table} {where}"
+
+DELETE_ROLLUP_DIRTY_KEYS_SQL = "DELETE FROM rollup_dirty_keys WHERE rollup=?"
+
+DELETE_ALL_ROLLUP_DIRTY_KEYS_SQL = "DELETE FROM rollup_dirty_keys"
+
+SELECT_CLASSIFIER_COUNTS_SQL = \
+    """
+    SELECT classifier_strings.name, rollup_classifier_counts.package_count FROM rollup_classifier_counts
+    INNER JOIN classifier_strings ON classifier_strings.id = rollup_classifier_counts.classifier_id
+    ORDER BY rollup_classifier_counts.package_count DESC
+    """
+
+SELECT_REQUIRES_PYTHON_COUNTS_SQL = \
+    "SELECT requires_python, package_count FROM rollup_requires_python_counts ORDER BY package_count DESC"
+
+SELECT_LICENSE_COUNTS_SQL = "SELECT license, package_count FROM rollup_license_counts ORDER BY package_count DESC"
+
+SELECT_MONTHLY_UPLOAD_COUNTS_SQL = "SELECT month, upload_count FROM rollup_monthly_upload_counts ORDER BY month"
+
+CREATE_COMPRESSION_DICTIONARIES_TABLE_SQL = \
+    """
+    CREATE TABLE IF NOT EXISTS compression_dictionaries (
+    id integer PRIMARY KEY,
+    codec text NOT NULL,
+    data BLOB NOT NULL);
+    """
+
+# Descriptions are moved out of the packages table when compression is enabled, so that scanning packages doesn't have
+# to page through large blocks of text
+CREATE_PACKAGE_DESCRIPTIONS_TABLE_SQL = \
+    """
+    CREATE TABLE IF NOT EXISTS package_descriptions (
+    package_id integer PRIMARY KEY,
+    codec text NOT NULL,
+    dictionary_id integer,
+    data BLOB NOT NULL,
+    FOREIGN KEY(package_id) REFERENCES packages(id),
+    FOREIGN KEY(dictionary_id) REFERENCES compression_dictionaries(id));
+    """
+
+INSERT_PACKAGE_DESCRIPTION_SQL = \
+    "INSERT OR IGNORE INTO package_descriptions(package_id, codec, dictionary_id, data) VALUES (?, ?, ?, ?)"
+
+UPDATE_PACKAGE_DESCRIPTION_SQL = "UPDATE package_descriptions SET codec=?, dictionary_id=?, data=? WHERE package_id=?"
+
+SELECT_DESCRIPTION_FOR_PACKAGE_NAME_SQL = \
+    """
+    SELECT packages.description, package_descriptions.codec, package_descriptions.dictionary_id,
+    package_descriptions.data FROM packages
+    LEFT JOIN package_descriptions ON packages.id = package_descriptions.package_id
+    WHERE packages.name=?
+    """
+
+SELECT_ALL_DESCRIPTIONS_SQL = \
+    """
+    SELECT packages.id, packages.description, package_descriptions.codec, package_descriptions.dictionary_id,
+    package_descriptions.data FROM packages
+    LEFT JOIN package_descriptions ON packages.id = package_descriptions.package_id
+    """
+
+SELECT_ALL_PACKAGES_WITH_DESCRIPTIONS_SQL = \
+    """
+    SELECT packages.*, package_descriptions.codec, package_descriptions.dictionary_id, package_descriptions.data
+    FROM packages
+    LEFT JOIN package_descriptions ON packages.id = package_descriptions.package_id
+    """
+
+SELECT_INLINE_DESCRIPTIONS_SQL = "SELECT id, description FROM packages WHERE description IS NOT NULL"
+
+CLEAR_INLINE_DESCRIPTION_SQL = "UPDATE packages SET description=NULL WHERE id=?"
+
+SELECT_COMPRESSED_DESCRIPTION_SAMPLE_SQL = \
+    "SELECT package_id, codec, dictionary_id, data FROM package_descriptions ORDER BY random() LIMIT ?"
+
+SELECT_DESCRIPTIONS_TO_RECOMPRESS_SQL = \
+    """
+    SELECT package_id, codec, dictionary_id, data FROM package_descriptions
+    WHERE codec != ? OR COALESCE(dictionary_id, -1) != ?
+    """
+
+COUNT_PACKAGE_DESCRIPTIONS_SQL = "SELECT COUNT(*) FROM package_descriptions"
+
+INSERT_COMPRESSION_DICTIONARY_SQL = "INSERT INTO compression_dictionaries(codec, data) VALUES (?, ?)"
+
+SELECT_LATEST_COMPRESSION_DICTIONARY_SQL = \
+    "SELECT id, data FROM compression_dictionaries WHERE codec=? ORDER BY id DESC LIMIT 1"
+
+SELECT_COMPRESSION_DICTIONARY_SQL = "SELECT data FROM compression_dictionaries WHERE id=?"
+
+CLEAR_PACKAGE_SEARCH_INDEX_SQL = "DELETE FROM packages_fts"
+
+# Merging shard databases. Each shard is attached as 'shard' and copied over with bulk INSERT ... SELECT statements. The
+# IDs in the shard are remapped to those in the merged database by joining on the unique names, through temporary
+# mapping tables
+ATTACH_MERGE_SOURCE_SQL = "ATTACH DATABASE ? AS shard"
+
+DETACH_MERGE_SOURCE_SQL = "DETACH DATABASE shard"
+
+SELECT_MERGE_SOURCE_TABLE_EXISTS_SQL = "SELECT name FROM shard.sqlite_master WHERE type='table' AND name=?"
+
+SELECT_MAX_PACKAGE_ID_SQL = "SELECT COALESCE(MAX(id), 0) FROM packages"
+
+MERGE_PACKAGES_SQL = \
+    """
+    INSERT OR IGNORE INTO main.packages({columns})
+    SELECT {columns} FROM shard.packages ORDER BY id
+    """
+
+MERGE_CLASSIFIER_STRINGS_SQL = \
+    """
+    INSERT OR IGNORE INTO main.classifier_strings(name)
+    SELECT name FROM shard.classifier_strings ORDER BY id
+    """
+
+# Packages that were already in the merged database (from an earlier shard) are skipped, so only the packages added
+# from this shard, those with an ID above the maximum before it was merged, are mapped
+CREATE_MERGE_PACKAGE_ID_MAP_SQL = \
+    "CREATE TEMP TABLE merge_package_id_map (old_id integer PRIMARY KEY, new_id integer NOT NULL)"
+
+INSERT_MERGE_PACKAGE_ID_MAP_SQL = \
+    """
+    INSERT INTO merge_package_id_map(old_id, new_id)
+    SELECT shard_packages.id, main_packages.id
+    FROM shard.packages AS shard_packages
+    INNER JOIN main.packages AS main_packages ON main_packages.name = shard_packages.name
+    WHERE main_packages.id > ?
+    """
+
+CREATE_MERGE_CLASSIFIER_ID_MAP_SQL = \
+    "CREATE TEMP TABLE merge_classifier_id_map (old_id integer PRIMARY KEY, new_id integer NOT NULL)"
+
+INSERT_MERGE_CLASSIFIER_ID_MAP_SQL = \
+    """
+    INSERT INTO merge_classifier_id_map(old_id, new_id)
+    SELECT shard_classifiers.id, main_classifiers.id
+    FROM shard.classifier_strings AS shard_classifiers
+    INNER JOIN main.classifier_strings AS main_classifiers ON main_classifiers.name = shard_classifiers.name
+    """
+
+MERGE_PACKAGE_CLASSIFIERS_SQL = \
+    """
+    INSERT INTO main.package_classifiers(package_id, classifier_id)
+    SELECT merge_package_id_map.new_id, merge_classifier_id_map.new_id
+    FROM shard.package_classifiers AS shard_package_classifiers
+    INNER JOIN merge_package_id_map ON merge_package_id_map.old_id = shard_package_classifiers.package_id
+    INNER JOIN merge_classifier_id_map ON merge_classifier_id_map.old_id = shard_package_classifiers.classifier_id
+    ORDER BY shard_package_classifiers.id
+    """
+
+MERGE_PACKAGE_RELEASES_SQL = \
+    """
+    INSERT INTO main.package_releases(package_id, {columns})
+    SELECT merge_package_id_map.new_id, {source_columns}
+    FROM shard.package_releases AS shard_releases
+    INNER JOIN merge_package_id_map ON merge_package_id_map.old_id = shard_releases.package_id
+    ORDER BY shard_releases.id
+    """
+
+# Identical dictionaries in several shards are only stored once
+MERGE_COMPRESSION_DICTIONARIES_SQL = \
+    """
+    INSERT INTO main.compression_dictionaries(codec, data)
+    SELECT codec, data FROM shard.compression_dictionaries AS shard_dictionaries
+    WHERE NOT EXISTS (
+        SELECT 1 FROM main.compression_dictionaries AS main_dictionaries
+        WHERE main_dictionaries.codec = shard_dictionaries.codec AND main_dictionaries.data = shard_dictionaries.data)
+    ORDER BY id
+    """
+
+CREATE_MERGE_DICTIONARY_ID_MAP_SQL = \
+    "CREATE TEMP TABLE merge_dictionary_id_map (old_id integer PRIMARY KEY, new_id integer NOT NULL)"
+
+INSERT_MERGE_DICTIONARY_ID_MAP_SQL = \
+    """
+    INSERT INTO merge_dictionary_id_map(old_id, new_id)
+    SELECT shard_dictionaries.id, MIN(main_dictionaries.id)
+    FROM shard.compression_dictionaries AS shard_dictionaries
+    INNER JOIN main.compression_dictionaries AS main_dictionaries
+        ON main_dictionaries.codec = shard_dictionaries.codec AND main_dictionaries.data = shard_dictionaries.data
+    GROUP BY shard_dictionaries.id
+    """
+
+MERGE_PACKAGE_DESCRIPTIONS_SQL = \
+    """
+    INSERT OR IGNORE INTO main.package_descriptions(package_id, codec, dictionary_id, data)
+    SELECT merge_package_id_map.new_id, shard_descriptions.codec, merge_dictionary_id_map.new_id,
+    shard_descriptions.data
+    FROM shard.package_descriptions AS shard_descriptions
+    INNER JOIN merge_package_id_map ON merge_package_id_map.old_id = shard_descriptions.package_id
+    LEFT JOIN merge_dictionary_id_map ON merge_dictionary_id_map.old_id = shard_descriptions.dictionary_id
+    """
+
+DROP_MERGE_ID_MAPS_SQL_QUERIES = [
+    "DROP TABLE IF EXISTS temp.merge_package_id_map",
+    "DROP TABLE IF EXISTS temp.merge_classifier_id_map",
+    "DROP TABLE IF EXISTS temp.merge_dictionary_id_map",
+]
+
+# Refreshing packages that are already in the database. The hash of the last payload stored for each package is kept so
+# that unchanged packages can be skipped without touching any of their rows
+CREATE_PACKAGE_SYNC_STATE_TABLE_SQL = \
+    """
+    CREATE TABLE IF NOT EXISTS package_sync_state (
+    package_id integer PRIMARY KEY,
+    payload_hash text NOT NULL,
+    last_fetched text NOT NULL,
+    FOREIGN KEY(package_id) REFERENCES packages(id));
+    """
+
+UPSERT_PACKAGE_SYNC_STATE_SQL = \
+    """
+    INSERT INTO package_sync_state(package_id, payload_hash, last_fetched) VALUES (?, ?, ?)
+    ON CONFLICT(package_id) DO UPDATE SET payload_hash=excluded.payload_hash, last_fetched=excluded.last_fetched
+    """
+
+UPDATE_PACKAGE_LAST_FETCHED_SQL = "UPDATE package_sync_state SET last_fetched=? WHERE package_id=?"
+
+SELECT_PACKAGE_SYNC_STATE_SQL = \
+    """
+    SELECT packages.id, package_sync_state.payload_hash FROM packages
+    LEFT JOIN package_sync_state ON package_sync_state.package_id = packages.id
+    WHERE packages.name = ?
+    """
+
+UPDATE_PACKAGE_SQL = \
+    """
+    UPDATE packages SET
+    author=?,
+    author_email=?,
+    bugtrack_url=?,
+    description=?,
+    description_content_type=?,
+    docs_url=?,
+    download_url=?,
+    home_page=?,
+    keywords=?,
+    license=?,
+    maintainer=?,
+    maintainer_email=?,
+    package_url=?,
+    platform=?,
+    project_url=?,
+    project_urls=?,
+    release_url=?,
+    requires_dist=?,
+    requires_python=?,
+    summary=?,
+    version=?
+    WHERE name=?
+    """
+
+SELECT_CLASSIFIER_IDS_FOR_PACKAGE_SQL = "SELECT classifier_id FROM package_classifiers WHERE package_id=?"
+
+DELETE_PACKAGE_CLASSIFIER_SQL = "DELETE FROM package_classifiers WHERE package_id=? AND classifier_id=?"
+
+DELETE_PACKAGE_DESCRIPTION_SQL = "DELETE FROM package_descriptions WHERE package_id=?"
+
+# Columns of a release file in the order of INSERT_PACKAGE_RELEASES_SQL
+RELEASE_FILE_INSERT_COLUMNS = ["comment_text", "filename", "has_sig", "md5_digest", "package_id", "packagetype",
+                               "python_version", "requires_python", "size", "upload_time", "upload_time_iso_8601",
+                               "url", "version"]
+
+SELECT_RELEASE_FILES_FOR_PACKAGE_ID_SQL = \
+    """
+    SELECT id, comment_text, filename, has_sig, md5_digest, package_id, packagetype, python_version, requires_python,
+    size, upload_time, upload_time_iso_8601, url, version
+    FROM package_releases WHERE package_id = ?
+    """
+
+UPDATE_PACKAGE_RELEASE_SQL = \
+    """
+    UPDATE package_releases SET
+    comment_text=?,
+    filename=?,
+    has_sig=?,
+    md5_digest=?,
+    package_id=?,
+    packagetype=?,
+    python_version=?,
+    requires_python=?,
+    size=?,
+    upload_time=?,
+    upload_time_iso_8601=?,
+    url=?,
+    version=?
+    WHERE id=?
+    """
+
+DELETE_PACKAGE_RELEASE_SQL = "DELETE FROM package_releases WHERE id=?"
+
+MERGE_PACKAGE_SYNC_STATE_SQL = \
+    """
+    INSERT OR IGNORE INTO main.package_sync_state(package_id, payload_hash, last_fetched)
+    SELECT merge_package_id_map.new_id, shard_package_sync_state.payload_hash, shard_package_sync_state.last_fetched
+    FROM shard.package_sync_state AS shard_package_sync_state
+    INNER JOIN merge_package_id_map ON merge_package_id_map.old_id = shard_package_sync_state.package_id
+    """
+
+SELECT_PACKAGE_FETCH_TIMES_SQL = \
+    """
+    SELECT packages.name, package_sync_state.last_fetched FROM packages
+    LEFT JOIN package_sync_state ON package_sync_state.package_id = packages.id
+    """
+
+# Lookups of the query command. Each is run many times with different parameters over one connection, which keeps
+# them prepared in its statement cache
+QUERY_PACKAGE_INFO_SQL = \
+    "SELECT {} FROM packages WHERE name=?".format(', '.join(PACKAGE_TABLE_COLUMNS))
+
+QUERY_PACKAGE_DESCRIPTION_SQL = "SELECT codec, dictionary_id, data FROM package_descriptions WHERE package_id=?"
+
+QUERY_PACKAGE_RELEASES_SQL = \
+    """
+    SELECT packages.name, {} FROM package_releases
+    INNER JOIN packages ON packages.id = package_releases.package_id
+    WHERE packages.name=?
+    ORDER BY package_releases.id
+    """.format(', '.join('package_releases.{}'.format(x) for x in PACKAGE_RELEASES_TABLE_COLUMNS
+                         if x not in ('id', 'package_id')))
+
+QUERY_PACKAGE_CLASSIFIERS_SQL = \
+    """
+    SELECT packages.name, classifier_strings.name FROM classifier_strings
+    INNER JOIN package_classifiers ON classifier_strings.id = package_classifiers.classifier_id
+    INNER JOIN packages ON packages.id = package_classifiers.package_id
+    WHERE packages.name=?
+    ORDER BY classifier_strings.name
+    """
+
+# Candidates are found with a LIKE on the name, with _ as the wildcard for both - and _ as they are interchangeable in
+# requirements. The requirements of each candidate are then parsed to drop partial matches
+QUERY_REVERSE_DEPENDENCY_CANDIDATES_SQL = \
+    "SELECT name, version, requires_dist FROM packages WHERE requires_dist LIKE ? ORDER BY name"
+
+# A classifier matches itself and every classifier below it, e.g. 'Framework :: Django' matches
+# 'Framework :: Django :: 3.2'
+QUERY_PACKAGES_WITH_CLASSIFIER_SQL = \
+    """
+    SELECT DISTINCT packages.name, packages.version, packages.summary FROM classifier_strings
+    INNER JOIN package_classifiers ON classifier_strings.id = package_classifiers.classifier_id
+    INNER JOIN packages ON packages.id = package_classifiers.package_id
+    WHERE classifier_strings.name=? OR classifier_strings.name LIKE ? ESCAPE '\\'
+    ORDER BY packages.name
+    """
+
+# Identifies the set of package names, which only changes as packages are added, to tell if a name index is stale
+SELECT_PACKAGE_NAMES_STAMP_SQL = "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM packages"
+SELECT_PACKAGE_NAMES_ADDED_SINCE_SQL = "SELECT name FROM packages WHERE id > ?"
+
+# Summary of the releases of each package, written along with the package so that latest version and freshness queries
+# are a scan of one row per package rather than of every release file. It is calculated before the releases are
+# truncated for storage, so it covers every release of the package
+CREATE_PACKAGE_RELEASE_SUMMARY_TABLE_SQL = \
+    """
+    CREATE TABLE IF NOT EXISTS package_release_summary (
+    package_id integer PRIMARY KEY,
+    latest_version text,
+    first_upload_time text,
+    last_upload_time text,
+    release_count integer NOT NULL,
+    file_count integer NOT NULL,
+    total_size integer NOT NULL,
+    has_wheel integer NOT NULL,
+    FOREIGN KEY(package_id) REFERENCES packages(id));
+    """
+
+CREATE_PACKAGE_RELEASE_SUMMARY_INDEX_SQL = \
+    "CREATE INDEX IF NOT EXISTS package_release_summary_last_upload ON package_release_summary(last_upload_time)"
+
+PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS = \
+    ["package_id", "latest_version", "first_upload_time", "last_upload_time", "release_count", "file_count",
+     "total_size", "has_wheel"]
+
+UPSERT_PACKAGE_RELEASE_SUMMARY_SQL = \
+    "INSERT OR REPLACE INTO package_release_summary({}) VALUES ({})".format(
+        ', '.join(PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS), ', '.join('?' for _ in PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS))
+
+SELECT_RELEASE_SUMMARY_FOR_PACKAGE_SQL = \
+    """
+    SELECT package_release_summary.* FROM package_release_summary
+    INNER JOIN packages ON packages.id = package_release_summary.package_id
+    WHERE packages.name=?
+    """
+
+# Oldest last upload first, in the order of the index
+SELECT_ALL_RELEASE_SUMMARIES_SQL = \
+    """
+    SELECT packages.name, {} FROM package_release_summary
+    INNER JOIN packages ON packages.id = package_release_summary.package_id
+    ORDER BY package_release_summary.last_upload_time
+    """.format(', '.join('package_release_summary.{}'.format(x) for x in PACKAGE_RELEASE_SUMMARY_TABLE_COLUMNS
+                         if x != 'package_id'))
+
+# Release files of the packages that have no summary, grouped by package, to summarise what was stored for them
+SELECT_RELEASE_FILES_WITHOUT_SUMMARY_SQL = \
+    """
+    SELECT * FROM package_releases
+    WHERE package_id NOT IN (SELECT package_id FROM package_release_summary)
+    ORDER BY package_id
+    """
+
+MERGE_PACKAGE_RELEASE_SUMMARY_SQL = \
+    """
+    INSERT OR IGNORE INTO main.package_release_summary({columns})
+    SELECT merge_package_id_map.new_id, {source_columns}
+    FROM shard.package_release_summary AS shard_summary
+    INNER JOIN merge_package_id_map ON merge_package_id_map.old_id = shard_summary.package_id
+    """
+
+# Database maintenance
+INTEGRITY_CHECK_SQL = 'PRAGMA integrity_check'
+QUICK_CHECK_SQL = 'PRAGMA quick_check'
+SEARCH_INDEX_INTEGRITY_CHECK_SQL = "INSERT INTO packages_fts(packages_fts) VALUES('integrity-check')"
+SEARCH_INDEX_OPTIMIZE_SQL = "INSERT INTO packages_fts(packages_fts) VALUES('optimize')"
+# A negative merge puts every segment of the search index on one level, so the positive merges that follow work through
+# them a few pages at a time until the index is fully merged, as 'optimize' does in one go
+SEARCH_INDEX_MERGE_SQL = "INSERT INTO packages_fts(packages_fts, rank) VALUES('merge', ?)"
+SELECT_INDEXED_TABLES_SQL = "SELECT DISTINCT tbl_name FROM sqlite_master WHERE type='index' ORDER BY tbl_name"
+REINDEX_TABLE_SQL = 'REINDEX "{}"'
+SET_ANALYSIS_LIMIT_SQL = 'PRAGMA analysis_limit={:d}'
+ANALYZE_SQL = 'ANALYZE'
+SELECT_AUTO_VACUUM_SQL = 'PRAGMA auto_vacuum'
+SET_INCREMENTAL_AUTO_VACUUM_SQL = 'PRAGMA auto_vacuum=INCREMENTAL'
+SELECT_FREELIST_COUNT_SQL = 'PRAGMA freelist_count'
+SELECT_PAGE_COUNT_SQL = 'PRAGMA page_count'
+SELECT_PAGE_SIZE_SQL = 'PRAGMA page_size'
+INCREMENTAL_VACUUM_SQL = 'PRAGMA incremental_vacuum({:d})'
+VACUUM_SQL = 'VACUUM'
+WAL_CHECKPOINT_SQL = 'PRAGMA wal_checkpoint({})'
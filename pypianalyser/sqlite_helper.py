@@ -1,19 +1,174 @@
-from sqlite3worker import Sqlite3Worker
+from collections import namedtuple
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import six
+from six.moves import queue
+
+ENABLE_WAL_SQL = 'PRAGMA journal_mode=WAL'
+# Only takes effect on a new database, before any tables are created
+ENABLE_INCREMENTAL_VACUUM_SQL = 'PRAGMA auto_vacuum=INCREMENTAL'
+FLUSH_SQL = 'SELECT 1'
+ENABLE_QUERY_ONLY_SQL = 'PRAGMA query_only=ON'
+SELECT_TABLE_EXISTS_SQL = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
+
+DEFAULT_FETCH_BATCH_SIZE = 1000
+ROW_TYPE_TUPLE = 'tuple'
+ROW_TYPE_DICT = 'dict'
+ROW_TYPE_NAMEDTUPLE = 'namedtuple'
+ROW_TYPES = [ROW_TYPE_TUPLE, ROW_TYPE_DICT, ROW_TYPE_NAMEDTUPLE]
+
+
+def connect_read_only(db_path, **kwargs):
+    """
+    Opens a read-only connection to an existing database. A mode=ro URI is used where the sqlite3 module supports URIs.
+    Python 2 does not, so there a plain connection is opened instead and switched to query_only, which rejects writes
+    in the same way
+
+    :param db_path: Path to the database file
+    :type db_path: str
+    :param kwargs: Keyword arguments for sqlite3.connect()
+
+    :return: Connection to the database
+    :rtype: sqlite3.Connection
+    """
+    if six.PY2:
+        # A plain connection would create the file if it didn't exist, where mode=ro fails
+        if not os.path.exists(db_path):
+            raise sqlite3.OperationalError('unable to open database file')
+        conn = sqlite3.connect(db_path, **kwargs)
+        conn.execute(ENABLE_QUERY_ONLY_SQL)
+        return conn
+    # urllib.request pulls in http.client and email, so it is only imported when a connection is opened
+    from six.moves.urllib.request import pathname2url
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_path)))
+    return sqlite3.connect(uri, uri=True, **kwargs)
+
+
+class ReadOnlyConnectionPool(object):
+    """
+    Pool of read-only connections to an SQLite database. Connections are opened lazily (up to pool_size) with
+    connect_read_only() and are handed out to one thread at a time, so readers neither queue behind each other nor
+    behind the Sqlite3Worker thread that performs the writes
+    """
+    def __init__(self, db_path, pool_size=4):
+        """
+        Constructor for ReadOnlyConnectionPool
+
+        :param db_path: Path to the database file
+        :type db_path: str
+        :param pool_size: Maximum number of connections to open
+        :type pool_size: int
+        """
+        self._db_path = db_path
+        self._pool_size = max(pool_size, 1)
+        self._idle_connections = queue.LifoQueue()
+        self._open_count = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        """
+        Opens a new read-only connection
+
+        :return: Connection to the database
+        :rtype: sqlite3.Connection
+        """
+        return connect_read_only(self._db_path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    def acquire(self):
+        """
+        Takes a connection from the pool, opening a new one if the pool has not reached its size limit. Blocks until a
+        connection is available otherwise
+
+        :return: Connection to the database
+        :rtype: sqlite3.Connection
+        """
+        try:
+            return self._idle_connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._open_count < self._pool_size
+            if can_open:
+                self._open_count += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._open_count -= 1
+                raise
+        return self._idle_connections.get()
+
+    def release(self, connection):
+        """
+        Returns a connection to the pool. If the pool has been closed the connection is closed instead
+
+        :param connection: Connection previously obtained from acquire()
+        :type connection: sqlite3.Connection
+        """
+        if self._closed:
+            connection.close()
+            with self._lock:
+                self._open_count -= 1
+        else:
+            self._idle_connections.put(connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that acquires a connection and releases it on exit
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        Closes all idle connections. Connections that are currently in use are closed when they are released
+        """
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open_count -= 1
 
 
 class SQLiteHelper(object):
     """
-    Class to wrap a concurrent SQLite database
+    Class to wrap a concurrent SQLite database. Writes are serialised through a single Sqlite3Worker thread, reads are
+    served from a pool of read-only connections
     """
-    def __init__(self, db_path):
+    def __init__(self, db_path, read_pool_size=4):
         """
         Constructor for SQLiteHelper
 
         :param db_path: Path to the database file
         :type db_path: str
+        :param read_pool_size: Maximum number of read-only connections to open for queries
+        :type read_pool_size: int
         """
+        # sqlite3worker is only imported once a database is opened for writing, so that commands which only read start
+        # quickly
+        from pypianalyser.sqlite_worker import CommittingSqlite3Worker
         self._db_path = db_path
-        self.sql_worker = Sqlite3Worker(db_path)
+        self.sql_worker = CommittingSqlite3Worker(db_path)
+        # Lets the maintenance command return free pages to the filesystem a few at a time, rather than rewriting the
+        # whole file with VACUUM
+        self.sql_worker.execute(ENABLE_INCREMENTAL_VACUUM_SQL)
+        # WAL allows the read-only connections to query the database while the worker is writing to it
+        self.sql_worker.execute(ENABLE_WAL_SQL)
+        self.read_pool = ReadOnlyConnectionPool(db_path, read_pool_size)
+        self._pending_writes = False
 
     def __del__(self):
         """
@@ -25,10 +180,122 @@ class SQLiteHelper(object):
         """
         Closes the database file
         """
-        if self.sql_worker:
+        # Close the readers first, a read-only connection can't checkpoint the WAL so the writer must be the last to
+        # close for the -wal and -shm files to be cleaned up
+        if getattr(self, 'read_pool', None):
+            self.read_pool.close()
+            self.read_pool = None
+        if getattr(self, 'sql_worker', None):
             self.sql_worker.close()
             self.sql_worker = None
 
+    def flush(self):
+        """
+        Blocks until every write queued by this helper has been executed and committed by the worker thread, after
+        which the writes are visible to the read-only connections. The commit is forced, rather than waiting for the
+        worker's queue to drain, so it holds while other threads keep queuing writes
+        """
+        self._pending_writes = False
+        self.sql_worker.execute(FLUSH_SQL)
+
+    def _table_exists(self, table_name):
+        """
+        Checks whether a table exists in the database. This is queried through the worker thread so that tables it has
+        just created are seen
+
+        :param table_name: Name of the table
+        :type table_name: str
+
+        :return: True if the table exists
+        :rtype: bool
+        """
+        return bool(self.sql_worker.execute(SELECT_TABLE_EXISTS_SQL, (table_name,)))
+
+    def _execute_write(self, query, values=None):
+        """
+        Queues a write query on the worker thread
+
+        :param query: SQL query
+        :type query: str
+        :param values: Values to bind to the query
+        :type values: tuple or None
+        """
+        self._pending_writes = True
+        self.sql_worker.execute(query, values)
+
+    def _execute_read(self, query, values=()):
+        """
+        Runs a query on one of the read-only connections. If this helper has queued writes that haven't been flushed
+        yet, they are flushed first so that the caller can read back its own writes
+
+        :param query: SQL query
+        :type query: str
+        :param values: Values to bind to the query
+        :type values: tuple
+
+        :return: List of row tuples
+        :rtype: list
+        """
+        if self._pending_writes:
+            self.flush()
+        with self.read_pool.connection() as conn:
+            return conn.execute(query, values).fetchall()
+
+    def _iter_read(self, query, values=(), batch_size=DEFAULT_FETCH_BATCH_SIZE, row_factory=None):
+        """
+        Generator that runs a query on one of the read-only connections and yields the rows, fetching them from the
+        cursor in batches so that the full result set is never held in memory. The connection is held until the
+        generator is exhausted or closed
+
+        :param query: SQL query
+        :type query: str
+        :param values: Values to bind to the query
+        :type values: tuple
+        :param batch_size: Number of rows to fetch from the cursor at a time
+        :type batch_size: int
+        :param row_factory: Callable to convert each row tuple, or None to yield the tuples as they are
+        :type row_factory: callable or None
+
+        :return: Generator of rows
+        :rtype: generator
+        """
+        if self._pending_writes:
+            self.flush()
+        with self.read_pool.connection() as conn:
+            cursor = conn.execute(query, values)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row_factory(row) if row_factory else row
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def _build_row_factory(row_type, column_names, row_class=None):
+        """
+        Builds a callable that converts a row tuple into the requested row type
+
+        :param row_type: One of ROW_TYPES
+        :type row_type: str
+        :param column_names: Names of the columns in the row, in order
+        :type column_names: list
+        :param row_class: namedtuple class to use for ROW_TYPE_NAMEDTUPLE
+        :type row_class: type or None
+
+        :return: Row factory, or None if the rows should be left as tuples
+        :rtype: callable or None
+        """
+        if row_type == ROW_TYPE_TUPLE:
+            return None
+        elif row_type == ROW_TYPE_DICT:
+            return lambda row: dict(zip(column_names, row))
+        elif row_type == ROW_TYPE_NAMEDTUPLE:
+            return (row_class or namedtuple('Row', column_names))._make
+        raise ValueError('Unknown row type: {}. Must be one of {}'.format(row_type, ', '.join(ROW_TYPES)))
+
     def _map_data_to_column_names(self, row_tuples, column_names):
         ret_val = []
         for row in row_tuples:
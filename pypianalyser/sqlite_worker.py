@@ -0,0 +1,17 @@
+from sqlite3worker import Sqlite3Worker
+from pypianalyser.sqlite_helper import FLUSH_SQL
+
+
+class CommittingSqlite3Worker(Sqlite3Worker):
+    """
+    Sqlite3Worker that commits before it answers FLUSH_SQL. Sqlite3Worker only commits once its queue is empty or every
+    max_queue_size statements, so while other threads keep queuing writes a SELECT can be answered long before the
+    writes queued ahead of it are committed and visible to other connections.
+
+    Kept out of pypianalyser.sqlite_helper so that sqlite3worker is only imported once a database is opened for writing
+    """
+    def _run_query(self, token, query, values):
+        if query == FLUSH_SQL:
+            # Runs on the worker thread, which owns the connection
+            self._sqlite3_conn.commit()
+        Sqlite3Worker._run_query(self, token, query, values)
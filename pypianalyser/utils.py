@@ -1,13 +1,20 @@
 from collections import OrderedDict
-from datetime import datetime
+import importlib
 from io import open
 import os
+import re
+import sys
+import zlib
+from packaging.version import Version, parse
 import six
 from six.moves import xrange
 
 if six.PY3:
     unicode = str
 
+# PEP 508 distribution name at the start of a requirement
+REQUIREMENT_NAME_REGEX = re.compile(r'\s*([A-Za-z][A-Za-z0-9._-]*[A-Za-z0-9]|[A-Za-z])')
+
 
 def order_dict_by_key_name(unordered_dict):
     """
@@ -45,6 +52,60 @@ def read_file_lines_into_list(file_path):
     return ret_val
 
 
+def get_rss_bytes():
+    """
+    Returns the resident set size of the current process. This is read from /proc on Linux, elsewhere the peak RSS
+    reported by getrusage is returned instead
+
+    :return: RSS in bytes, or None if it can't be determined on this platform
+    :rtype: int or None
+    """
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, everything else kilobytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def lazy_import(module_name):
+    """
+    Imports an optional dependency lazily. A module object is returned straight away, but the module is only loaded the
+    first time one of its attributes is used, so that heavy dependencies such as numpy and pyarrow don't slow down the
+    startup of commands that never use them. Loading isn't thread safe before Python 3.12, so only use this for modules
+    that are first used from a single thread. On Python 2 the module is imported straight away
+
+    :param module_name: Name of the module, e.g. 'numpy'
+    :type module_name: str
+
+    :return: The module, or None if it isn't installed
+    :rtype: module or None
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    try:
+        from importlib.util import find_spec, module_from_spec, LazyLoader
+    except ImportError:
+        try:
+            return importlib.import_module(module_name)
+        except ImportError:
+            return None
+    spec = find_spec(module_name)
+    if spec is None:
+        return None
+    spec.loader = LazyLoader(spec.loader)
+    module = module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
 def write_list_lines_into_file(file_path, lines, file_mode='w'):
     """
     Write a list of strings to a file, each one on their own line. OS specific line separator is used
@@ -101,30 +162,129 @@ def normalize_package_name(package_name):
     return package_name.lower().replace('_', '-')
 
 
-def order_release_names_fallback(release_dict):
+def split_requires_dist(requires_dist):
+    """
+    Splits the requires_dist field, as it is stored in the database (the requirements joined with ', '), back into the
+    list of requirements
+
+    :param requires_dist: Stored requires_dist field, e.g. "requests (>=2.0, <3), six ; extra == 'test'"
+    :type requires_dist: str or None
+
+    :return: Requirements, or None if there are none
+    :rtype: list or None
+    """
+    if not requires_dist:
+        return None
+    ret_val = []
+    for part in requires_dist.split(', '):
+        # Requirements are taken to start with a letter. Anything else is the tail of a version specifier that itself
+        # contained ', ', e.g. '<3)' from 'requests (>=2.0, <3)'
+        if ret_val and not REQUIREMENT_NAME_REGEX.match(part):
+            ret_val[-1] = u'{}, {}'.format(ret_val[-1], part)
+        else:
+            ret_val.append(part)
+    return ret_val
+
+
+def split_project_urls(project_urls):
+    """
+    Splits the project_urls field, as it is stored in the database (the 'label: url' pairs joined with ', '), back into
+    a dictionary
+
+    :param project_urls: Stored project_urls field, e.g. 'Homepage: https://a.com, Source: https://github.com/a'
+    :type project_urls: str or None
+
+    :return: Labels mapped to URLs, or None if there are none
+    :rtype: OrderedDict or None
+    """
+    if not project_urls:
+        return None
+    ret_val = OrderedDict()
+    for pair in project_urls.split(', '):
+        label, _, url = pair.partition(': ')
+        ret_val[label] = url
+    return ret_val
+
+
+def parse_requirement_names(requires_dist):
+    """
+    Extracts the normalized names of the packages a package depends on from its requires_dist field, as it is stored in
+    the database (the requirements joined with ', ')
+
+    :param requires_dist: Stored requires_dist field, e.g. "requests (>=2.0), six ; extra == 'test'"
+    :type requires_dist: str or None
+
+    :return: Names of the required packages, without duplicates, in the order they are listed
+    :rtype: list
+    """
+    ret_val = []
+    for requirement in split_requires_dist(requires_dist) or []:
+        match = REQUIREMENT_NAME_REGEX.match(requirement)
+        if match:
+            name = normalize_package_name(match.group(1))
+            if name not in ret_val:
+                ret_val.append(name)
+    return ret_val
+
+
+def order_release_names(release_dict):
     """
-    In Python3 if you compare two versions using LooseVersion where one has a string in, e.g.
-    LooseVersion('0.1dev') < LooseVersion('0.1.0')
-    an error is thrown because its trying to compare a string to an int. This is fallback that orders versions by the
-    upload date of the first file in each release
+    Orders the names of releases from newest to oldest by their PEP 440 version numbers, so that pre-releases come
+    after the final release they precede (e.g. 2.0 before 2.0rc1). Release names that aren't valid versions come last,
+    in reverse order of name
 
-    :param release_dict: Releases to order keys for
+    :param release_dict: Release names mapped to lists of release files
     :type release_dict: dict
 
-    :return: Ordered list of keys, with releases with no files removed
+    :return: Ordered list of release names
     :rtype: list
     """
-    release_keys = list(release_dict.keys())
-    # Begin by removing any releases that do no have any files
-    release_keys = [x for x in release_keys if release_dict[x]]
+    return sorted(list(release_dict.keys()), key=_release_sort_key, reverse=True)
+
+
+def _release_sort_key(release_name):
+    """
+    Sort key of a release name, which puts names that aren't valid versions below all of those that are
 
-    # Now order based on upload date of the first file in the release
-    ordered_releases_names = sorted(
-        release_keys,
-        key=lambda x: datetime.strptime(release_dict[x][0]['upload_time'], '%Y-%m-%dT%H:%M:%S'),
-        reverse=True)
+    :param release_name: Release name
+    :type release_name: str
 
-    return ordered_releases_names
+    :return: Sort key
+    :rtype: tuple
+    """
+    try:
+        version = parse(release_name)
+    except ValueError:
+        # Newer versions of packaging raise InvalidVersion, a ValueError, rather than returning a LegacyVersion
+        version = None
+    if isinstance(version, Version):
+        return 1, version
+    return 0, release_name
+
+
+def summarise_releases(release_dict):
+    """
+    Summarises the releases of a package. Releases without any files are left out
+
+    :param release_dict: Release names mapped to lists of release files
+    :type release_dict: dict or None
+
+    :return: The latest version, the first and last upload times, the numbers of releases and files, the total size of
+     the files and whether any of them is a wheel, keyed by the columns of the package_release_summary table
+    :rtype: OrderedDict
+    """
+    releases = dict((k, v) for k, v in (release_dict or {}).items() if v)
+    files = [x for release_files in releases.values() for x in release_files]
+    upload_times = [x['upload_time'] for x in files if x.get('upload_time')]
+    return OrderedDict([
+        ('latest_version', order_release_names(releases)[0] if releases else None),
+        ('first_upload_time', min(upload_times) if upload_times else None),
+        ('last_upload_time', max(upload_times) if upload_times else None),
+        ('release_count', len(releases)),
+        ('file_count', len(files)),
+        ('total_size', sum(x.get('size') or 0 for x in files)),
+        ('has_wheel', any(x.get('packagetype') == 'bdist_wheel' for x in files)),
+    ])
 
 
 def split_list_into_chunks(full_list, chunk_count):
@@ -147,3 +307,33 @@ def split_list_into_chunks(full_list, chunk_count):
         chunks = chunks[:-1]
         chunks[-1].extend(extra_chunk)
     return chunks
+
+
+def get_shard_index(package_name, shard_count):
+    """
+    Assigns a package to a shard by hashing its name. The hash is stable across processes, machines and Python versions
+    (unlike hash()), so every node of a sharded crawl agrees on the assignment
+
+    :param package_name: Normalized package name
+    :type package_name: str
+    :param shard_count: Total number of shards
+    :type shard_count: int
+
+    :return: Index of the shard, from 0 to shard_count - 1
+    :rtype: int
+    """
+    return (zlib.crc32(package_name.encode('utf-8')) & 0xffffffff) % shard_count
+
+
+def build_search_query(search_terms):
+    """
+    Converts free text into an FTS5 query that matches rows containing every term. Each term is quoted so that
+    characters that have a meaning in the FTS5 query syntax (e.g. hyphens in package names) are searched for literally
+
+    :param search_terms: Free text to search for
+    :type search_terms: str
+
+    :return: FTS5 MATCH expression
+    :rtype: str
+    """
+    return u' '.join(u'"{}"'.format(term.replace('"', '""')) for term in search_terms.split())
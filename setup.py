@@ -24,8 +24,14 @@ setuptools.setup(
         'six',
         'sqlite3worker',
         'lxml',
+        'packaging',
         'requests'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'export': ['pyarrow'],
+        'stats': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'pypianalyser=pypianalyser:main'
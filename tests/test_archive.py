@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from pypianalyser.archive import ResponseArchive, ARCHIVE_OBJECTS_DIR
+
+
+class TestResponseArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.test_obj = ResponseArchive(os.path.join(self.temp_dir, 'archive'))
+
+    def tearDown(self):
+        self.test_obj.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _count_objects(self):
+        return sum(len(files) for _, _, files in os.walk(os.path.join(self.test_obj.directory, ARCHIVE_OBJECTS_DIR)))
+
+    def test_store_and_load(self):
+        content = u'{"info": {"name": "a", "summary": "☃"}}'.encode('utf-8')
+        digest, is_new = self.test_obj.store('a', content)
+        self.assertTrue(is_new)
+        self.assertEqual(content.decode('utf-8'), self.test_obj.load(digest))
+
+    def test_identical_responses_stored_once(self):
+        first_digest, _ = self.test_obj.store('a', b'{"v": 1}')
+        second_digest, is_new = self.test_obj.store('b', b'{"v": 1}')
+        self.assertFalse(is_new)
+        self.assertEqual(first_digest, second_digest)
+        self.assertEqual(1, self._count_objects())
+
+    def test_read_index_latest_response_wins(self):
+        self.test_obj.store('a', b'{"v": 1}')
+        self.test_obj.store('b', b'{"v": 2}')
+        latest_digest, _ = self.test_obj.store('a', b'{"v": 3}')
+        self.test_obj.close()
+
+        index = ResponseArchive(self.test_obj.directory).read_index()
+        self.assertListEqual(['a', 'b'], list(index))
+        self.assertEqual(latest_digest, index['a'])
+        self.assertEqual(2, len(set(index.values())))
+
+    def test_load_missing(self):
+        self.assertRaises(Exception, self.test_obj.load, '0' * 64)
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import unittest
+from mock import MagicMock, call, patch
+from pypianalyser.cli import main
+
+
+class TestCli(unittest.TestCase):
+
+    def test_ingest_is_default_command(self):
+        mock_retriever = MagicMock()
+        with patch('pypianalyser.pypi_metadata_retriever.PyPiMetadataRetriever',
+                   return_value=mock_retriever) as mock_cls:
+            main(['-db', 'test.sqlite', '-t', '3'])
+        self.assertEqual('test.sqlite', mock_cls.call_args[0][3])
+        self.assertEqual(3, mock_cls.call_args[0][2])
+        mock_retriever.run.assert_called_once_with()
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime requires Python 3.7')
+    def test_heavy_dependencies_not_imported_at_startup(self):
+        root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', 'import pypianalyser.cli'],
+                                         cwd=root_dir, stderr=subprocess.STDOUT).decode('utf-8')
+        imported = set(x.split('|')[-1].strip() for x in output.splitlines() if x.startswith('import time:'))
+        for module_name in ['requests', 'lxml', 'numpy', 'pyarrow', 'zstandard', 'distutils', 'sqlite3worker',
+                            'multiprocessing', 'cProfile', 'pypianalyser.pypi_metadata_retriever',
+                            'pypianalyser.profiling', 'pypianalyser.server', 'pypianalyser.merge',
+                            'pypianalyser.maintenance', 'pypianalyser.pypi_sqlite_helper']:
+            self.assertNotIn(module_name, imported)
+
+    def test_search(self):
+        mock_db = MagicMock()
+        mock_db.search_packages.return_value = [{'name': 'pack-a', 'version': '1.0', 'summary': 'A package'}]
+        with patch('pypianalyser.cli._open_existing_db', return_value=mock_db):
+            main(['search', 'http', 'client', '-db', 'test.sqlite'])
+        mock_db.search_packages.assert_called_once_with('http client', 20, False)
+        mock_db.close.assert_called_once_with()
+
+    def test_maintenance(self):
+        mock_maintenance = MagicMock()
+        mock_maintenance.run.return_value = {'integrity_check': {'result': ['Page 3 is never used'], 'seconds': 0.1}}
+        with patch('pypianalyser.maintenance.DatabaseMaintenance', return_value=mock_maintenance) as mock_cls:
+            self.assertRaisesRegexp(Exception, 'found 1 problems', main,
+                                    ['maintenance', '--online', '--steps', 'vacuum', 'integrity_check'])
+        self.assertTrue(mock_cls.call_args[0][1])
+        mock_maintenance.run.assert_called_once_with(['vacuum', 'integrity_check'])
+        mock_maintenance.close.assert_called_once_with()
+
+    def test_query(self):
+        mock_queries = MagicMock()
+        mock_queries.run.side_effect = lambda query_type, term: [(term, 'Topic :: Utilities')]
+        with patch('pypianalyser.query.PackageQueries', return_value=mock_queries), \
+                patch('pypianalyser.cli.sys.stdout') as mock_stdout:
+            main(['query', 'classifiers', 'pack-a', 'pack-b', '-f', 'tsv', '-db', 'test.sqlite'])
+        self.assertEqual([call('classifiers', 'pack-a'), call('classifiers', 'pack-b')], mock_queries.run.call_args_list)
+        # One header for all of the names
+        self.assertEqual(['name\tclassifier\n', 'pack-a\tTopic :: Utilities\n', 'pack-b\tTopic :: Utilities\n'],
+                         [x[0][0] for x in mock_stdout.write.call_args_list])
+        mock_queries.close.assert_called_once_with()
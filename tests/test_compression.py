@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import unittest
+from pypianalyser.compression import TextCompressor, train_dictionary, CODEC_ZLIB, CODEC_ZSTD, zstandard, \
+    ZLIB_DICTIONARY_SUPPORTED
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = [u'Package {}\n\nInstallation\n------------\n\npip install package-{}\n\nLicense: MIT\n'
+                        u'Copyright (c) The Authors. Permission is hereby granted, free of charge\n'.format(i, i)
+                        for i in range(500)]
+
+    def _check_round_trip(self, codec):
+        dictionary = train_dictionary(codec, self.samples)
+        self.assertIsNotNone(dictionary)
+        plain_compressor = TextCompressor(codec)
+        dictionary_compressor = TextCompressor(codec, dictionary)
+
+        text = u'Package 1000 ☃\n\nInstallation\n------------\n\npip install package-1000\n'
+        self.assertEqual(text, plain_compressor.decompress(plain_compressor.compress(text)))
+        self.assertEqual(text, dictionary_compressor.decompress(dictionary_compressor.compress(text)))
+        self.assertLess(len(dictionary_compressor.compress(text)), len(plain_compressor.compress(text)))
+
+    @unittest.skipUnless(ZLIB_DICTIONARY_SUPPORTED, 'zlib dictionaries require Python 3')
+    def test_zlib_round_trip(self):
+        self._check_round_trip(CODEC_ZLIB)
+
+    @unittest.skipIf(ZLIB_DICTIONARY_SUPPORTED, 'zlib dictionaries are supported')
+    def test_zlib_without_dictionary_support(self):
+        self.assertIsNone(train_dictionary(CODEC_ZLIB, self.samples))
+        self.assertRaises(Exception, TextCompressor, CODEC_ZLIB, b'Installation')
+        compressor = TextCompressor(CODEC_ZLIB)
+        self.assertEqual(self.samples[0], compressor.decompress(compressor.compress(self.samples[0])))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_round_trip(self):
+        self._check_round_trip(CODEC_ZSTD)
+
+    def test_zlib_dictionary_no_common_lines(self):
+        self.assertIsNone(train_dictionary(CODEC_ZLIB, [u'abcdef', u'ghijkl']))
@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from pypianalyser.export import export_database, pyarrow
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'db.sqlite')
+        self.output_dir = os.path.join(self.temp_dir, 'export')
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        db_helper = PyPiAnalyserSqliteHelper(self.db_path, compress_descriptions=True)
+        self.release_count = 0
+        for file_name in ['robotframework.json', 'robotframework-remoterunner.json']:
+            with open(os.path.join(resources_dir, file_name), 'r') as fp:
+                metadata = json.load(fp)
+            self.release_count += sum(len(x) for x in metadata['releases'].values())
+            db_helper.commit_package_to_db(metadata)
+        db_helper.close()
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_export_parquet(self):
+        import pyarrow.parquet
+        paths = export_database(self.db_path, self.output_dir, batch_size=7)
+        self.assertEqual(4, len(paths))
+
+        releases = pyarrow.parquet.read_table(os.path.join(self.output_dir, 'package_releases.parquet'))
+        self.assertEqual(self.release_count, releases.num_rows)
+        self.assertTrue(pyarrow.types.is_dictionary(releases.schema.field('packagetype').type))
+        self.assertSetEqual({'sdist', 'bdist_wheel'}, set(releases.column('packagetype').to_pylist()))
+
+        packages = pyarrow.parquet.read_table(os.path.join(self.output_dir, 'packages.parquet')).to_pydict()
+        robotframework = packages['name'].index('robotframework')
+        self.assertTrue(packages['description'][robotframework].startswith('Robot Framework'))
+
+    def test_export_arrow(self):
+        import pyarrow.ipc
+        export_database(self.db_path, self.output_dir, file_format='arrow', batch_size=5, tables=['package_releases'])
+        with pyarrow.memory_map(os.path.join(self.output_dir, 'package_releases.arrow')) as source:
+            releases = pyarrow.ipc.open_file(source).read_all()
+        self.assertEqual(self.release_count, releases.num_rows)
+        self.assertIn('bdist_wheel', releases.column('packagetype').to_pylist())
+
+    def test_export_leaves_database_unchanged(self):
+        modified_time = os.path.getmtime(self.db_path)
+        export_database(self.db_path, self.output_dir, tables=['classifier_strings'])
+        self.assertEqual(modified_time, os.path.getmtime(self.db_path))
+
+    def test_export_missing_database(self):
+        missing_path = os.path.join(self.temp_dir, 'missing.sqlite')
+        self.assertRaisesRegexp(Exception, 'does not exist', export_database, missing_path, self.output_dir)
+        self.assertFalse(os.path.exists(missing_path))
@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+from pypianalyser.hedging import HedgedRequester, MIN_HEDGE_DELAY, RECALCULATE_INTERVAL
+from pypianalyser.metrics import Metrics
+
+
+class TestHedgedRequester(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.hedger = HedgedRequester(0.9, window_size=20, min_samples=10, metrics=self.metrics)
+
+    def tearDown(self):
+        self.hedger.close()
+
+    def _warm_up(self, seconds=0.01):
+        for _ in range(10):
+            self.hedger.record_latency(seconds)
+
+    def test_hedge_delay(self):
+        self.assertRaises(ValueError, HedgedRequester, 0)
+        self.assertRaises(ValueError, HedgedRequester, 1)
+        self.assertIsNone(self.hedger.hedge_delay)
+        self.assertEqual(1, self.hedger.call(lambda: 1))
+        self.assertIsNone(self.hedger.hedge_delay)
+
+        hedger = HedgedRequester(0.9, window_size=20, min_samples=20)
+        for i in range(20):
+            hedger.record_latency((i + 1) / 100.0)
+        self.assertEqual(0.19, hedger.hedge_delay)
+        # Only recalculated every RECALCULATE_INTERVAL latencies
+        for _ in range(RECALCULATE_INTERVAL - 1):
+            hedger.record_latency(0)
+        self.assertEqual(0.19, hedger.hedge_delay)
+        hedger.record_latency(0)
+        self.assertEqual(MIN_HEDGE_DELAY, hedger.hedge_delay)
+
+    def test_slow_request_hedged(self):
+        self._warm_up()
+        calls = []
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def func():
+            with lock:
+                calls.append(None)
+                attempt = len(calls)
+            if attempt == 1:
+                # The first attempt is stuck until the test finishes
+                release.wait(5)
+                return 'slow'
+            return 'fast'
+
+        start = time.time()
+        self.assertEqual('fast', self.hedger.call(func))
+        self.assertLess(time.time() - start, 1)
+        release.set()
+        self.assertEqual(2, len(calls))
+        self.assertEqual(1, self.metrics.get_counter('hedged_requests'))
+        self.assertEqual(1, self.metrics.get_counter('hedge_wins'))
+
+    def test_fast_request_not_hedged(self):
+        self._warm_up(1)
+        calls = []
+
+        def func():
+            calls.append(None)
+            return 'ok'
+
+        for _ in range(5):
+            self.assertEqual('ok', self.hedger.call(func))
+        self.assertEqual(5, len(calls))
+        self.assertEqual(0, self.metrics.get_counter('hedged_requests'))
+
+    def test_errors(self):
+        self._warm_up()
+
+        def fail():
+            raise ValueError('Failed')
+        self.assertRaises(ValueError, self.hedger.call, fail)
+        self.assertEqual(0, self.metrics.get_counter('hedged_requests'))
+
+        # A hedged request succeeds if either attempt does
+        calls = []
+        lock = threading.Lock()
+
+        def slow_then_fail():
+            with lock:
+                calls.append(None)
+                attempt = len(calls)
+            if attempt == 1:
+                time.sleep(0.2)
+                return 'slow'
+            raise ValueError('Failed')
+        self.assertEqual('slow', self.hedger.call(slow_then_fail))
+        self.assertEqual(1, self.metrics.get_counter('hedged_requests'))
+
+        def slow_fail():
+            time.sleep(0.05)
+            raise ValueError('Failed')
+        self.assertRaises(ValueError, self.hedger.call, slow_fail)
+
+
+if __name__ == '__main__':
+    unittest.main()
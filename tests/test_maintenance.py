@@ -0,0 +1,115 @@
+import copy
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pypianalyser.maintenance import DatabaseMaintenance, MAINTENANCE_STEPS, STEP_VACUUM, STEP_INTEGRITY_CHECK
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+
+
+class TestDatabaseMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'db.sqlite')
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        with open(os.path.join(resources_dir, 'robotframework.json'), 'r') as fp:
+            self.metadata = json.load(fp)
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _create_db(self, package_count=30, **kwargs):
+        db_helper = PyPiAnalyserSqliteHelper(self.db_path, **kwargs)
+        for i in range(package_count):
+            metadata = copy.deepcopy(self.metadata)
+            metadata['info']['name'] = 'package-{}'.format(i)
+            db_helper.commit_package_to_db(metadata)
+        db_helper.close()
+        # Leave free pages behind
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute('DELETE FROM package_releases WHERE package_id % 2 = 0')
+            conn.execute('DELETE FROM packages WHERE id % 2 = 0')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.close()
+        self.assertGreater(free_pages, 0)
+
+    def _pragma(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_run_offline(self):
+        self._create_db(enable_search_index=True)
+        # Databases created before incremental auto-vacuum was the default are switched over
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA auto_vacuum=NONE')
+        conn.execute('VACUUM')
+        conn.execute('DELETE FROM package_classifiers')
+        conn.commit()
+        conn.close()
+        self.assertEqual(0, self._pragma('PRAGMA auto_vacuum'))
+
+        maintenance = DatabaseMaintenance(self.db_path)
+        try:
+            report = maintenance.run()
+        finally:
+            maintenance.close()
+        self.assertEqual(['size_before'] + MAINTENANCE_STEPS + ['size_after'], list(report))
+        self.assertEqual([], report[STEP_INTEGRITY_CHECK]['result'])
+        self.assertGreater(report[STEP_VACUUM]['result'], 0)
+        self.assertLess(report['size_after'], report['size_before'])
+        self.assertEqual(0, self._pragma('PRAGMA freelist_count'))
+        self.assertEqual(2, self._pragma('PRAGMA auto_vacuum'))
+
+        db_helper = PyPiAnalyserSqliteHelper(self.db_path)
+        try:
+            self.assertEqual(15, len(db_helper.search_packages('robotframework', limit=100)))
+        finally:
+            db_helper.close()
+
+    def test_run_online(self):
+        self._create_db(enable_search_index=True)
+        self.assertEqual(2, self._pragma('PRAGMA auto_vacuum'))
+        db_helper = PyPiAnalyserSqliteHelper(self.db_path)
+        maintenance = DatabaseMaintenance(self.db_path, online=True, pause_seconds=0, vacuum_batch_pages=5)
+        try:
+            report = maintenance.run()
+            # The database stays usable while the maintenance connection is open
+            self.assertIsNotNone(db_helper.get_package_id('package-0'))
+        finally:
+            maintenance.close()
+            db_helper.close()
+        self.assertEqual([], report[STEP_INTEGRITY_CHECK]['result'])
+        self.assertGreater(report[STEP_VACUUM]['result'], 0)
+        self.assertEqual(0, self._pragma('PRAGMA freelist_count'))
+
+    def test_online_vacuum_needs_incremental_auto_vacuum(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE TABLE test (value TEXT)')
+        conn.executemany('INSERT INTO test VALUES (?)', [('x' * 1000,)] * 100)
+        conn.execute('DELETE FROM test')
+        conn.commit()
+        conn.close()
+
+        maintenance = DatabaseMaintenance(self.db_path, online=True)
+        try:
+            self.assertEqual(0, maintenance.vacuum())
+            self.assertGreater(self._pragma('PRAGMA freelist_count'), 0)
+            self.assertRaises(ValueError, maintenance.run, ['compact'])
+        finally:
+            maintenance.close()
+
+    def test_missing_database(self):
+        self.assertRaises(Exception, DatabaseMaintenance, os.path.join(self.temp_dir, 'missing.sqlite'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from pypianalyser.merge import merge_databases
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        self.metadata = {}
+        for name in ['robotframework', 'robotframework-remoterunner']:
+            with open(os.path.join(resources_dir, '{}.json'.format(name)), 'r') as fp:
+                self.metadata[name] = json.load(fp)
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _create_db(self, file_name, package_names, **kwargs):
+        db_path = os.path.join(self.temp_dir, file_name)
+        db_helper = PyPiAnalyserSqliteHelper(db_path, **kwargs)
+        for name in package_names:
+            db_helper.commit_package_to_db(copy.deepcopy(self.metadata[name]))
+        db_helper.close()
+        return db_path
+
+    def test_merge_shards(self):
+        # The shards share classifier strings with different IDs, and robotframework is in both
+        shard1 = self._create_db('shard1.sqlite', ['robotframework-remoterunner', 'robotframework'],
+                                 compress_descriptions=True)
+        shard2 = self._create_db('shard2.sqlite', ['robotframework'], enable_search_index=True)
+        expected = PyPiAnalyserSqliteHelper(self._create_db('expected.sqlite', ['robotframework',
+                                                                                 'robotframework-remoterunner']))
+        merged_path = os.path.join(self.temp_dir, 'merged.sqlite')
+
+        self.assertEqual(2, merge_databases(merged_path, [shard2, shard1]))
+
+        merged = PyPiAnalyserSqliteHelper(merged_path)
+        try:
+            self.assertTrue(merged.compress_descriptions)
+            self.assertTrue(merged.search_index_enabled)
+            for name in ['robotframework', 'robotframework-remoterunner']:
+                self.assertListEqual(sorted(expected.get_classifiers_for_package_name(name)),
+                                     sorted(merged.get_classifiers_for_package_name(name)))
+                self.assertEqual(expected.get_releases_for_package(name), merged.get_releases_for_package(name))
+                expected_package = expected.get_package_by_name(name)
+                merged_package = merged.get_package_by_name(name)
+                del expected_package['id'], merged_package['id']
+                self.assertDictEqual(expected_package, merged_package)
+                expected_summary = expected.get_release_summary(name)
+                merged_summary = merged.get_release_summary(name)
+                del expected_summary['package_id'], merged_summary['package_id']
+                self.assertDictEqual(expected_summary, merged_summary)
+            expected.update_rollups()
+            self.assertEqual(expected.get_classifier_counts(), merged.get_classifier_counts())
+            self.assertEqual('robotframework-remoterunner', merged.search_packages('remoterunner')[0]['name'])
+        finally:
+            merged.close()
+            expected.close()
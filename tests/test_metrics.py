@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from pypianalyser.metrics import Metrics, MetricsReporter
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.test_obj = Metrics(latency_buckets=(0.1, 1.0))
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_shards_are_merged(self):
+        def record():
+            for _ in range(1000):
+                self.test_obj.increment('packages_processed')
+                self.test_obj.observe('fetch_seconds', 0.05)
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        snapshot = self.test_obj.snapshot()
+        self.assertEqual(4000, snapshot['counters'][('packages_processed', ())])
+        self.assertEqual([4000, 0, 0], snapshot['histograms'][('fetch_seconds', ())][0])
+        self.assertEqual(4000, self.test_obj.get_counter('packages_processed'))
+
+    def test_estimate_quantile(self):
+        for value in [0.05] * 98 + [0.5, 5.0]:
+            self.test_obj.observe('fetch_seconds', value)
+        histogram = self.test_obj.snapshot()['histograms'][('fetch_seconds', ())]
+        self.assertEqual(0.1, self.test_obj.estimate_quantile(histogram, 0.5))
+        self.assertEqual(1.0, self.test_obj.estimate_quantile(histogram, 0.99))
+        self.assertEqual(float('inf'), self.test_obj.estimate_quantile(histogram, 1.0))
+
+    def test_to_prometheus(self):
+        self.test_obj.increment('errors', labels={'type': 'Exception404'})
+        self.test_obj.set_gauge('db_queue_depth', 7)
+        self.test_obj.observe('fetch_seconds', 0.5)
+        text = self.test_obj.to_prometheus()
+        self.assertIn('# TYPE pypianalyser_errors_total counter\npypianalyser_errors_total{type="Exception404"} 1\n',
+                      text)
+        self.assertIn('pypianalyser_db_queue_depth 7\n', text)
+        self.assertIn('pypianalyser_fetch_seconds_bucket{le="0.1"} 0\n', text)
+        self.assertIn('pypianalyser_fetch_seconds_bucket{le="1.0"} 1\n', text)
+        self.assertIn('pypianalyser_fetch_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('pypianalyser_fetch_seconds_count 1\n', text)
+
+    def test_reporter_writes_prometheus_file(self):
+        file_path = os.path.join(self.temp_dir, 'metrics.prom')
+        reporter = MetricsReporter(self.test_obj, interval=60, prometheus_file=file_path, log_metrics=False,
+                                   samplers=[lambda: self.test_obj.set_gauge('db_queue_depth', 3)])
+        reporter.start()
+        reporter.stop()
+        with open(file_path, 'r') as fp:
+            self.assertIn('pypianalyser_db_queue_depth 3', fp.read())
+        self.assertListEqual(['metrics.prom'], os.listdir(self.temp_dir))
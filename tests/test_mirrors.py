@@ -0,0 +1,99 @@
+import random
+import unittest
+from pypianalyser.exceptions import Exception404
+from pypianalyser.metrics import Metrics
+from pypianalyser.mirrors import Mirror, MirrorPool
+
+
+class TestMirrorPool(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.pool = MirrorPool(['https://a.example/', 'https://b.example/', 'https://a.example/'], max_failures=2,
+                               cooldown_seconds=60, metrics=self.metrics, rng=random.Random(0))
+        self.mirror_a, self.mirror_b = self.pool.mirrors
+
+    def test_init(self):
+        self.assertEqual(['https://a.example/', 'https://b.example/'], [x.url for x in self.pool.mirrors])
+        self.assertEqual('https://a.example/pypi/{}/json', self.mirror_a.metadata_url_format)
+        self.assertRaises(ValueError, MirrorPool, [])
+
+    def test_mirror_url_without_trailing_slash(self):
+        # The last segment of the path is kept whether or not the URL ends with a /
+        self.assertEqual('https://c.example/pypi-mirror/pypi/{}/json',
+                         Mirror('https://c.example/pypi-mirror').metadata_url_format)
+        self.assertEqual('https://c.example/pypi-mirror/pypi/{}/json',
+                         Mirror('https://c.example/pypi-mirror/').metadata_url_format)
+
+    def test_choose_weighted_by_latency_and_errors(self):
+        self.pool.record_success(self.mirror_a, 0.1)
+        self.pool.record_success(self.mirror_b, 0.2)
+        chosen = [self.pool.choose() for _ in range(1000)]
+        self.assertGreater(chosen.count(self.mirror_a), 600)
+        self.assertGreater(chosen.count(self.mirror_b), 0)
+
+        # Errors outweigh the latency advantage
+        self.pool.record_failure(self.mirror_a)
+        chosen = [self.pool.choose() for _ in range(1000)]
+        self.assertLess(chosen.count(self.mirror_a), 500)
+
+        self.assertIs(self.mirror_b, self.pool.choose(exclude=[self.mirror_a]))
+        self.assertIsNone(self.pool.choose(exclude=[self.mirror_a, self.mirror_b]))
+
+    def test_cooldown(self):
+        self.pool.record_failure(self.mirror_a)
+        self.pool.record_failure(self.mirror_a)
+        self.assertFalse(self.mirror_a.is_available(0 + self.mirror_a.unavailable_until - 1))
+        self.assertTrue(all(self.pool.choose() is self.mirror_b for _ in range(100)))
+        # Still used when nothing else is left
+        self.assertIs(self.mirror_a, self.pool.choose(exclude=[self.mirror_b]))
+
+        self.pool.record_success(self.mirror_a, 0.1)
+        self.assertEqual(0, self.mirror_a.consecutive_failures)
+        self.assertEqual(0, self.mirror_a.unavailable_until)
+
+    def test_request_fails_over(self):
+        def func(mirror):
+            if mirror is self.mirror_a:
+                raise Exception('Connection reset')
+            return mirror.url
+
+        for _ in range(200):
+            self.assertEqual('https://b.example/', self.pool.request(func))
+        self.assertEqual(0, self.metrics.get_counter('mirror_requests', {'mirror': 'https://b.example/',
+                                                                            'result': 'error'}))
+        self.assertEqual(200, self.metrics.get_counter('mirror_requests', {'mirror': 'https://b.example/',
+                                                                            'result': 'ok'}))
+        # Out of rotation after two failures, so it isn't tried again
+        self.assertEqual(2, self.metrics.get_counter('mirror_requests', {'mirror': 'https://a.example/',
+                                                                            'result': 'error'}))
+        self.assertEqual(2, self.metrics.get_counter('mirror_failovers'))
+
+    def test_request_errors(self):
+        def fail(mirror):
+            raise Exception('Error on {}'.format(mirror.url))
+        self.assertRaisesRegexp(Exception, 'Error on', self.pool.request, fail)
+
+        def not_found(mirror):
+            raise Exception404(mirror.url)
+        self.assertRaises(Exception404, self.pool.request, not_found)
+
+        # A package missing from a partial mirror is found on another
+        def partial(mirror):
+            if mirror is self.mirror_a:
+                raise Exception404(mirror.url)
+            return 'found'
+        for _ in range(5):
+            self.assertEqual('found', self.pool.request(partial))
+
+        # A 404 with an error elsewhere isn't reported as not found
+        def mixed(mirror):
+            if mirror is self.mirror_a:
+                raise Exception404(mirror.url)
+            raise ValueError('Timed out')
+        for _ in range(5):
+            self.assertRaises(ValueError, self.pool.request, mixed)
+
+
+if __name__ == '__main__':
+    unittest.main()
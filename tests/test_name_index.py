@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from pypianalyser.name_index import NameIndex, load_name_index
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+
+
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.temp_dir, 'test.names')
+        self.names = ['robotframework', 'robotframework-remoterunner', 'robotframework-seleniumlibrary', 'requests',
+                      'requests-oauthlib', 'six', u'caf\xe9', 'a', 'zope.interface'] + \
+                     ['package-{}'.format(i) for i in range(100)]
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_membership(self):
+        for bloom_bits_per_name in [10, 0]:
+            self.assertEqual(len(self.names), NameIndex.build(self.index_path, self.names + ['six'], block_size=4,
+                                                              bloom_bits_per_name=bloom_bits_per_name))
+            with NameIndex(self.index_path) as index:
+                self.assertEqual(len(self.names), len(index))
+                for name in self.names:
+                    self.assertIn(name, index)
+                for name in ['', 'robot', 'robotframework-', 'requests-oauthlib2', 'zzz', 'package-100', 'cafe']:
+                    self.assertNotIn(name, index)
+                self.assertEqual(sorted(self.names, key=lambda x: x.encode('utf-8')), list(index))
+
+    def test_empty(self):
+        NameIndex.build(self.index_path, [])
+        with NameIndex(self.index_path) as index:
+            self.assertEqual(0, len(index))
+            self.assertNotIn('six', index)
+            self.assertEqual([], list(index))
+
+    def test_not_an_index(self):
+        with open(self.index_path, 'wb') as fp:
+            fp.write(b'six\nrequests\n' * 10)
+        self.assertRaises(ValueError, NameIndex, self.index_path)
+
+    def test_load_name_index(self):
+        loads = []
+
+        def load_names():
+            loads.append(1)
+            return self.names
+
+        with load_name_index(self.index_path, (1, 2), load_names) as index:
+            self.assertIn('six', index)
+        with load_name_index(self.index_path, (1, 2), load_names) as index:
+            self.assertEqual((1, 2), index.stamp)
+        self.assertEqual(1, len(loads))
+        self.names.append('pytest')
+        with load_name_index(self.index_path, (2, 3), load_names) as index:
+            self.assertIn('pytest', index)
+        self.assertEqual(2, len(loads))
+
+    def test_load_name_index_added_names(self):
+        NameIndex.build(self.index_path, self.names, (1, 2))
+        stamps = []
+
+        def load_added_names(index_stamp):
+            stamps.append(index_stamp)
+            return ['pytest', 'six'] if index_stamp == (1, 2) else None
+
+        def load_names():
+            raise AssertionError('The index should only have the added names loaded')
+
+        with load_name_index(self.index_path, (3, 4), load_names, load_added_names) as index:
+            self.assertEqual(len(self.names) + 1, len(index))
+            self.assertIn('pytest', index)
+            self.assertIn('zope.interface', index)
+            self.assertEqual((3, 4), index.stamp)
+        # Rebuilt in full when the source has changed in some other way
+        with load_name_index(self.index_path, (5, 6), lambda: ['six'], load_added_names) as index:
+            self.assertEqual(['six'], list(index))
+        self.assertListEqual([(1, 2), (3, 4)], stamps)
+
+    def test_database_name_index(self):
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        db_helper = PyPiAnalyserSqliteHelper(os.path.join(self.temp_dir, 'test.sqlite'))
+        try:
+            for i, name in enumerate(['robotframework', 'robotframework-remoterunner']):
+                with open(os.path.join(resources_dir, '{}.json'.format(name)), 'r') as fp:
+                    db_helper.commit_package_to_db(json.load(fp))
+                # Brought up to date once a package has been added. Only the first index is built from every package,
+                # the new packages are added to it after that
+                side_effect = AssertionError if i else None
+                with patch.object(db_helper, 'iter_package_names', side_effect=side_effect,
+                                  wraps=db_helper.iter_package_names):
+                    with db_helper.open_name_index() as index:
+                        self.assertIn(name, index)
+            with db_helper.open_name_index() as index:
+                self.assertEqual(['robotframework', 'robotframework-remoterunner'], list(index))
+            self.assertTrue(os.path.exists(os.path.join(self.temp_dir, 'test.sqlite.names')))
+        finally:
+            db_helper.close()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pypianalyser.package_filter import PackageFilter, PrefixTrie, ACTION_INCLUDE, ACTION_EXCLUDE, RULE_PREFIX, \
+    RULE_GLOB, RULE_REGEX
+
+
+class TestPackageFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.names = ['robotframework', 'robotframework-seleniumlibrary', 'robotframework-test', 'django',
+                      'django-rest-framework', 'pytest', 'pytest-django', 'requests', 'six']
+
+    def test_prefix_trie(self):
+        trie = PrefixTrie(['robot', 'py', 'pytest'])
+        self.assertEqual(3, trie.size)
+        self.assertTrue(trie.matches('robotframework'))
+        self.assertTrue(trie.matches('py'))
+        self.assertFalse(trie.matches('p'))
+        self.assertFalse(trie.matches('requests'))
+        self.assertTrue(PrefixTrie(['']).matches('anything'))
+
+    def test_no_rules_selects_everything(self):
+        self.assertListEqual(self.names, list(PackageFilter().filter(self.names)))
+
+    def test_include_rules(self):
+        package_filter = PackageFilter()
+        package_filter.add_rule(ACTION_INCLUDE, RULE_PREFIX, 'robotframework-')
+        package_filter.add_rule(ACTION_INCLUDE, RULE_GLOB, '*-django')
+        package_filter.add_rule(ACTION_INCLUDE, RULE_REGEX, '^six$')
+        self.assertListEqual(['robotframework-seleniumlibrary', 'robotframework-test', 'pytest-django', 'six'],
+                             list(package_filter.filter(self.names)))
+
+    def test_exclude_rules(self):
+        package_filter = PackageFilter()
+        package_filter.add_rule(ACTION_EXCLUDE, RULE_REGEX, '-test$')
+        package_filter.add_rule(ACTION_EXCLUDE, RULE_GLOB, 'django*')
+        package_filter.add_rule(ACTION_EXCLUDE, RULE_PREFIX, 'py')
+        self.assertListEqual(['robotframework', 'robotframework-seleniumlibrary', 'requests', 'six'],
+                             list(package_filter.filter(self.names)))
+
+    def test_from_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(temp_dir, 'filter.txt')
+            with open(file_path, 'w') as fp:
+                fp.write('# Team rules\ninclude prefix robotframework\n\ninclude glob pytest*\n'
+                         'exclude regex -(test|django)$\n')
+            package_filter = PackageFilter.from_file(file_path)
+            self.assertListEqual(['robotframework', 'robotframework-seleniumlibrary', 'pytest'],
+                                 list(package_filter.filter(self.names)))
+
+            with open(file_path, 'w') as fp:
+                fp.write('include regex (unclosed\n')
+            self.assertRaises(ValueError, PackageFilter.from_file, file_path)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_invalid_rule(self):
+        self.assertRaises(ValueError, PackageFilter().add_rule, 'maybe', RULE_PREFIX, 'a')
+        self.assertRaises(ValueError, PackageFilter().add_rule, ACTION_INCLUDE, 'suffix', 'a')
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from pypianalyser.profiling import create_profiler, tracemalloc
+
+
+def _busy_thread_target(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        sum(range(100))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.temp_dir, 'profile.out')
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _run_thread(self, duration=0.05):
+        t = threading.Thread(target=_busy_thread_target, args=(duration,))
+        t.start()
+        t.join()
+
+    def test_cpu_profiler_includes_threads(self):
+        profiler = create_profiler('cpu', self.output_path)
+        profiler.start()
+        self._run_thread()
+        stats = profiler.stop()
+        self.assertTrue(os.path.exists(self.output_path))
+        self.assertIn('_busy_thread_target', [x[2] for x in stats.stats])
+
+    def test_sampling_profiler_writes_collapsed_stacks(self):
+        profiler = create_profiler('sample', self.output_path)
+        profiler.start()
+        self._run_thread(0.2)
+        profiler.stop()
+        with open(self.output_path, 'r') as fp:
+            lines = fp.read().splitlines()
+        self.assertTrue(any('_busy_thread_target' in x for x in lines))
+        self.assertTrue(all(x.rsplit(' ', 1)[1].isdigit() for x in lines))
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_memory_profiler_writes_report(self):
+        profiler = create_profiler('memory', self.output_path)
+        profiler.start()
+        data = [str(x) * 10 for x in range(10000)]
+        profiler.stop()
+        with open(self.output_path, 'r') as fp:
+            self.assertIn('test_profiling.py', fp.read())
+        del data
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, create_profiler, 'gpu', self.output_path)
@@ -0,0 +1,42 @@
+import unittest
+from pypianalyser.metrics import Metrics
+from pypianalyser.progress import ProgressReporter, STARTED_COUNTER, FINISHED_COUNTER
+
+
+class TestProgressReporter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.metrics = Metrics()
+        self.test_obj = ProgressReporter(self.metrics, total=100, rate_window=10, clock=lambda: self.now)
+
+    def _process(self, started, finished):
+        self.metrics.increment(STARTED_COUNTER, started)
+        self.metrics.increment(FINISHED_COUNTER, finished)
+
+    def test_sample(self):
+        self._process(12, 10)
+        self.now += 5
+        progress = self.test_obj.sample()
+        self.assertEqual(10, progress['finished'])
+        self.assertEqual(2, progress['in_flight'])
+        self.assertEqual(2.0, progress['rate'])
+        self.assertEqual(45.0, progress['eta_seconds'])
+
+    def test_rate_is_rolling(self):
+        self._process(10, 10)
+        self.now += 10
+        self.test_obj.sample()
+        # Slow down to 1 package/sec, the initial burst drops out of the window
+        for _ in range(3):
+            self._process(10, 10)
+            self.now += 10
+            progress = self.test_obj.sample()
+        self.assertEqual(1.0, progress['rate'])
+        self.assertEqual(60.0, progress['eta_seconds'])
+
+    def test_no_progress_has_no_eta(self):
+        self.now += 5
+        progress = self.test_obj.sample()
+        self.assertEqual(0.0, progress['rate'])
+        self.assertIsNone(progress['eta_seconds'])
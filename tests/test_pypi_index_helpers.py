@@ -4,6 +4,7 @@ import unittest
 from mock import MagicMock, patch
 from pypianalyser.pypi_index_helpers import get_package_list, get_metadata_for_package
 from pypianalyser.exceptions import Exception404
+from pypianalyser.metrics import Metrics
 
 
 class TestPyPiIndexHelpers(unittest.TestCase):
@@ -20,32 +21,47 @@ class TestPyPiIndexHelpers(unittest.TestCase):
         mock_response.content = self.mock_metadata_blob
         mock_response.status_code = 200
 
-        with patch('pypianalyser.pypi_index_helpers.requests.get', return_value=mock_response):
+        with patch('requests.get', return_value=mock_response):
             result = get_metadata_for_package('pack1')
             self.assertIn('info', result)
             self.assertIn('releases', result)
 
+    def test_get_metadata_for_package_records_metrics(self):
+        mock_response = MagicMock()
+        mock_response.content = self.mock_metadata_blob
+        mock_response.status_code = 200
+        metrics = Metrics()
+
+        with patch('requests.get', return_value=mock_response):
+            get_metadata_for_package('pack1', metrics=metrics)
+        snapshot = metrics.snapshot()
+        self.assertEqual(len(self.mock_metadata_blob), snapshot['counters'][('bytes_downloaded', ())])
+        self.assertEqual(1, snapshot['counters'][('http_responses', (('status', 200),))])
+        self.assertEqual(1, snapshot['histograms'][('fetch_seconds', ())][2])
+        self.assertEqual(1, snapshot['histograms'][('parse_seconds', ())][2])
+
     def test_get_metadata_for_package_404(self):
         mock_response = MagicMock()
         mock_response.status_code = 404
 
-        with patch('pypianalyser.pypi_index_helpers.requests.get', return_value=mock_response):
+        with patch('requests.get', return_value=mock_response):
             self.assertRaises(Exception404, get_metadata_for_package, 'pack1')
 
     def test_get_metadata_for_package_other_http_code(self):
         mock_response = MagicMock()
         mock_response.status_code = 500
 
-        with patch('pypianalyser.pypi_index_helpers.requests.get', return_value=mock_response):
+        with patch('requests.get', return_value=mock_response):
             self.assertRaisesRegexp(Exception, 'HTTP Error: 500 on https://pypi.org/pypi/pack1/json',
                                     get_metadata_for_package, 'pack1')
 
     def test_get_package_list(self):
         mock_response = MagicMock()
+        mock_response.status_code = 200
         mock_response.content = self.mock_simple_index
         expected_result = ['pack-a', 'pack-b', 'pack-c', 'pack-d', 'pack-e']
 
-        with patch('pypianalyser.pypi_index_helpers.requests.get', return_value=mock_response):
+        with patch('requests.get', return_value=mock_response):
             actual_result = get_package_list()
             self.assertListEqual(expected_result, actual_result)
 
@@ -3,8 +3,12 @@ import tempfile
 import unittest
 from mock import MagicMock, patch
 import shutil
+import threading
+from six.moves import queue
 from pypianalyser.pypi_metadata_retriever import PyPiMetadataRetriever
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
 from pypianalyser.exceptions import Exception404
+from pypianalyser.name_index import NameIndex
 
 
 class TestPyPiMetadataRetriever(unittest.TestCase):
@@ -22,18 +26,34 @@ class TestPyPiMetadataRetriever(unittest.TestCase):
         test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path,
                                          max_packages=2,
                                          package_regex='^(aaa-.*)|(ccc-.*)',
-                                         file_404='404.txt')
+                                         file_404=os.path.join(self.temp_dir, '404.txt'))
 
         list_from_pypi = ['aaa-123', 'aaa-456', 'aaa-789', 'bbb-123', 'bbb-456', 'bbb-789', 'ccc-123', 'ccc-456',
                           'ccc-789']
-        list_404 = ['aaa-456']
+        with open(os.path.join(self.temp_dir, '404.txt'), 'w') as fp:
+            fp.write('aaa-456\n')
+        db_names_path = os.path.join(self.temp_dir, 'db.sqlite.names')
+        NameIndex.build(db_names_path, ['ccc-456', 'ccc-789'])
         mock_db = MagicMock()
-        mock_db.get_package_names.return_value = ['ccc-456', 'ccc-789']
+        mock_db.open_name_index.return_value = NameIndex(db_names_path)
         with patch('pypianalyser.pypi_metadata_retriever.get_package_list', return_value=list_from_pypi), \
-             patch('pypianalyser.pypi_metadata_retriever.read_file_lines_into_list', return_value=list_404), \
              patch('pypianalyser.pypi_metadata_retriever.PyPiAnalyserSqliteHelper', return_value=mock_db):
             actual_result = test_obj.calculate_package_list()
         self.assertListEqual(expected_result, actual_result)
+        # The 404 file is indexed for the next run
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, '404.txt.names')))
+
+    def test_calculate_package_list_shards(self):
+        list_from_pypi = ['package-{}'.format(i) for i in range(50)]
+        shard_lists = []
+        for shard_index in range(3):
+            test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path, max_packages=None,
+                                             file_404=os.path.join(self.temp_dir, '404.txt'), shard=(shard_index, 3))
+            with patch('pypianalyser.pypi_metadata_retriever.get_package_list', return_value=list_from_pypi), \
+                 patch('pypianalyser.pypi_metadata_retriever.PyPiAnalyserSqliteHelper', return_value=MagicMock()):
+                shard_lists.append(test_obj.calculate_package_list())
+        self.assertTrue(all(shard_lists))
+        self.assertListEqual(sorted(list_from_pypi), sorted(sum(shard_lists, [])))
 
     def test_truncate_description(self):
         test_obj = PyPiMetadataRetriever(trunc_description=10,
@@ -61,21 +81,39 @@ class TestPyPiMetadataRetriever(unittest.TestCase):
         self.assertEqual(2, len(input_metadata['releases']))
         self.assertListEqual(['2.1.0', '1.5.2'], list(input_metadata['releases'].keys()))
 
-    def test_truncate_releases_fallback(self):
-        test_obj = PyPiMetadataRetriever(trunc_releases=1,
+    def test_prepare_metadata_summarises_all_releases(self):
+        test_obj = PyPiMetadataRetriever(trunc_releases=1, db_path=self.temp_db_path)
+        metadata = {
+            'info': {'description': None, 'summary': None},
+            'releases': {
+                '1.0': [{'upload_time': '2019-01-01T00:00:00', 'size': 10, 'packagetype': 'sdist'}],
+                '1.10': [{'upload_time': '2020-01-01T00:00:00', 'size': 20, 'packagetype': 'bdist_wheel'}],
+                '1.9': [],
+            }
+        }
+        test_obj._prepare_metadata(metadata)
+        self.assertListEqual(['1.10'], list(metadata['releases'].keys()))
+        summary = metadata['release_summary']
+        self.assertEqual('1.10', summary['latest_version'])
+        self.assertEqual(2, summary['release_count'])
+        self.assertEqual(30, summary['total_size'])
+        self.assertEqual('2019-01-01T00:00:00', summary['first_upload_time'])
+        self.assertTrue(summary['has_wheel'])
+
+    def test_truncate_releases_pre_releases_and_invalid_versions(self):
+        test_obj = PyPiMetadataRetriever(trunc_releases=3,
                                          db_path=self.temp_db_path)
         input_metadata = \
             {'releases':
                 {
-                    '1.0.1': [{'upload_time': '2016-02-19T13:08:33'}],
-                    '2.1.0': {},
-                    '2.2.1dev': [{'upload_time': '2018-02-19T13:08:33'}],
+                    'latest': {},
+                    '2.0rc1': {},
+                    '1.0.1': {},
+                    '2.0': {},
                 }
             }
-        with patch('pypianalyser.pypi_metadata_retriever.LooseVersion', side_effect=TypeError):
-            test_obj._truncate_releases(input_metadata)
-        self.assertEqual(1, len(input_metadata['releases']))
-        self.assertListEqual(['2.2.1dev'], list(input_metadata['releases'].keys()))
+        test_obj._truncate_releases(input_metadata)
+        self.assertListEqual(['2.0', '2.0rc1', '1.0.1'], list(input_metadata['releases'].keys()))
 
     def test_run_single_thread_override(self):
         test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path)
@@ -105,6 +143,21 @@ class TestPyPiMetadataRetriever(unittest.TestCase):
             test_obj._threaded_process(['a'])
             mock_r404.assert_called_once_with('a')
 
+    def test_download_metadata_fails_over_to_mirror(self):
+        test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path, index_url='https://a.example/',
+                                         mirror_urls=['https://b.example/'])
+
+        def get_metadata(package_name, url_format, metrics, timeout):
+            if url_format.startswith('https://a.example/'):
+                raise Exception('HTTP Error: 503 on {}'.format(url_format.format(package_name)))
+            return {'info': {'name': package_name}}
+
+        with patch('pypianalyser.pypi_metadata_retriever.get_metadata_for_package', side_effect=get_metadata):
+            for _ in range(10):
+                self.assertEqual({'info': {'name': 'a'}}, test_obj._download_metadata('a'))
+        self.assertEqual(10, test_obj.metrics.get_counter('mirror_requests', {'mirror': 'https://b.example/',
+                                                                                 'result': 'ok'}))
+
     def test_test_threaded_process_commit_to_db(self):
         test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path)
         mock_metadata = {'info': {
@@ -117,3 +170,75 @@ class TestPyPiMetadataRetriever(unittest.TestCase):
             test_obj._open_db()
             test_obj._threaded_process(['a'])
             mock_db.commit_package_to_db.assert_called_once_with(mock_metadata)
+
+    def test_threaded_process_hands_packages_to_writer(self):
+        test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path, max_queued_packages=1)
+        mock_db = MagicMock()
+        with patch('pypianalyser.pypi_metadata_retriever.get_metadata_for_package',
+                   side_effect=lambda *args: {'info': {'name': args[0]}}),\
+             patch('pypianalyser.pypi_metadata_retriever.PyPiAnalyserSqliteHelper', return_value=mock_db):
+            test_obj._open_db()
+            test_obj._start_writer()
+            test_obj._threaded_process(['a', 'b', 'c'])
+            test_obj._stop_writer()
+        self.assertListEqual(['a', 'b', 'c'],
+                             [x[0][0]['info']['name'] for x in mock_db.commit_package_to_db.call_args_list])
+        self.assertEqual(3, test_obj.metrics.get_counter('packages_finished'))
+
+    def _serve_resources(self, package_name, *args):
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        with open(os.path.join(resources_dir, '{}.json'.format(package_name)), 'rb') as fp:
+            return fp.read()
+
+    def test_rebuild_from_archive(self):
+        archive_dir = os.path.join(self.temp_dir, 'archive')
+        package_names = ['robotframework', 'robotframework-remoterunner']
+        test_obj = PyPiMetadataRetriever(-1, -1, db_path=self.temp_db_path, archive_dir=archive_dir,
+                                         progress_interval=0)
+        test_obj.package_list = package_names
+        with patch('pypianalyser.pypi_metadata_retriever.download_metadata_for_package',
+                   side_effect=self._serve_resources):
+            test_obj.run()
+        self.assertEqual(2, test_obj.metrics.get_counter('archived_responses', {'result': 'new'}))
+
+        rebuilt_db_path = os.path.join(self.temp_dir, 'rebuilt.sqlite')
+        rebuilt_obj = PyPiMetadataRetriever(10, 1, thread_count=2, db_path=rebuilt_db_path, archive_dir=archive_dir,
+                                            progress_interval=0)
+        rebuilt_obj.rebuild()
+        self.assertEqual(2, rebuilt_obj.metrics.get_counter('packages_processed'))
+        db = PyPiAnalyserSqliteHelper(rebuilt_db_path)
+        try:
+            self.assertListEqual(package_names, db.get_package_names())
+            self.assertEqual(10, len(db.get_package_by_name('robotframework')['description']))
+            self.assertEqual(1, len(db.get_releases_for_package('robotframework')))
+        finally:
+            db.close()
+        # Rebuilding never overwrites an existing database
+        self.assertRaises(Exception, rebuilt_obj.rebuild)
+
+        # Rebuilding in process doesn't set up another retriever, and the request pool that comes with it
+        in_process_obj = PyPiMetadataRetriever(10, 1, db_path=os.path.join(self.temp_dir, 'in-process.sqlite'),
+                                               archive_dir=archive_dir, progress_interval=0)
+        with patch('pypianalyser.pypi_metadata_retriever.HedgedRequester') as mock_hedger:
+            in_process_obj.rebuild()
+        mock_hedger.assert_not_called()
+        self.assertEqual(2, in_process_obj.metrics.get_counter('packages_processed'))
+
+    def test_remove_unused_fields(self):
+        metadata = {'info': {'name': 'a', 'classifiers': [], 'downloads': {}},
+                    'releases': {'1.0': [{'filename': 'a-1.0.tar.gz', 'digests': {'sha256': 'abc'}}]},
+                    'urls': [{'filename': 'a-1.0.tar.gz'}]}
+        PyPiMetadataRetriever._remove_unused_fields(metadata)
+        self.assertDictEqual({'info': {'name': 'a', 'classifiers': []},
+                              'releases': {'1.0': [{'filename': 'a-1.0.tar.gz'}]}}, metadata)
+
+    def test_wait_for_memory_pauses_until_writes_catch_up(self):
+        test_obj = PyPiMetadataRetriever(db_path=self.temp_db_path, max_memory_mb=1)
+        test_obj._write_queue = queue.Queue()
+        test_obj._write_queue.put({})
+        timer = threading.Timer(0.1, test_obj._write_queue.get)
+        timer.start()
+        test_obj._wait_for_memory()
+        timer.join()
+        self.assertTrue(test_obj._write_queue.empty())
+        self.assertEqual(1, test_obj.metrics.get_counter('memory_pauses'))
@@ -1,7 +1,11 @@
 import unittest
 import os
 import json
-from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+from mock import patch
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper, PackageReleaseRow, REFRESH_ADDED, \
+    REFRESH_UPDATED, REFRESH_UNCHANGED
+from pypianalyser.sql_queries import UPDATE_PACKAGE_LAST_FETCHED_SQL
+from pypianalyser.compression import DEFAULT_CODEC, CODEC_ZSTD, ZLIB_DICTIONARY_SUPPORTED
 
 
 class PyPiAnalyserSqliteHelperTests(unittest.TestCase):
@@ -162,3 +166,190 @@ class PyPiAnalyserSqliteHelperTests(unittest.TestCase):
             "size": 647126
             }
         self.assertDictContainsSubset(expected_release_file2, actual_release_file2)
+
+    def test_iter_package_names(self):
+        actual_value = sorted(self.test_obj.iter_package_names(batch_size=1))
+        self.assertListEqual(['robotframework', 'robotframework-remoterunner'], actual_value)
+
+    def test_iter_releases_namedtuple(self):
+        rows = list(self.test_obj.iter_releases('robotframework', batch_size=3, row_type='namedtuple'))
+        self.assertEqual(sum(len(x) for x in self.input_1['releases'].values()), len(rows))
+        self.assertIsInstance(rows[0], PackageReleaseRow)
+        self.assertIn('3.2b2', [x.version for x in rows])
+
+    def test_iter_releases_all_packages(self):
+        expected_count = sum(len(x) for x in self.input_1['releases'].values()) + \
+            sum(len(x) for x in self.input_2['releases'].values())
+        rows = list(self.test_obj.iter_releases(row_type='tuple'))
+        self.assertEqual(expected_count, len(rows))
+
+    def test_iter_packages_unknown_row_type(self):
+        self.assertRaises(ValueError, self.test_obj.iter_packages, row_type='xml')
+
+    def test_search_packages(self):
+        # Re-open with the search index enabled so that it's built from the existing packages
+        self.test_obj.close()
+        self.test_obj = PyPiAnalyserSqliteHelper(self.db_name, enable_search_index=True)
+        results = self.test_obj.search_packages('robotic process automation')
+        self.assertListEqual(['robotframework'], [x['name'] for x in results])
+
+        results = self.test_obj.search_packages('robotframework-remoterunner')
+        self.assertEqual('robotframework-remoterunner', results[0]['name'])
+
+    def test_search_packages_skipped_insert(self):
+        self.test_obj.close()
+        self.test_obj = PyPiAnalyserSqliteHelper(self.db_name, enable_search_index=True)
+        # The package is already stored, so the insert is skipped and the search entry must be left alone
+        with open(os.path.join(self.resources_dir, 'robotframework.json'), 'r') as fp:
+            duplicate = json.load(fp)
+        duplicate['info']['description'] = 'zeppelinmarker'
+        self.test_obj.commit_package_to_db(duplicate)
+        self.assertListEqual([], self.test_obj.search_packages('zeppelinmarker'))
+        results = self.test_obj.search_packages('robotic process automation')
+        self.assertListEqual(['robotframework'], [x['name'] for x in results])
+
+    def test_search_packages_no_index(self):
+        self.assertRaises(Exception, self.test_obj.search_packages, 'automation')
+
+    def test_update_rollups(self):
+        self.test_obj.update_rollups()
+        self.assertEqual(2, self.test_obj.get_classifier_counts()['Operating System :: OS Independent'])
+        self.assertEqual(1, self.test_obj.get_license_counts()['Apache License 2.0'])
+        self.assertEqual(2, self.test_obj.get_requires_python_counts()[''])
+        expected_uploads = sum(len(x) for x in self.input_1['releases'].values()) + \
+            sum(len(x) for x in self.input_2['releases'].values())
+        self.assertEqual(expected_uploads, sum(self.test_obj.get_monthly_upload_counts().values()))
+
+    def test_update_rollups_incremental(self):
+        self.test_obj.update_rollups()
+        with open(os.path.join(self.resources_dir, 'robotframework-remoterunner.json'), 'r') as fp:
+            new_package = json.load(fp)
+        new_package['info']['name'] = 'robotframework-remoterunner2'
+        new_package['info']['classifiers'] = ['Operating System :: OS Independent']
+        self.test_obj.commit_package_to_db(new_package)
+        self.test_obj.update_rollups()
+        incremental = (self.test_obj.get_classifier_counts(), self.test_obj.get_license_counts(),
+                       self.test_obj.get_requires_python_counts(), self.test_obj.get_monthly_upload_counts())
+        self.assertEqual(3, incremental[0]['Operating System :: OS Independent'])
+        self.assertEqual(1, incremental[0]['License :: OSI Approved :: MIT License'])
+
+        self.test_obj.update_rollups(full_rebuild=True)
+        rebuilt = (self.test_obj.get_classifier_counts(), self.test_obj.get_license_counts(),
+                   self.test_obj.get_requires_python_counts(), self.test_obj.get_monthly_upload_counts())
+        self.assertEqual(rebuilt, incremental)
+
+    def _load_remoterunner(self):
+        # Committing modifies the metadata, so each refresh needs a fresh copy
+        with open(os.path.join(self.resources_dir, 'robotframework-remoterunner.json'), 'r') as fp:
+            return json.load(fp)
+
+    def test_refresh_package_unchanged(self):
+        # The first refresh of a package committed without a hash rewrites it and records the hash
+        self.assertEqual(REFRESH_UPDATED, self.test_obj.refresh_package(self._load_remoterunner()))
+        with patch.object(self.test_obj, '_execute_write', wraps=self.test_obj._execute_write) as mock_write:
+            self.assertEqual(REFRESH_UNCHANGED, self.test_obj.refresh_package(self._load_remoterunner()))
+        self.assertEqual([UPDATE_PACKAGE_LAST_FETCHED_SQL], [x[0][0] for x in mock_write.call_args_list])
+        self.assertListEqual(list(self.input_2['releases']),
+                             list(self.test_obj.get_releases_for_package('robotframework-remoterunner')))
+        self.assertEqual(len(self._load_remoterunner()['info']['classifiers']),
+                         len(self.test_obj.get_classifiers_for_package_name('robotframework-remoterunner')))
+
+    def test_refresh_package_changed(self):
+        self.test_obj.refresh_package(self._load_remoterunner())
+        package = self._load_remoterunner()
+        package['info']['summary'] = 'New summary'
+        package['info']['classifiers'] = package['info']['classifiers'][1:] + ['Topic :: Software Development']
+        package['releases']['1.0.1'][0]['size'] = 1
+        package['releases']['1.0.2'] = [dict(package['releases']['1.0.1'][0], filename='remoterunner-1.0.2.tar.gz')]
+        expected_classifiers = sorted(package['info']['classifiers'])
+        self.assertEqual(REFRESH_UPDATED, self.test_obj.refresh_package(package))
+
+        self.assertEqual('New summary', self.test_obj.get_package_by_name('robotframework-remoterunner')['summary'])
+        self.assertListEqual(expected_classifiers,
+                             sorted(self.test_obj.get_classifiers_for_package_name('robotframework-remoterunner')))
+        releases = self.test_obj.get_releases_for_package('robotframework-remoterunner')
+        self.assertListEqual(['1.0.1', '1.0.2'], sorted(releases))
+        self.assertEqual(1, releases['1.0.1'][0]['size'])
+        self.assertEqual(len(self.input_2['releases']['1.0.1']), len(releases['1.0.1']))
+
+        # Removed releases are deleted
+        package = self._load_remoterunner()
+        self.assertEqual(REFRESH_UPDATED, self.test_obj.refresh_package(package))
+        self.assertListEqual(['1.0.1'], list(self.test_obj.get_releases_for_package('robotframework-remoterunner')))
+
+    def test_refresh_package_added(self):
+        package = self._load_remoterunner()
+        package['info']['name'] = 'remoterunner-new'
+        self.assertEqual(REFRESH_ADDED, self.test_obj.refresh_package(package))
+        package = self._load_remoterunner()
+        package['info']['name'] = 'remoterunner-new'
+        self.assertEqual(REFRESH_UNCHANGED, self.test_obj.refresh_package(package))
+        self.assertEqual('remoterunner-new', self.test_obj.get_package_by_name('remoterunner-new')['name'])
+
+    def test_get_package_metadata(self):
+        with open(os.path.join(self.resources_dir, 'robotframework.json'), 'r') as fp:
+            expected = json.load(fp)
+        actual_value = self.test_obj.get_package_metadata('RobotFramework')
+        self.assertEqual(expected['info']['classifiers'], actual_value['info']['classifiers'])
+        self.assertEqual(expected['info']['project_urls'], dict(actual_value['info']['project_urls']))
+        self.assertEqual(expected['info']['summary'], actual_value['info']['summary'])
+        self.assertEqual(sorted(expected['releases'].keys()), sorted(actual_value['releases'].keys()))
+        release_file = actual_value['releases']['3.2b2'][0]
+        self.assertEqual(expected['releases']['3.2b2'][0]['filename'], release_file['filename'])
+        self.assertNotIn('package_id', release_file)
+        self.assertIs(expected['releases']['3.2b2'][0]['has_sig'], release_file['has_sig'])
+        self.assertEqual([], actual_value['urls'])
+        self.assertIsNone(self.test_obj.get_package_metadata('missing-package'))
+
+    def test_release_summary(self):
+        # The fixture only has files for 3.2b2 and 3.2rc1, of which the release candidate is the newer under PEP 440
+        expected_value = {
+            'latest_version': '3.2rc1',
+            'first_upload_time': '2020-02-14T10:16:11',
+            'last_upload_time': '2020-04-03T18:49:33',
+            'release_count': 2,
+            'file_count': 4,
+            'total_size': 613098 + 647126 + 609083 + 642901,
+            'has_wheel': True,
+        }
+        self.assertDictContainsSubset(expected_value, self.test_obj.get_release_summary('robotframework'))
+        self.assertIsNone(self.test_obj.get_release_summary('missing-package'))
+        summaries = list(self.test_obj.iter_release_summaries())
+        # Oldest last upload first
+        self.assertListEqual(['robotframework-remoterunner', 'robotframework'], [x['name'] for x in summaries])
+
+        # Databases created before the summary table existed are summarised when opened
+        self.test_obj._execute_write('DROP TABLE package_release_summary')
+        self.test_obj.close()
+        self.test_obj = PyPiAnalyserSqliteHelper(self.db_name)
+        self.assertDictContainsSubset(expected_value, self.test_obj.get_release_summary('robotframework'))
+
+        # A final release is newer than its release candidates
+        with open(os.path.join(self.resources_dir, 'robotframework.json'), 'r') as fp:
+            final_release = json.load(fp)
+        final_release['info']['name'] = 'robotframework-final'
+        final_release['releases']['3.2'] = final_release['releases']['3.2b2']
+        self.test_obj.commit_package_to_db(final_release)
+        self.assertEqual('3.2', self.test_obj.get_release_summary('robotframework-final')['latest_version'])
+
+    def test_compress_descriptions(self):
+        expected_description = self.test_obj.get_package_by_name('robotframework')['description']
+        # Enabling compression on an existing database moves the descriptions into the package_descriptions table
+        self.test_obj.close()
+        self.test_obj = PyPiAnalyserSqliteHelper(self.db_name, compress_descriptions=True, enable_search_index=True)
+        package_row = next(x for x in self.test_obj.iter_packages() if x['name'] == 'robotframework')
+        self.assertIsNone(package_row['description'])
+        self.assertEqual(expected_description, self.test_obj.get_package_by_name('robotframework')['description'])
+        self.assertListEqual(['robotframework'],
+                             [x['name'] for x in self.test_obj.search_packages('acceptance testin')])
+
+        for i in range(20):
+            with open(os.path.join(self.resources_dir, 'robotframework-remoterunner.json'), 'r') as fp:
+                new_package = json.load(fp)
+            new_package['info']['name'] = 'remoterunner-{}'.format(i)
+            self.test_obj.commit_package_to_db(new_package)
+        # The zlib of Python 2 can't use a dictionary, so none is trained there unless zstandard is installed
+        self.assertEqual(DEFAULT_CODEC == CODEC_ZSTD or ZLIB_DICTIONARY_SUPPORTED,
+                         self.test_obj.ensure_description_dictionary(min_samples=20))
+        self.assertEqual(0, self.test_obj.recompress_descriptions())
+        self.assertEqual(expected_description, self.test_obj.get_package_description('robotframework'))
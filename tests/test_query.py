@@ -0,0 +1,95 @@
+import copy
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+from pypianalyser.query import PackageQueries, write_rows, QUERY_COLUMNS
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        self.metadata = {}
+        for name in ['robotframework', 'robotframework-remoterunner']:
+            with open(os.path.join(resources_dir, '{}.json'.format(name)), 'r') as fp:
+                self.metadata[name] = json.load(fp)
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _create_db(self, **kwargs):
+        db_path = os.path.join(self.temp_dir, 'test.sqlite')
+        db_helper = PyPiAnalyserSqliteHelper(db_path, **kwargs)
+        remoterunner = copy.deepcopy(self.metadata['robotframework-remoterunner'])
+        remoterunner['info']['requires_dist'] = ['Robotframework (>=3.0)', "robotframework-lint ; extra == 'lint'"]
+        db_helper.commit_package_to_db(remoterunner)
+        db_helper.commit_package_to_db(copy.deepcopy(self.metadata['robotframework']))
+        db_helper.close()
+        return PackageQueries(db_path)
+
+    def _query(self, queries, query_type, term):
+        return [dict(zip(QUERY_COLUMNS[query_type], x)) for x in queries.run(query_type, term)]
+
+    def test_package_info(self):
+        queries = self._create_db(compress_descriptions=True)
+        try:
+            rows = self._query(queries, 'info', 'RobotFramework')
+            self.assertEqual(1, len(rows))
+            self.assertEqual('robotframework', rows[0]['name'])
+            self.assertEqual(self.metadata['robotframework']['info']['version'], rows[0]['version'])
+            self.assertTrue(rows[0]['description'])
+            self.assertEqual([], self._query(queries, 'info', 'missing-package'))
+        finally:
+            queries.close()
+
+    def test_releases_and_classifiers(self):
+        queries = self._create_db()
+        try:
+            releases = self._query(queries, 'releases', 'robotframework')
+            self.assertEqual(sorted(self.metadata['robotframework']['releases'].keys()),
+                             sorted(set(x['version'] for x in releases)))
+            classifiers = self._query(queries, 'classifiers', 'robotframework')
+            self.assertEqual(sorted(self.metadata['robotframework']['info']['classifiers']),
+                             [x['classifier'] for x in classifiers])
+        finally:
+            queries.close()
+
+    def test_reverse_dependencies(self):
+        queries = self._create_db()
+        try:
+            self.assertEqual([{'name': 'robotframework', 'required_by': 'robotframework-remoterunner',
+                               'version': self.metadata['robotframework-remoterunner']['info']['version']}],
+                             self._query(queries, 'rdeps', 'robotframework'))
+            # Partial matches of the name are not dependencies
+            self.assertEqual([], self._query(queries, 'rdeps', 'robot'))
+            self.assertEqual(1, len(self._query(queries, 'rdeps', 'robotframework_lint')))
+        finally:
+            queries.close()
+
+    def test_packages_with_classifier(self):
+        queries = self._create_db()
+        try:
+            rows = self._query(queries, 'classifier', 'License :: OSI Approved')
+            self.assertEqual(['robotframework', 'robotframework-remoterunner'], [x['name'] for x in rows])
+            rows = self._query(queries, 'classifier', 'Framework :: Robot Framework')
+            self.assertEqual(['robotframework'], [x['name'] for x in rows])
+            self.assertEqual([], self._query(queries, 'classifier', 'License :: OSI'))
+        finally:
+            queries.close()
+
+    def test_write_rows(self):
+        rows = [(u'pack-a', u'1.0', u'A\tpackage\nsummary'), (u'pack-b', None, None)]
+        columns = ['name', 'version', 'summary']
+        fp = io.StringIO()
+        self.assertEqual(2, write_rows(rows, columns, 'tsv', fp))
+        self.assertEqual(u'name\tversion\tsummary\npack-a\t1.0\tA\\tpackage\\nsummary\npack-b\t\t\n', fp.getvalue())
+        fp = io.StringIO()
+        write_rows(rows, columns, 'jsonl', fp)
+        lines = fp.getvalue().splitlines()
+        self.assertEqual({'name': 'pack-b', 'version': None, 'summary': None}, json.loads(lines[1]))
@@ -0,0 +1,50 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+from pypianalyser.release_stats import get_release_stats, summarise_release_stats, top_packages, np
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestReleaseStats(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_helper = PyPiAnalyserSqliteHelper(os.path.join(self.temp_dir, 'db.sqlite'))
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        for file_name in ['robotframework.json', 'robotframework-remoterunner.json']:
+            with open(os.path.join(resources_dir, file_name), 'r') as fp:
+                self.db_helper.commit_package_to_db(json.load(fp))
+
+    def tearDown(self):
+        self.db_helper.close()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_get_release_stats(self):
+        stats = get_release_stats(self.db_helper, now=datetime(2020, 1, 1), batch_size=2)
+        by_name = {name: i for i, name in enumerate(stats['name'])}
+        robot = by_name['robotframework']
+        remoterunner = by_name['robotframework-remoterunner']
+
+        self.assertEqual(4, stats['file_count'][robot])
+        self.assertEqual(2, stats['release_count'][robot])
+        self.assertEqual(1, stats['file_count'][remoterunner])
+        self.assertEqual(1, stats['release_count'][remoterunner])
+        self.assertAlmostEqual(49.36, stats['mean_days_between_releases'][robot], places=2)
+        self.assertTrue(math.isnan(stats['mean_days_between_releases'][remoterunner]))
+        self.assertEqual(stats['wheel_count'][robot] / float(stats['wheel_count'][robot] + stats['sdist_count'][robot]),
+                         stats['wheel_ratio'][robot])
+
+    def test_summarise_and_rank(self):
+        stats = get_release_stats(self.db_helper)
+        summary = summarise_release_stats(stats)
+        self.assertEqual(2, summary['packages'])
+        self.assertEqual(5, summary['release_files'])
+        self.assertEqual(3, summary['releases'])
+        self.assertEqual('robotframework', stats['name'][top_packages(stats, 'file_count', 1)[0]])
+        self.assertEqual('robotframework', stats['name'][top_packages(stats, 'mean_days_between_releases', 1)[0]])
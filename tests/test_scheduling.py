@@ -0,0 +1,61 @@
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+from pypianalyser.scheduling import create_scheduler, StalenessScheduler, SCHEDULE_ALPHABETICAL, \
+    SCHEDULE_DOWNLOADS, SCHEDULE_FAN_IN
+from pypianalyser.sql_queries import UPSERT_PACKAGE_SYNC_STATE_SQL
+
+
+def _package(name, requires_dist=None):
+    info = dict(author='', author_email='', bugtrack_url=None, description='', description_content_type='',
+                docs_url=None, download_url='', home_page='', keywords='', license='', maintainer='',
+                maintainer_email='', package_url='', platform='', project_url='', project_urls=None, release_url='',
+                requires_dist=requires_dist, requires_python='', summary='', version='1.0', name=name, classifiers=[])
+    return {'info': info, 'releases': {}}
+
+
+class TestScheduling(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = PyPiAnalyserSqliteHelper(os.path.join(self.temp_dir, 'db.sqlite'))
+        self.db.commit_package_to_db(_package('app', ['requests (>=2.0)', 'six']))
+        self.db.commit_package_to_db(_package('lib', ['requests']))
+        self.db.commit_package_to_db(_package('requests', ['urllib3']))
+        self.package_names = set(['app', 'lib', 'requests', 'six', 'urllib3', 'zzz'])
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_alphabetical(self):
+        self.assertListEqual(sorted(self.package_names),
+                             create_scheduler(SCHEDULE_ALPHABETICAL).order(self.package_names, self.db))
+
+    def test_staleness(self):
+        package_ids = dict((x, self.db.get_package_id(x)) for x in ['app', 'lib', 'requests'])
+        self.db._execute_write(UPSERT_PACKAGE_SYNC_STATE_SQL, (package_ids['app'], 'hash', '2024-01-03T00:00:00.5'))
+        self.db._execute_write(UPSERT_PACKAGE_SYNC_STATE_SQL, (package_ids['lib'], 'hash', '2024-01-01T00:00:00'))
+        scheduler = StalenessScheduler(now=datetime(2024, 1, 4))
+        # Packages never refreshed (requests) or not in the database come first, then the least recently refreshed
+        self.assertListEqual(['requests', 'six', 'urllib3', 'zzz', 'lib', 'app'],
+                             scheduler.order(self.package_names, self.db))
+
+    def test_downloads(self):
+        downloads_file = os.path.join(self.temp_dir, 'downloads.csv')
+        with open(downloads_file, 'w') as fp:
+            fp.write('project,downloads\nsix,500\nRequests,900\nlib,10\nnot-listed,1000\n')
+        scheduler = create_scheduler(SCHEDULE_DOWNLOADS, downloads_file)
+        self.assertListEqual(['requests', 'six', 'lib', 'app', 'urllib3', 'zzz'],
+                             scheduler.order(self.package_names, self.db))
+        self.assertRaises(ValueError, create_scheduler, SCHEDULE_DOWNLOADS)
+
+    def test_fan_in(self):
+        self.assertListEqual(['requests', 'six', 'urllib3', 'app', 'lib', 'zzz'],
+                             create_scheduler(SCHEDULE_FAN_IN).order(self.package_names, self.db))
+
+    def test_unknown_schedule(self):
+        self.assertRaises(ValueError, create_scheduler, 'random')
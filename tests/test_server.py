@@ -0,0 +1,96 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from mock import patch
+import six.moves.urllib as urllib
+from pypianalyser.exceptions import Exception404
+from pypianalyser.pypi_sqlite_helper import PyPiAnalyserSqliteHelper
+from pypianalyser.server import LRUCache, MetadataService, create_http_server
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(2, len(cache))
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class TestMetadataService(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+        self.metadata = {}
+        for name in ['robotframework', 'robotframework-remoterunner']:
+            with open(os.path.join(resources_dir, '{}.json'.format(name)), 'r') as fp:
+                self.metadata[name] = json.load(fp)
+        self.db_helper = PyPiAnalyserSqliteHelper(os.path.join(self.temp_dir, 'test.sqlite'))
+        self.db_helper.commit_package_to_db(copy.deepcopy(self.metadata['robotframework']))
+        self.service = MetadataService(self.db_helper, cache_size=10)
+
+    def tearDown(self):
+        self.db_helper.close()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_database_then_cache(self):
+        response, source = self.service.get_response('RobotFramework')
+        self.assertEqual('database', source)
+        self.assertEqual('3.1.2', json.loads(response.decode('utf-8'))['info']['version'])
+        self.assertEqual((response, 'cache'), self.service.get_response('robotframework'))
+
+    def test_fetches_missing_package(self):
+        upstream = copy.deepcopy(self.metadata['robotframework-remoterunner'])
+        with patch('pypianalyser.server.get_metadata_for_package', return_value=upstream) as mock_get:
+            response, source = self.service.get_response('robotframework-remoterunner')
+            self.assertEqual('upstream', source)
+            # Stored, so it is served from the database once evicted from the cache
+            self.service.cache = LRUCache(10)
+            self.assertEqual('database', self.service.get_response('robotframework-remoterunner')[1])
+        self.assertEqual(1, mock_get.call_count)
+        self.assertEqual(self.metadata['robotframework-remoterunner']['info']['classifiers'],
+                         json.loads(response.decode('utf-8'))['info']['classifiers'])
+
+    def test_not_found(self):
+        with patch('pypianalyser.server.get_metadata_for_package', side_effect=Exception404('url')):
+            status, _, body, _ = self.service.handle_request('/pypi/missing-package/json')
+        self.assertEqual(404, status)
+        self.assertEqual(404, self.service.handle_request('/simple/')[0])
+        self.service.fetch_missing = False
+        self.assertEqual((None, 'database'), self.service.get_response('missing-package'))
+
+    def test_upstream_error(self):
+        with patch('pypianalyser.server.get_metadata_for_package', side_effect=Exception('HTTP Error: 503')):
+            status, _, _, _ = self.service.handle_request('/pypi/missing-package/json')
+        self.assertEqual(502, status)
+
+    def test_http_server(self):
+        server = create_http_server(self.service, '127.0.0.1', 0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}/pypi/robotframework/json'.format(server.server_address[1])
+            response = urllib.request.urlopen(url)
+            self.assertEqual('MISS', response.headers['X-Cache'])
+            self.assertEqual('robotframework', json.loads(response.read().decode('utf-8'))['info']['name'])
+            self.assertEqual('HIT', urllib.request.urlopen(url).headers['X-Cache'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
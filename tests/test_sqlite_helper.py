@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from mock import patch
+from pypianalyser.sqlite_helper import SQLiteHelper, ReadOnlyConnectionPool, connect_read_only
+
+
+class TestSQLiteHelper(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'db.sqlite')
+        self.test_obj = SQLiteHelper(self.db_path, read_pool_size=2)
+        self.test_obj._execute_write('CREATE TABLE items (id integer PRIMARY KEY, name text)')
+        self.test_obj._execute_write('INSERT INTO items(name) VALUES (?)', ('a',))
+
+    def tearDown(self):
+        self.test_obj.close()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_read_own_writes(self):
+        rows = self.test_obj._execute_read('SELECT name FROM items')
+        self.assertListEqual([('a',)], rows)
+
+    def test_read_own_writes_while_another_thread_writes(self):
+        # The worker only commits on its own once its queue is empty, which it never is while the other thread writes
+        stop = threading.Event()
+
+        def write():
+            while not stop.is_set():
+                self.test_obj._execute_write('INSERT INTO items(name) VALUES (?)', ('other',))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for i in range(20):
+                name = 'mine-{}'.format(i)
+                self.test_obj._execute_write('INSERT INTO items(name) VALUES (?)', (name,))
+                self.test_obj.flush()
+                with self.test_obj.read_pool.connection() as conn:
+                    rows = conn.execute('SELECT name FROM items WHERE name=?', (name,)).fetchall()
+                self.assertListEqual([(name,)], rows)
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_wal_enabled(self):
+        rows = self.test_obj._execute_read('PRAGMA journal_mode')
+        self.assertEqual('wal', rows[0][0])
+
+    def test_read_connections_are_read_only(self):
+        self.test_obj.flush()
+        with self.test_obj.read_pool.connection() as conn:
+            self.assertRaises(sqlite3.OperationalError, conn.execute, 'INSERT INTO items(name) VALUES (?)', ('b',))
+
+    def test_iter_read_batches(self):
+        for name in 'bcde':
+            self.test_obj._execute_write('INSERT INTO items(name) VALUES (?)', (name,))
+        row_factory = self.test_obj._build_row_factory('dict', ['id', 'name'])
+        rows = list(self.test_obj._iter_read('SELECT id, name FROM items ORDER BY id', batch_size=2,
+                                             row_factory=row_factory))
+        self.assertListEqual(['a', 'b', 'c', 'd', 'e'], [x['name'] for x in rows])
+
+
+class TestReadOnlyConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'db.sqlite')
+        sqlite3.connect(self.db_path).close()
+
+    def tearDown(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_connect_read_only_without_uri_support(self):
+        # Python 2's sqlite3 module has no uri argument
+        with patch('pypianalyser.sqlite_helper.six.PY2', True):
+            conn = connect_read_only(self.db_path)
+            try:
+                self.assertRaises(sqlite3.OperationalError, conn.execute, 'CREATE TABLE items (id integer)')
+            finally:
+                conn.close()
+            missing_path = os.path.join(self.temp_dir, 'missing.sqlite')
+            self.assertRaises(sqlite3.OperationalError, connect_read_only, missing_path)
+            self.assertFalse(os.path.exists(missing_path))
+
+    def test_connections_are_reused(self):
+        pool = ReadOnlyConnectionPool(self.db_path, pool_size=2)
+        conn1 = pool.acquire()
+        conn2 = pool.acquire()
+        self.assertIsNot(conn1, conn2)
+        pool.release(conn1)
+        self.assertIs(conn1, pool.acquire())
+        pool.release(conn1)
+        pool.release(conn2)
+        pool.close()
+
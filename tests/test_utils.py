@@ -5,7 +5,9 @@ import shutil
 import tempfile
 import unittest
 from pypianalyser.utils import order_dict_by_key_name, read_file_lines_into_list, write_list_lines_into_file, \
-    append_line_to_file, remove_unknown_keys_from_dict, normalize_package_name, order_release_names_fallback
+    append_line_to_file, remove_unknown_keys_from_dict, normalize_package_name, order_release_names, \
+    build_search_query, get_shard_index, parse_requirement_names, split_requires_dist, split_project_urls, \
+    summarise_releases
 
 
 class TestUtils(unittest.TestCase):
@@ -68,28 +70,51 @@ class TestUtils(unittest.TestCase):
         actual_result = normalize_package_name(input)
         self.assertEqual(expected_result, actual_result)
 
-    def test_order_release_names_fallback(self):
-        inp = {
-            '0.0.1':
-                [{
-                    'filename': 'robotframework-difflibrary-0.0.1.tar.gz',
-                    'upload_time': '2016-02-19T13:08:33',
-                    'upload_time_iso_8601': '2016-02-19T13:08:33.988065Z'
-                }],
-            '5.0.1': [],
-            '0.1.0':
-                [{
-                    'filename': 'robotframework-difflibrary-0.1.0.tar.gz',
-                    'upload_time': '2016-11-01T22:36:38',
-                    'upload_time_iso_8601': '2016-11-01T22:36:38.451004Z',
-                }],
-            '0.1dev':
-                [{
-                    'filename': 'robotframework-difflibrary-0.1dev.tar.gz',
-                    'upload_time': '2011-10-05T05:58:49',
-                    'upload_time_iso_8601': '2011-10-05T05:58:49.218714Z',
-                }]
+    def test_order_release_names(self):
+        inp = dict((x, []) for x in ['1.9', '2.0rc1', 'not a version', '2.0', '1.10', '2.0.post1', '2.0b2'])
+        expected_value = ['2.0.post1', '2.0', '2.0rc1', '2.0b2', '1.10', '1.9', 'not a version']
+        self.assertListEqual(expected_value, order_release_names(inp))
+
+    def test_get_shard_index(self):
+        actual_value = [get_shard_index(x, 4) for x in ['requests', 'numpy', 'robotframework', 'six']]
+        self.assertListEqual([1, 2, 0, 3], actual_value)
+
+    def test_parse_requirement_names(self):
+        actual_value = parse_requirement_names("requests (>=2.0, <3), six ; extra == 'test', PyYAML>=5, six (>=1.5)")
+        self.assertListEqual(['requests', 'six', 'pyyaml'], actual_value)
+        self.assertListEqual([], parse_requirement_names(None))
+
+    def test_summarise_releases(self):
+        releases = {
+            '0.9': [{'upload_time': '2018-01-01T00:00:00', 'size': 5, 'packagetype': 'sdist'}],
+            '0.10': [{'upload_time': '2018-06-01T00:00:00', 'size': 7, 'packagetype': 'sdist'},
+                     {'upload_time': '2018-06-02T00:00:00', 'size': None, 'packagetype': 'bdist_egg'}],
+            '1.0': [],
         }
-        expected_value = ['0.1.0', '0.0.1', '0.1dev']
-        actual_value = order_release_names_fallback(inp)
-        self.assertListEqual(expected_value, actual_value)
\ No newline at end of file
+        actual_value = summarise_releases(releases)
+        self.assertEqual('0.10', actual_value['latest_version'])
+        self.assertEqual('2018-01-01T00:00:00', actual_value['first_upload_time'])
+        self.assertEqual('2018-06-02T00:00:00', actual_value['last_upload_time'])
+        self.assertEqual(2, actual_value['release_count'])
+        self.assertEqual(3, actual_value['file_count'])
+        self.assertEqual(12, actual_value['total_size'])
+        self.assertFalse(actual_value['has_wheel'])
+        self.assertIsNone(summarise_releases(None)['latest_version'])
+        # A final release is newer than its release candidates
+        releases['1.0rc1'] = releases['0.10']
+        releases['1.0'] = releases['0.9']
+        self.assertEqual('1.0', summarise_releases(releases)['latest_version'])
+
+    def test_split_requires_dist(self):
+        actual_value = split_requires_dist("requests (>=2.0, <3), six ; extra == 'test'")
+        self.assertListEqual(['requests (>=2.0, <3)', "six ; extra == 'test'"], actual_value)
+        self.assertIsNone(split_requires_dist(''))
+
+    def test_split_project_urls(self):
+        actual_value = split_project_urls('Homepage: http://a.org, Source: https://github.com/a/a')
+        self.assertEqual([('Homepage', 'http://a.org'), ('Source', 'https://github.com/a/a')], list(actual_value.items()))
+        self.assertIsNone(split_project_urls(None))
+
+    def test_build_search_query(self):
+        actual_value = build_search_query('robotframework-lib  "remote"')
+        self.assertEqual('"robotframework-lib" """remote"""', actual_value)